@@ -2,17 +2,20 @@
 Chronopotentiometry plotting functions
 """
 
-import eclabfiles as ecf
-
 import glob
 import numpy as np
-from colour import Color
-import matplotlib.pyplot as plt
+from . import cache, export, mpr
+from .ragged import CycleTable
+from .decimate import output_dpi, axes_pixels, minmax_decimate, lttb_decimate
+from ._lazy import lazy_import
+
+# BioLogic and plotting dependencies are imported on first use
+ecf = lazy_import("eclabfiles")
+pd = lazy_import("pandas")
+colour = lazy_import("colour")
+plt = lazy_import("matplotlib.pyplot")
+mcollections = lazy_import("matplotlib.collections")
 
-from matplotlib.pyplot import rc
-rc("text", usetex=True)
-rc("font", **{"family":"sans-serif","sans-serif":["Helvetica"]},size="14")
-rc("text.latex",preamble=r"\usepackage{sfmath}")
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -41,7 +44,7 @@ def import_file(path, fn, header_rows):
         Each column in file returned as a separate list
 
     '''
-    return np.loadtxt(path+fn, unpack=True, dtype=float, skiprows=header_rows)
+    return cache.loadtxt(path+fn, skiprows=header_rows)
 
 #------------------------------------------------------------------------------
 def import_dir(path, filetype=None):
@@ -94,8 +97,8 @@ def gradient_gen(start_hex, end_hex, num):
         Hex codes, will need to use .hex() to retrieve as string
 
     '''
-    start_color = Color(start_hex)
-    end_color = Color(end_hex)
+    start_color = colour.Color(start_hex)
+    end_color = colour.Color(end_hex)
     
     colors_list = list(start_color.range_to(end_color, num))
     
@@ -158,26 +161,38 @@ def labelprefix(limit):
     return prefix
 
 #------------------------------------------------------------------------------
-def save_fig(plot, path, fn):
+def save_fig(plot, path, fn, fmt="png", profile="print", background=False):
     '''
-    Save figure as a .png file
+    Save figure as a .png, .svg or .pdf file
 
     Parameters
     ----------
     plot : figure
-        Name of plot
+        Name of plot, or axes returned by a plotting function
     path : str
         File directory path
     fn : str
         File name to save to
+    fmt : str, optional
+        File format, "png", "svg" or "pdf". Dense data layers are rasterized
+        in svg/pdf output. The default is "png".
+    profile : str or float, optional
+        "screen" (100 dpi), "preview" (300 dpi), "print" (1000 dpi) or a dpi
+        value. The default is "print".
+    background : bool, optional
+        Set to True to write the file in a background thread, use 
+        export.wait_saves() to wait for it. The default is False.
 
     Returns
     -------
-    None
+    bbox : Bbox or Future
+        Bounding box used, pass to export.save_figure to save other formats
+        of the same figure without another layout pass
 
     '''
-    save = path + fn + ".png"
-    plot.savefig(save, bbox_inches="tight", pad_inches=0.2, dpi=1000)
+    if background == True:
+        return export.save_async(plot, path, fn, fmt, profile)
+    return export.save_figure(plot, path, fn, fmt, profile)
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -190,7 +205,7 @@ Functions in this section:
 
 
 #------------------------------------------------------------------------------
-def import_biologic_CP(pos, neg, path):
+def import_biologic_CP(pos, neg, path, columns=None):
     '''
     Import CP data from biologic .mpr file
 
@@ -202,6 +217,9 @@ def import_biologic_CP(pos, neg, path):
         File name of positive CP data
     neg : str
         File name of negative CP data
+    columns : list (str), optional
+        Only read these columns with the native .mpr reader, e.g. 
+        ["time", "<Ewe>"] for plot_CP. The default is None (all columns).
 
     Returns
     -------
@@ -214,13 +232,17 @@ def import_biologic_CP(pos, neg, path):
     pfilepath = path + pos + ".mpr"
     nfilepath = path + neg + ".mpr"
         
-    pos_CP = ecf.to_df(pfilepath)
-    neg_CP = ecf.to_df(nfilepath)
+    if columns is not None:
+        pos_CP = pd.DataFrame(mpr.load_mpr(pfilepath, columns))
+        neg_CP = pd.DataFrame(mpr.load_mpr(nfilepath, columns))
+    else:
+        pos_CP = ecf.to_df(pfilepath)
+        neg_CP = ecf.to_df(nfilepath)
         
     return pos_CP, neg_CP
 
 #------------------------------------------------------------------------------
-def sep_CP_cycles(pos_df, neg_df, cycle_pts):
+def sep_CP_cycles(pos_df, neg_df, cycle_pts=None, by=None):
     '''
     Separates CP data by cycle
 
@@ -230,61 +252,160 @@ def sep_CP_cycles(pos_df, neg_df, cycle_pts):
         Full positive CP dataset
     neg_df : dataframe
         Full positive CP dataset
-    cycle_pts : int
-        Number of data points per EIS cycle
+    cycle_pts : int, optional
+        Number of data points per CP cycle, incomplete last cycles are
+        dropped. The default is None (cycle boundaries are detected).
+    by : str, optional
+        Column used to detect cycle boundaries, see ragged.cycle_offsets. The
+        default is None ("half cycle" if present, otherwise current sign
+        changes).
 
     Returns
     -------
-    CP_cycles_pos : dict
-        Dictionary of positive CP data where each cycle is a separate entry
-    CP_cycles_neg : dict
-        Dictionary of negative CP data where each cycle is a separate entry
+    CP_cycles_pos : CycleTable
+        Positive CP data indexed by cycle
+    CP_cycles_neg : CycleTable
+        Negative CP data indexed by cycle
     num_cycles_pos : int
         Total number of positive CP cycles 
     num_cycles_neg : int
         Total number of negative CP cycles
 
     '''
-    num_rows_pos = len(pos_df)
-    num_rows_neg = len(neg_df)
-        
-    num_cycles_pos = int(num_rows_pos/cycle_pts)
-    num_cycles_neg = int(num_rows_neg/cycle_pts)
-    
-    CP_cycles_pos = {}
-    CP_cycles_neg = {}
-    
-    for i in range(0, num_cycles_pos):
-        CP_cycles_pos[i] = pos_df.truncate(before=0 + (cycle_pts*i), after=(cycle_pts-1) + (cycle_pts*i))
+    if cycle_pts is None:
+        CP_cycles_pos = CycleTable.from_columns(pos_df, by)
+        CP_cycles_neg = CycleTable.from_columns(neg_df, by)
+    else:
+        CP_cycles_pos = CycleTable.from_cycle_pts(pos_df, cycle_pts)
+        CP_cycles_neg = CycleTable.from_cycle_pts(neg_df, cycle_pts)
         
-    for i in range(0, num_cycles_neg):
-        CP_cycles_neg[i] = neg_df.truncate(before=0 + (cycle_pts*i), after=(cycle_pts-1) + (cycle_pts*i))
+    num_cycles_pos = len(CP_cycles_pos)
+    num_cycles_neg = len(CP_cycles_neg)
     
     print("Number of positive cycles: " + str(num_cycles_pos))
     print("Number of negative cycles: " + str(num_cycles_neg))
     
     return CP_cycles_pos, CP_cycles_neg, num_cycles_pos, num_cycles_neg
 
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CP METRICS 
+Functions in this section:
+    - cycle_metrics '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# fields of the cycle_metrics result
+metric_fields = [("cycle", "<i8"), ("points", "<i8"), ("start", "<f8"), ("duration", "<f8"),
+                 ("E_max", "<f8"), ("E_min", "<f8"), ("E_mean", "<f8"), ("E_plateau", "<f8"),
+                 ("dE_plateau", "<f8"), ("t_cutoff", "<f8"), ("capacity", "<f8"),
+                 ("cum_capacity", "<f8")]
+
+# axis labels of the cycle_metrics fields
+metric_labels = {"points": "Points", "start": "Start time (s)", "duration": "Duration (s)",
+                 "E_max": r"E$_{max}$ (V)", "E_min": r"E$_{min}$ (V)", "E_mean": r"E$_{mean}$ (V)",
+                 "E_plateau": r"E$_{plateau}$ (V)", "dE_plateau": r"$\Delta$E$_{plateau}$ (V)",
+                 "t_cutoff": "Time to cutoff (s)", "capacity": "Capacity (mAh)",
+                 "cum_capacity": "Cumulative capacity (mAh)"}
+
+#------------------------------------------------------------------------------
+def cycle_metrics(cycles, plateau=0.5, cutoff=None, current="I"):
+    '''
+    Calculates potential and capacity metrics of every half cycle
+
+    All cycles are processed together with reductions over the cycle
+    offsets, without a Python loop over cycles.
+
+    Parameters
+    ----------
+    cycles : CycleTable
+        CP data by cycle from sep_CP_cycles, with "time" and "<Ewe>" columns
+    plateau : float, optional
+        Fraction at the end of each half cycle averaged for the plateau 
+        potential. The default is 0.5.
+    cutoff : float, optional
+        Cutoff potential in V, time to cutoff is the time until |E| first 
+        reaches |cutoff|. The default is None (not calculated).
+    current : str, optional
+        Current column in mA used for the capacity. The default is "I" (NaN
+        if the column was not loaded).
+
+    Returns
+    -------
+    metrics : structured array
+        One row per half cycle with the fields of metric_fields: cycle 
+        number, number of points, start time and duration (s), maximum, 
+        minimum, mean and plateau potential (V), plateau change since the
+        first cycle (V), time to cutoff (s), capacity and cumulative
+        absolute capacity (mAh). Values of empty cycles are NaN.
+
+    '''
+    num = len(cycles)
+    starts, lengths = cycles.offsets[:-1], cycles.lengths
+    ends = starts + lengths
+    full = lengths > 0
+    time = np.asarray(cycles.columns["time"], dtype=np.float64)
+    E = cycles.columns["<Ewe>"]
+
+    metrics = np.zeros(num, dtype=metric_fields)
+    metrics["cycle"] = np.arange(1, num + 1)
+    metrics["points"] = lengths
+    metrics["start"] = cycles.reduce("time", "first")
+    metrics["duration"] = cycles.reduce("time", "last") - metrics["start"]
+    metrics["E_max"] = cycles.reduce("<Ewe>", "max")
+    metrics["E_min"] = cycles.reduce("<Ewe>", "min")
+    metrics["E_mean"] = cycles.reduce("<Ewe>", "mean")
+
+    # plateau mean from a running sum, over the last fraction of each cycle
+    total = np.concatenate(([0], np.cumsum(E, dtype=np.float64)))
+    first = starts + np.minimum((lengths * (1 - plateau)).astype(np.int64), np.maximum(lengths - 1, 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        metrics["E_plateau"] = np.where(full, (total[ends] - total[first]) / (ends - first), np.nan)
+    metrics["dE_plateau"] = metrics["E_plateau"] - metrics["E_plateau"][np.argmax(full)]
+
+    # first row at or beyond the cutoff in each cycle
+    metrics["t_cutoff"] = np.nan
+    if cutoff is not None:
+        hits = np.flatnonzero(np.abs(E) >= abs(cutoff))
+        pos = np.searchsorted(hits, starts)
+        found = pos < len(hits)
+        found[found] = hits[pos[found]] < ends[found]
+        metrics["t_cutoff"][found] = time[hits[pos[found]]] - time[starts[found]]
+
+    # charge passed, I dt summed within each cycle
+    metrics["capacity"] = np.nan
+    if current in cycles.keys():
+        charge = np.zeros(len(time))
+        charge[:-1] = np.asarray(cycles.columns[current], dtype=np.float64)[:-1] * np.diff(time)
+        charge[ends[full] - 1] = 0
+        metrics["capacity"][full] = np.add.reduceat(charge, starts[full]) / 3600
+        metrics["capacity"][~full] = 0
+    metrics["cum_capacity"] = np.cumsum(np.abs(metrics["capacity"]))
+
+    return metrics
+
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 ''' CP PLOTTING 
 Functions in this section:
     - plot_CP
+    - plot_metrics
     - expt_info '''
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def plot_CP(pos, neg, num_cycles, x_lim=False, y_lim=False, start_hex=False, end_hex=False):
+def plot_CP(pos, neg, num_cycles, x_lim=False, y_lim=False, start_hex=False, end_hex=False,
+            decimate=False, method="minmax"):
     '''
     Generate plot of CP data
 
     Parameters
     ----------
-    pos : dict
-        Dictionary of positive CP data
-    neg : dict
-        Dictionary of negative CP data
+    pos : CycleTable or dict
+        Positive CP data by cycle, from sep_CP_cycles
+    neg : CycleTable or dict
+        Negative CP data by cycle, from sep_CP_cycles
     num_cycles : int
         Total number of EIS cycles
     x_lim : list (float), optional
@@ -295,6 +416,15 @@ def plot_CP(pos, neg, num_cycles, x_lim=False, y_lim=False, start_hex=False, end
         Hex code for initial gradient color, format "#000000". The default is False.
     end_hex : str, optional
         Hex code for final gradient color, format "#000000". The default is False.
+    decimate : bool, str or float, optional
+        Set to True to reduce each half cycle to the pixel resolution of the 
+        default save_fig profile ("print", 1000 dpi), or give the export
+        profile name or dpi the figure will be saved at (e.g. "screen"). The 
+        default is False.
+    method : str, optional
+        Decimation method, "minmax" keeps the min/max envelope of each pixel
+        column so voltage spikes are preserved, "lttb" keeps the largest 
+        triangles of each bucket. The default is "minmax".
 
     Returns
     -------
@@ -308,12 +438,21 @@ def plot_CP(pos, neg, num_cycles, x_lim=False, y_lim=False, start_hex=False, end
         start_hex = "#00C6BF"
     if end_hex == False:
         end_hex = "#B430C2"
-    g = list(Color(start_hex).range_to(Color(end_hex), num_cycles))
+    g = list(colour.Color(start_hex).range_to(colour.Color(end_hex), num_cycles))
+    
+    # columns with one row per cycle, zero-copy views for CycleTable input
+    if isinstance(pos, CycleTable):
+        pos_time, pos_E = pos["time"], pos["<Ewe>"]
+    else:
+        pos_time, pos_E = [pos[i]["time"] for i in range(num_cycles)], [pos[i]["<Ewe>"] for i in range(num_cycles)]
+    if isinstance(neg, CycleTable):
+        neg_time, neg_E = neg["time"], neg["<Ewe>"]
+    else:
+        neg_time, neg_E = [neg[i]["time"] for i in range(num_cycles)], [neg[i]["<Ewe>"] for i in range(num_cycles)]
     
-    # plot CP data
-    for i in range(num_cycles):
-        cp.plot(pos[i]["time"], pos[i]["<Ewe>"], color = g[i].hex)
-        cp.plot(neg[i]["time"], neg[i]["<Ewe>"], color = g[i].hex)
+    halves = [(pos_time[i], pos_E[i]) for i in range(num_cycles)] + \
+             [(neg_time[i], neg_E[i]) for i in range(num_cycles)]
+    colors = [g[i].hex for i in range(num_cycles)] * 2
     
     # set axis limits
     if x_lim != False:
@@ -321,11 +460,81 @@ def plot_CP(pos, neg, num_cycles, x_lim=False, y_lim=False, start_hex=False, end
     if y_lim != False:
         cp.set_ylim(y_lim)
     
+    # reduce each half cycle to the pixel resolution of the axes
+    if decimate is not False:
+        width, height = axes_pixels(cp, output_dpi(decimate))
+        if x_lim != False:
+            span = x_lim
+        else:
+            span = (min(np.min(t) for t, E in halves if len(t) > 0),
+                    max(np.max(t) for t, E in halves if len(t) > 0))
+        if method == "minmax":
+            halves = [minmax_decimate(t, E, span, width) for t, E in halves]
+        elif method == "lttb":
+            halves = [lttb_decimate(t, E, max(int(2 * width * (np.max(t) - np.min(t)) / (span[1] - span[0])), 3))
+                      if len(t) > 0 else (t, E) for t, E in halves]
+        else:
+            raise ValueError("unknown decimation method: " + str(method))
+    
+    # plot CP data, one collection for all cycles
+    lines = [np.column_stack((t, E)) for t, E in halves]
+    cp.add_collection(mcollections.LineCollection(lines, colors=colors))
+    cp.autoscale_view()
+    
     # set axis labels
     cp.set_xlabel("Time (s)", fontsize=16)
     cp.set_ylabel(r"E$_{we}$ (V)", fontsize=16)
     
     return(cp)
+
+#------------------------------------------------------------------------------
+def plot_metrics(pos_metrics, field, neg_metrics=None, color=False, neg_color=False, marker=False):
+    '''
+    Plot a half cycle metric vs cycle number
+
+    Parameters
+    ----------
+    pos_metrics : structured array
+        Metrics of the positive half cycles from cycle_metrics
+    field : str
+        Metric to plot, e.g. "E_plateau", see metric_fields
+    neg_metrics : structured array, optional
+        Metrics of the negative half cycles. The default is None.
+    color : str, optional
+        Hex code for positive data color, format "#000000". The default is False.
+    neg_color : str, optional
+        Hex code for negative data color, format "#000000". The default is False.
+    marker : str, optional
+        Plot marker shape. The default is False.
+
+    Returns
+    -------
+    ax : matplotlib axes
+        Plot of the metric vs cycle number
+
+    '''
+    fig, (ax)=plt.subplots(1, 1, figsize=(8,4))
+    
+    if color == False:
+        color = "#00C6BF"
+    if neg_color == False:
+        neg_color = "#B430C2"
+    if marker == False:
+        marker = "o"
+    
+    # plot data
+    ax.plot(pos_metrics["cycle"], pos_metrics[field], color=color, marker=marker, markersize="6",
+            label="Positive")
+    if neg_metrics is not None:
+        ax.plot(neg_metrics["cycle"], neg_metrics[field], color=neg_color, marker=marker,
+                markersize="6", label="Negative")
+        ax.legend(frameon=False, fontsize=12)
+    
+    # set axis labels 
+    ax.set_xlabel("Cycle Number", fontsize=16)
+    ax.set_ylabel(metric_labels.get(field, field), fontsize=16)
+    
+    return(ax)
  
 #------------------------------------------------------------------------------
 def expt_info(curr_dens, num_cycles):
@@ -0,0 +1,341 @@
+"""
+Distribution of relaxation times (DRT) functions for EIS series
+
+Each spectrum is described as a series resistance plus a continuous set of
+RC elements, Z(w) = R_inf + int gamma(ln tau) / (1 + j w tau) dln(tau). The
+DRT gamma is found by Tikhonov-regularized non-negative least squares on a
+log-spaced tau grid. The kernel only depends on the frequency grid, so it is
+built once and shared by every cycle.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .EIS import gradient_gen
+from ._lazy import lazy_import
+
+# plotting dependencies are imported on first use
+plt = lazy_import("matplotlib.pyplot")
+colors = lazy_import("matplotlib.colors")
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' DRT SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# relaxation times extend this many decades beyond the measured range
+tau_extend = 1
+
+# precomputed kernels, by frequency grid, tau grid and regularization
+_kernels = {}
+max_kernels = 32
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' DRT CALCULATION
+Functions in this section:
+    - tau_grid
+    - drt_kernel
+    - nnls_gram
+    - calc_DRT '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def tau_grid(freq, pts_per_decade=10):
+    '''
+    Log-spaced relaxation times covering a frequency range
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz
+    pts_per_decade : int, optional
+        Number of relaxation times per decade. The default is 10.
+
+    Returns
+    -------
+    tau : list (float)
+        Relaxation times in s, ascending
+
+    '''
+    w = 2 * np.pi * np.asarray(freq, dtype=float)
+    lo = np.log10(1 / w.max()) - tau_extend
+    hi = np.log10(1 / w.min()) + tau_extend
+    return np.logspace(lo, hi, int(np.ceil((hi - lo) * pts_per_decade)) + 1)
+
+#------------------------------------------------------------------------------
+def drt_kernel(freq, tau, lam):
+    '''
+    Builds the regularized DRT kernel of a frequency grid
+
+    Z(w) = R_inf + sum_k gamma_k dln(tau) / (1 + j w tau_k), fitted to real
+    and imaginary parts with a first-derivative Tikhonov penalty. Results
+    are cached, so all cycles on the same grid share one kernel.
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz
+    tau : list (float)
+        Relaxation times in s, log-spaced
+    lam : float
+        Regularization parameter
+
+    Returns
+    -------
+    A : list (float)
+        Kernel matrix, real parts stacked over imaginary parts, columns are
+        R_inf and each relaxation time
+    K : list (float)
+        Regularized normal matrix A^T A + lam L^T L
+
+    '''
+    freq = np.asarray(freq, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    key = (freq.tobytes(), tau.tobytes(), lam)
+    if key in _kernels:
+        return _kernels[key]
+
+    w = 2 * np.pi * freq
+    dln = np.log(tau[1] / tau[0])
+    wt = w[:, None] * tau[None, :]
+    A = np.zeros((2 * len(w), len(tau) + 1))
+    A[:len(w), 0] = 1
+    A[:len(w), 1:] = dln / (1 + wt**2)
+    A[len(w):, 1:] = -dln * wt / (1 + wt**2)
+
+    # first differences of gamma, R_inf is not regularized
+    L = np.zeros((len(tau) - 1, len(tau) + 1))
+    idx = np.arange(len(tau) - 1)
+    L[idx, idx + 1] = -1
+    L[idx, idx + 2] = 1
+    K = A.T @ A + lam * (L.T @ L)
+
+    if len(_kernels) >= max_kernels:
+        _kernels.pop(next(iter(_kernels)))
+    _kernels[key] = (A, K)
+    return A, K
+
+#------------------------------------------------------------------------------
+def nnls_gram(K, c, max_iter=None):
+    '''
+    Non-negative least squares from the normal equations
+
+    Minimizes x^T K x / 2 - c^T x subject to x >= 0 with the active set
+    method of Bro and de Jong (J. Chemometrics 11 (1997) 393), which only
+    needs K = A^T A and c = A^T b, so K can be shared between problems.
+
+    Parameters
+    ----------
+    K : list (float)
+        Symmetric positive definite normal matrix
+    c : list (float)
+        Right-hand side A^T b
+    max_iter : int, optional
+        Maximum number of outer iterations. The default is None (3 times
+        the number of unknowns).
+
+    Returns
+    -------
+    x : list (float)
+        Non-negative solution
+
+    '''
+    n = len(c)
+    if max_iter is None:
+        max_iter = 3 * n
+    tol = 10 * np.finfo(float).eps * np.abs(K).sum(axis=0).max() * n * max(np.abs(c).max(), 1)
+
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    # variables that failed to enter the passive set since x last changed
+    blocked = np.zeros(n, dtype=bool)
+    w = c.copy()
+    for it in range(max_iter):
+        free = ~passive & ~blocked & (w > tol)
+        if not free.any():
+            break
+        j = np.argmax(np.where(free, w, -np.inf))
+        passive[j] = True
+
+        s = np.zeros(n)
+        s[passive] = np.linalg.solve(K[np.ix_(passive, passive)], c[passive])
+        # step back until all passive values are positive, only variables
+        # with x > 0 limit the step
+        while (s[passive] <= 0).any():
+            neg = passive & (s <= 0) & (x > 0)
+            if not neg.any():
+                # only the new variable is not positive (rounding), drop it
+                passive[j] = False
+                blocked[j] = True
+                s = x
+                break
+            alpha = np.min(x[neg] / (x[neg] - s[neg]))
+            x = x + alpha * (s - x)
+            passive &= x > tol
+            x[~passive] = 0
+            s = np.zeros(n)
+            s[passive] = np.linalg.solve(K[np.ix_(passive, passive)], c[passive])
+        if s is not x:
+            blocked[:] = False
+        x = s
+        w = c - K @ x
+
+    return x
+
+#------------------------------------------------------------------------------
+def calc_DRT(freq, expt_re, expt_im, lam=1e-2, pts_per_decade=10, workers=None):
+    '''
+    Calculates the DRT of every EIS cycle
+
+    Parameters
+    ----------
+    freq : list (float)
+        Measurement frequencies in Hz, shared by all cycles (the exported
+        .txt files do not contain them)
+    expt_re : list (float)
+        Real values from observed dataset, one row per cycle, e.g. from
+        EIS.import_cycles
+    expt_im : list (float)
+        Imaginary values from observed dataset (-Z_imag), one row per cycle
+    lam : float, optional
+        Regularization parameter, larger values give smoother spectra. The
+        default is 1e-2.
+    pts_per_decade : int, optional
+        Number of relaxation times per decade. The default is 10.
+    workers : int, optional
+        Number of solver threads. The default is None (Python default).
+
+    Returns
+    -------
+    tau : list (float)
+        Relaxation times in s
+    gamma : list (float)
+        DRT values in ohm, one row per cycle
+    R_inf : list (float)
+        Series resistance of each cycle
+
+    '''
+    tau = tau_grid(freq, pts_per_decade)
+    A, K = drt_kernel(freq, tau, lam)
+    B = np.array([np.concatenate((np.asarray(expt_re[i], dtype=float),
+                                  -np.asarray(expt_im[i], dtype=float)))
+                  for i in range(len(expt_re))])
+    C = B @ A
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        X = np.array(list(pool.map(lambda c: nnls_gram(K, c), C)))
+
+    return tau, X[:, 1:], X[:, 0]
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' DRT PLOTTING
+Functions in this section:
+    - plot_DRT
+    - plot_DRT_map '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def plot_DRT(tau, gamma, cycles=None, start_hex=False, end_hex=False):
+    '''
+    Generate plot of DRT spectra of selected cycles
+
+    Parameters
+    ----------
+    tau : list (float)
+        Relaxation times in s
+    gamma : list (float)
+        DRT values, one row per cycle
+    cycles : list (int), optional
+        Indices of cycles to plot. The default is None (all cycles).
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+
+    Returns
+    -------
+    ax : matplotlib axes
+        Plot of gamma vs tau
+
+    '''
+    gamma = np.atleast_2d(gamma)
+    if cycles is None:
+        cycles = range(len(gamma))
+    cycles = list(cycles)
+
+    fig, (ax)=plt.subplots(1,figsize=(7,5))
+
+    # generate color gradient
+    if start_hex == False:
+        start_hex = "#00C6BF"
+    if end_hex == False:
+        end_hex = "#B430C2"
+    g = gradient_gen(start_hex, end_hex, len(cycles))
+
+    for i, c in enumerate(cycles):
+        ax.plot(tau, gamma[c], color=g[i].hex, linewidth=1.5, label="Cycle " + str(c + 1))
+
+    ax.set_xscale("log")
+    ax.set_xlim(tau[0], tau[-1])
+    ax.set_ylim(bottom=0)
+    ax.tick_params(axis="both", labelsize="14")
+
+    ax.set_xlabel("$\\tau$ (s)", fontsize=16)
+    ax.set_ylabel("$\\gamma$ ($\\Omega$)", fontsize=16)
+
+    return(ax)
+
+#------------------------------------------------------------------------------
+def plot_DRT_map(tau, gamma, cmap="viridis", log_scale=False):
+    '''
+    Generate heatmap of DRT spectra vs cycle number
+
+    Parameters
+    ----------
+    tau : list (float)
+        Relaxation times in s
+    gamma : list (float)
+        DRT values, one row per cycle
+    cmap : str, optional
+        Matplotlib colormap. The default is "viridis".
+    log_scale : bool, optional
+        Set to True for a logarithmic color scale. The default is False.
+
+    Returns
+    -------
+    ax : matplotlib axes
+        Heatmap with tau on the x-axis and cycle number on the y-axis
+
+    '''
+    gamma = np.atleast_2d(gamma)
+
+    fig, (ax)=plt.subplots(1,figsize=(7,5))
+
+    # cell edges halfway between grid points in log(tau) and cycle number
+    log_tau = np.log10(tau)
+    half = (log_tau[1] - log_tau[0]) / 2
+    x_edges = 10**np.concatenate(([log_tau[0] - half], log_tau + half))
+    y_edges = np.arange(len(gamma) + 1) + 0.5
+
+    norm = None
+    if log_scale:
+        positive = gamma[gamma > 0]
+        vmin = positive.max() * 1e-3 if len(positive) > 0 else 1e-3
+        norm = colors.LogNorm(vmin=vmin, vmax=max(gamma.max(), vmin * 10))
+        gamma = np.maximum(gamma, vmin)
+    mesh = ax.pcolormesh(x_edges, y_edges, gamma, cmap=cmap, norm=norm, shading="flat",
+                         rasterized=True)
+
+    ax.set_xscale("log")
+    ax.tick_params(axis="both", labelsize="14")
+    cbar = fig.colorbar(mesh, ax=ax)
+    cbar.set_label("$\\gamma$ ($\\Omega$)", fontsize=16)
+
+    ax.set_xlabel("$\\tau$ (s)", fontsize=16)
+    ax.set_ylabel("Cycle number", fontsize=16)
+
+    return(ax)
@@ -2,19 +2,20 @@
 Electrochemical impedence spectroscopy plotting functions
 """
 
-import eclabfiles as ecf
 import numpy as np
-import glob
+from . import cache, export, mpr, readers
+from .ragged import RaggedArray, CycleTable, PermutedColumns, sort_order
+from ._lazy import lazy_import
+import glob, os, re
+from concurrent.futures import ThreadPoolExecutor
 
-from colour import Color
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import matplotlib.ticker as ticker
+# BioLogic and plotting dependencies are imported on first use
+ecf = lazy_import("eclabfiles")
+pd = lazy_import("pandas")
+colour = lazy_import("colour")
+plt = lazy_import("matplotlib.pyplot")
+ticker = lazy_import("matplotlib.ticker")
 
-from matplotlib.pyplot import rc
-rc("text", usetex=True)
-rc("font", **{"family":"sans-serif","sans-serif":["Helvetica"]},size="14")
-rc("text.latex",preamble=r"\usepackage{sfmath}")
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -43,7 +44,7 @@ def import_file(path, fn, header_rows):
         Each column in file returned as a separate list
 
     '''
-    return np.loadtxt(path+fn, unpack=True, dtype=float, skiprows=header_rows)
+    return cache.loadtxt(path+fn, skiprows=header_rows)
 
 #------------------------------------------------------------------------------
 def import_dir(path, filetype=None):
@@ -96,8 +97,8 @@ def gradient_gen(start_hex, end_hex, num):
         Hex codes, will need to use .hex() to retrieve as string
 
     '''
-    start_color = Color(start_hex)
-    end_color = Color(end_hex)
+    start_color = colour.Color(start_hex)
+    end_color = colour.Color(end_hex)
     
     colors_list = list(start_color.range_to(end_color, num))
     
@@ -160,26 +161,38 @@ def labelprefix(limit):
     return prefix
 
 #------------------------------------------------------------------------------
-def save_fig(plot, path, fn):
+def save_fig(plot, path, fn, fmt="png", profile="print", background=False):
     '''
-    Save figure as a .png file
+    Save figure as a .png, .svg or .pdf file
 
     Parameters
     ----------
     plot : figure
-        Name of plot
+        Name of plot, or axes returned by a plotting function
     path : str
         File directory path
     fn : str
         File name to save to
+    fmt : str, optional
+        File format, "png", "svg" or "pdf". Dense data layers are rasterized
+        in svg/pdf output. The default is "png".
+    profile : str or float, optional
+        "screen" (100 dpi), "preview" (300 dpi), "print" (1000 dpi) or a dpi
+        value. The default is "print".
+    background : bool, optional
+        Set to True to write the file in a background thread, use 
+        export.wait_saves() to wait for it. The default is False.
 
     Returns
     -------
-    None
+    bbox : Bbox or Future
+        Bounding box used, pass to export.save_figure to save other formats
+        of the same figure without another layout pass
 
     '''
-    save = path + fn + ".png"
-    plot.savefig(save, bbox_inches="tight", pad_inches=0.2, dpi=1000)
+    if background == True:
+        return export.save_async(plot, path, fn, fmt, profile)
+    return export.save_figure(plot, path, fn, fmt, profile)
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -189,13 +202,14 @@ Functions in this section:
     - sort_EIS
     - sep_EIS_cycles
     - import_cycles
-    - import_param_vals '''
+    - import_param_vals
+    - import_cycle_series '''
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 
 
 #------------------------------------------------------------------------------
-def import_biologic_EIS(path):
+def import_biologic_EIS(path, columns=None):
     '''
     Imports EIS data from biologic .mpr file
 
@@ -203,6 +217,9 @@ def import_biologic_EIS(path):
     ----------
     path : str
         File directory path
+    columns : list (str), optional
+        Only read these columns with the native .mpr reader, e.g. 
+        ["time", "freq", "Re(Z)", "-Im(Z)"]. The default is None (all columns).
 
     Returns
     -------
@@ -213,29 +230,39 @@ def import_biologic_EIS(path):
     file = input("Data file: ")
     filepath = path + file + ".mpr"
         
-    EIS_data = ecf.to_df(filepath)
+    if columns is not None:
+        EIS_data = pd.DataFrame(mpr.load_mpr(filepath, columns))
+    else:
+        EIS_data = ecf.to_df(filepath)
         
     return EIS_data
 
 #------------------------------------------------------------------------------
-def sort_EIS(df):
+def sort_EIS(df, columns=None):
     '''
     Sorts EIS data by time
 
+    Already sorted data is detected in one pass and returned without
+    copying. Otherwise the sorted order is applied to each column when it
+    is first accessed.
+
     Parameters
     ----------
     df : dataframe
-        Full EIS dataset
+        Full EIS dataset (or dict of columns)
+    columns : list (str), optional
+        Only keep these columns. The default is None (all columns).
 
     Returns
     -------
-    None
+    EIS_data : PermutedColumns
+        EIS dataset in time order, indexed by column name like df
 
     '''
-    df.sort_values(by=["time"])
+    return PermutedColumns(df, sort_order(df["time"]), columns)
 
 #------------------------------------------------------------------------------
-def sep_EIS_cycles(df, cycle_pts):
+def sep_EIS_cycles(df, cycle_pts=None, by=None):
     '''
     Separates EIS data by cycle
 
@@ -243,24 +270,28 @@ def sep_EIS_cycles(df, cycle_pts):
     ----------
     df : dataframe
         Full EIS dataset
-    cycle_pts : int
-        Number of data points per EIS cycle
+    cycle_pts : int, optional
+        Number of data points per EIS cycle, incomplete last cycles are
+        dropped. The default is None (cycle boundaries are detected).
+    by : str, optional
+        Column used to detect cycle boundaries, see ragged.cycle_offsets. The
+        default is None (cycle counter column if present, otherwise the start
+        of each frequency sweep).
 
     Returns
     -------
-    EIS_cycles : dict
-        Dictionary of EIS data where each cycle is a separate entry 
+    EIS_cycles : CycleTable
+        EIS data indexed by cycle, e.g. EIS_cycles[i]["Re(Z)"] for one cycle
+        or EIS_cycles["Re(Z)"] for all cycles
     num_cycles : int
         Total number of EIS cycles
 
     '''
-    num_rows = len(df)
-    num_cycles = int(num_rows / cycle_pts)
-    
-    EIS_cycles = {}
-    
-    for i in range(0, num_cycles):
-        EIS_cycles[i] = df.truncate(before=0 + (cycle_pts*i), after=(cycle_pts-1) +  (cycle_pts*i) )
+    if cycle_pts is None:
+        EIS_cycles = CycleTable.from_columns(df, by)
+    else:
+        EIS_cycles = CycleTable.from_cycle_pts(df, cycle_pts)
+    num_cycles = len(EIS_cycles)
     
     print("Number of cycles: " + str(num_cycles))
     
@@ -304,8 +335,8 @@ def import_cycles(path, fn, num_cycles):
     fit_imag = []
     
     for i in range(num_cycles):
-        expt_re, expt_im = np.loadtxt(path + file_list[i][0], unpack=True, dtype=float, delimiter=" ", skiprows=1)
-        fit_re, fit_im = np.loadtxt(path + file_list[i][1], unpack=True, dtype=float, delimiter=" ", skiprows=1)
+        expt_re, expt_im = cache.loadtxt(path + file_list[i][0], skiprows=1, delimiter=" ")
+        fit_re, fit_im = cache.loadtxt(path + file_list[i][1], skiprows=1, delimiter=" ")
         expt_real.append(expt_re)
         expt_imag.append(expt_im)
         fit_real.append(fit_re)
@@ -340,10 +371,80 @@ def import_param_vals(path, fn, num_cycles):
         
     param_vals = []
     for i in range(num_cycles):
-        param_vals.append(np.loadtxt(path + file_list[i], unpack=True, dtype=float, delimiter=" "))
+        param_vals.append(cache.loadtxt(path + file_list[i], delimiter=" "))
         
     return param_vals
 
+#------------------------------------------------------------------------------
+def import_cycle_series(path, fn, workers=None):
+    '''
+    Import all EIS cycles, fits and fit parameters for a file name at once
+
+    Files are found with a single directory scan and parsed concurrently, see
+    readme for file name formatting information.
+
+    Parameters
+    ----------
+    path : str
+        File directory path
+    fn : str
+        File name, see readme for formatting information
+    workers : int, optional
+        Number of parsing threads. The default is None (Python default).
+
+    Returns
+    -------
+    cycles : ndarray (int)
+        Cycle numbers found in directory, in ascending order
+    expt_real : RaggedArray
+        Real values from observed dataset, one row per cycle
+    expt_imag : RaggedArray
+        Imaginary values from observed dataset, one row per cycle
+    fit_real : RaggedArray
+        Real values from calculated dataset, one row per cycle
+    fit_imag : RaggedArray
+        Imaginary values from calculated dataset, one row per cycle
+    param_vals : list (float)
+        Fit parameter values, one row per cycle (NaN if no parameter file)
+
+    '''
+    pattern = re.compile(re.escape(fn) + r"_cycle(\d+)(_fit|_params)?\.txt$")
+    found = {"": {}, "_fit": {}, "_params": {}}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if match is not None:
+                found[match.group(2) or ""][int(match.group(1))] = entry.path
+    cycles = sorted(found[""])
+    
+    # parameter files have no header row
+    def parse(job):
+        kind, cycle = job
+        skip = 0 if kind == "_params" else 1
+        return readers.read_columns(found[kind][cycle], skiprows=skip, delimiter=" ")
+    
+    jobs = [(kind, c) for kind in found for c in cycles if c in found[kind]]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        data = dict(zip(jobs, pool.map(parse, jobs)))
+    
+    # pack cycles into contiguous arrays sharing one offsets index
+    empty = np.empty((2, 0))
+    expt = [data[("", c)] for c in cycles]
+    fit = [data.get(("_fit", c), empty) for c in cycles]
+    expt_real = RaggedArray.from_list([e[0] for e in expt])
+    expt_imag = RaggedArray(np.concatenate([e[1] for e in expt] or [empty[0]]), expt_real.offsets)
+    fit_real = RaggedArray.from_list([f[0] for f in fit])
+    fit_imag = RaggedArray(np.concatenate([f[1] for f in fit] or [empty[0]]), fit_real.offsets)
+    
+    params = [np.atleast_1d(data[("_params", c)]) if ("_params", c) in data else np.empty(0)
+              for c in cycles]
+    num_params = max([len(p) for p in params] or [0])
+    param_vals = np.full((len(cycles), num_params), np.nan)
+    for i, p in enumerate(params):
+        param_vals[i, :len(p)] = p
+    
+    return np.array(cycles, dtype=int), expt_real, expt_imag, fit_real, fit_imag, param_vals
+
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -351,9 +452,13 @@ def import_param_vals(path, fn, num_cycles):
 Functions in this section:
     - plot_singlecycle
     - plot_multicycle
+    - append_cycles
     - plot_R
+    - plot_param_trends
     - plot_fit_params
-    - plot_sigC '''
+    - plot_sigC
+    - plot_kk_residuals
+    - plot_kk_flags '''
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 
@@ -396,8 +501,8 @@ def plot_singlecycle(expt_re, expt_im, fit_re, fit_im, fit_color, x_lim):
     ax.set_ylim(x_lim)
     
     # format tick values
-    ax.xaxis.set_major_formatter(FuncFormatter(reformat_ticks))
-    ax.yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+    ax.xaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
     ax.tick_params(axis="both", labelsize="14")
     
     # set axis labels
@@ -421,7 +526,8 @@ def plot_multicycle(num_cycles, expt_re, expt_im, fit_re, fit_im, x_lim, start_h
     num_cycles : int
         Total number of EIS cycles
     expt_re : list (float)
-        Real values from observed dataset
+        Real values from observed dataset, one row per cycle (e.g. a RaggedArray
+        from import_cycles or a sep_EIS_cycles column)
     expt_im : list (float)
         Imaginary values from observed dataset
     fit_re : list (float)
@@ -461,8 +567,8 @@ def plot_multicycle(num_cycles, expt_re, expt_im, fit_re, fit_im, x_lim, start_h
     ax.set_ylim(x_lim)
     
     # format tick values
-    ax.xaxis.set_major_formatter(FuncFormatter(reformat_ticks))
-    ax.yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+    ax.xaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
     ax.tick_params(axis="both", labelsize="14")
     
     # set axis labels
@@ -473,9 +579,58 @@ def plot_multicycle(num_cycles, expt_re, expt_im, fit_re, fit_im, x_lim, start_h
     
     return(ax)
 
+#------------------------------------------------------------------------------
+def append_cycles(ax, expt_re, expt_im, fit_re, fit_im, start_hex=False, end_hex=False):
+    '''
+    Adds new EIS cycles to a plot made by plot_multicycle
+
+    The existing cycles are kept and only recolored, so the color gradient
+    spans all cycles.
+
+    Parameters
+    ----------
+    ax : axes
+        Axes returned by plot_multicycle
+    expt_re : list (float)
+        Real values from observed dataset, one entry per new cycle
+    expt_im : list (float)
+        Imaginary values from observed dataset, one entry per new cycle
+    fit_re : list (float)
+        Real values from calculated dataset, one entry per new cycle
+    fit_im : list (float)
+        Imaginary values from calculated dataset, one entry per new cycle
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+
+    Returns
+    -------
+    ax : axes
+        Updated axes
+
+    '''
+    marker_style = dict(marker="o", markersize=5, markerfacecolor="white", markeredgecolor="black")
+    
+    for i in range(len(expt_re)):
+        ax.plot(expt_re[i], expt_im[i], color="white", label="_Experimental", linewidth=1, **marker_style)
+        ax.plot(fit_re[i], fit_im[i], linewidth=1.5, label="_Calculated")
+    
+    # spread the gradient over all cycles
+    if start_hex == False:
+        start_hex = "#00C6BF"
+    if end_hex == False:
+        end_hex = "#B430C2"
+    fits = [line for line in ax.lines if line.get_label() == "_Calculated"]
+    g = gradient_gen(start_hex, end_hex, len(fits))
+    for line, color in zip(fits, g):
+        line.set_color(color.hex)
+    
+    return(ax)
+
 #------------------------------------------------------------------------------
 ''' plot R value vs cycle number '''
-def plot_R(num_cycles, R_vals, x_lim, y_lim, color=False, marker=False):
+def plot_R(num_cycles, R_vals, x_lim, y_lim, color=False, marker=False, cycles=None):
     '''
     Plot R value vs cycle number
 
@@ -493,10 +648,13 @@ def plot_R(num_cycles, R_vals, x_lim, y_lim, color=False, marker=False):
         Hex code for calculated data color, format "#000000". The default is False.
     marker : str, optional
         Plot marker shape. The default is False.
+    cycles : list (int), optional
+        Cycle number of each value. The default is None (0 to num_cycles - 1).
 
     Returns
     -------
-    None
+    ax : matplotlib axes
+        Plot of the resistance
 
     '''
     fig, (ax)=plt.subplots(1, 1, figsize=(8,4))
@@ -504,11 +662,12 @@ def plot_R(num_cycles, R_vals, x_lim, y_lim, color=False, marker=False):
     if color == False:
         color = "#00C6BF"
     if marker == False:
-        marker == "o"
+        marker = "o"
     
-    cycle_count = []
-    for i in range(num_cycles):
-        cycle_count.append(i)
+    if cycles is None:
+        cycle_count = np.arange(num_cycles)
+    else:
+        cycle_count = np.asarray(cycles)
     
     # plot data
     ax.plot(cycle_count, R_vals, color=color, marker=marker, markersize="8")
@@ -528,6 +687,51 @@ def plot_R(num_cycles, R_vals, x_lim, y_lim, color=False, marker=False):
     
     return(ax)
 
+#------------------------------------------------------------------------------
+def plot_param_trends(cycles, param_vals, labels, color=False, marker=False):
+    '''
+    Plot several fit parameters vs cycle number, one panel per parameter
+
+    Parameters
+    ----------
+    cycles : list (int)
+        Cycle numbers
+    param_vals : list (float)
+        Parameter values, one row per cycle and one column per panel
+    labels : list (str)
+        Y-axis label of each panel
+    color : str, optional
+        Hex code for data color, format "#000000". The default is False.
+    marker : str, optional
+        Plot marker shape. The default is False.
+
+    Returns
+    -------
+    ax : list (matplotlib axes)
+        One axes per parameter
+
+    '''
+    param_vals = np.asarray(param_vals, dtype=float).reshape(len(cycles), len(labels))
+    fig, ax = plt.subplots(len(labels), 1, figsize=(8, 2*len(labels)), sharex=True, squeeze=False)
+    ax = ax[:,0]
+    
+    if color == False:
+        color = "#00C6BF"
+    if marker == False:
+        marker = "o"
+    
+    # plot data
+    for i in range(len(labels)):
+        ax[i].plot(cycles, param_vals[:,i], color=color, marker=marker, markersize="5")
+        ax[i].set_ylabel(labels[i], fontsize=14)
+        ax[i].tick_params(axis="both", labelsize="12")
+    
+    # set axis labels
+    ax[-1].set_xlabel("Cycle Number", fontsize=16)
+    fig.align_ylabels(ax)
+    
+    return(ax)
+
 #------------------------------------------------------------------------------
 def plot_fit_params(plot, vals, pos):
     '''
@@ -574,6 +778,76 @@ def plot_sigC(plot, sig_C_vals, pos, box_color):
     props = dict(facecolor="white", edgecolor=box_color, pad=8, linewidth=2)
     plot.text(pos[0], pos[1], sig_C_vals, ha="left", va="top", fontsize="14", linespacing=2, bbox=props)
 
+#------------------------------------------------------------------------------
+def plot_kk_residuals(plot, freq, res_re, res_im, pos, threshold=0.01):
+    '''
+    Plot inset with Kramers-Kronig residuals of one cycle
+
+    Parameters
+    ----------
+    plot : figure
+        Name of plot, e.g. from plot_singlecycle
+    freq : list (float)
+        Frequencies in Hz
+    res_re : list (float)
+        Real residuals relative to |Z|, from kk.kk_test
+    res_im : list (float)
+        Imaginary residuals relative to |Z|, from kk.kk_test
+    pos : list (float)
+        (x, y, width, height) of inset in axes fractions
+    threshold : float, optional
+        Pass limit drawn as a shaded band. The default is 0.01.
+
+    Returns
+    -------
+    inset : axes
+        Residual axes
+
+    '''
+    inset = plot.inset_axes(pos)
+    inset.axhspan(-100 * threshold, 100 * threshold, color="#E6E6E6", zorder=0)
+    inset.plot(freq, 100 * np.asarray(res_re), color="black", marker="o", markersize=3, 
+               linewidth=1, label="Real")
+    inset.plot(freq, 100 * np.asarray(res_im), color="#B430C2", marker="s", markersize=3, 
+               linewidth=1, label="Imag.")
+    inset.set_xscale("log")
+    inset.tick_params(axis="both", labelsize="10")
+    inset.set_xlabel("Frequency (Hz)", fontsize=10)
+    inset.set_ylabel(r"$\Delta$ (\%)" if plt.rcParams["text.usetex"] else r"$\Delta$ (%)", fontsize=10)
+    inset.legend(handlelength=1, fontsize="8", loc="upper left")
+    return(inset)
+
+#------------------------------------------------------------------------------
+def plot_kk_flags(plot, expt_re, expt_im, passed, color="#FF0000"):
+    '''
+    Mark cycles that fail the Kramers-Kronig test on a multicycle plot
+
+    Parameters
+    ----------
+    plot : figure
+        Name of plot, e.g. from plot_multicycle
+    expt_re : list (float)
+        Real values from observed dataset, one entry per cycle
+    expt_im : list (float)
+        Imaginary values from observed dataset, one entry per cycle
+    passed : list (bool)
+        Pass flags from kk.kk_test
+    color : str, optional
+        Hex code for marker edge color, format "#000000". The default is "#FF0000".
+
+    Returns
+    -------
+    None
+
+    '''
+    failed = np.flatnonzero(~np.asarray(passed, dtype=bool))
+    for n, i in enumerate(failed):
+        plot.plot(expt_re[i], expt_im[i], linestyle="none", marker="o", markersize=5, 
+                  markerfacecolor="white", markeredgecolor=color,
+                  label="KK test failed" if n == 0 else "_KK test failed")
+    if len(failed) > 0:
+        plot.legend(handlelength=1, fontsize="14")
+
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -1,17 +1,19 @@
 """
-PDF plotting functions
+PDF plotting and transform functions
 """
 
 import numpy as np
+from . import cache, export, readers
+from .ragged import RaggedArray
+from ._lazy import lazy_import
 import glob
-from colour import Color
-import matplotlib.pyplot as plt
-import matplotlib.lines as mlines
 
-from matplotlib.pyplot import rc
-rc("text", usetex=True)
-rc("font", **{"family":"sans-serif","sans-serif":["Helvetica"]},size="14")
-rc("text.latex",preamble=r"\usepackage{sfmath}")
+# plotting dependencies are imported on first use
+colour = lazy_import("colour")
+plt = lazy_import("matplotlib.pyplot")
+mlines = lazy_import("matplotlib.lines")
+mcollections = lazy_import("matplotlib.collections")
+
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -40,7 +42,7 @@ def import_file(path, fn, header_rows):
         Each column in file returned as a separate list
 
     '''
-    return np.loadtxt(path+fn, unpack=True, dtype=float, skiprows=header_rows)
+    return cache.loadtxt(path+fn, skiprows=header_rows)
 
 #------------------------------------------------------------------------------
 def import_dir(path, filetype=None):
@@ -93,8 +95,8 @@ def gradient_gen(start_hex, end_hex, num):
         Hex codes, will need to use .hex() to retrieve as string
 
     '''
-    start_color = Color(start_hex)
-    end_color = Color(end_hex)
+    start_color = colour.Color(start_hex)
+    end_color = colour.Color(end_hex)
     
     colors_list = list(start_color.range_to(end_color, num))
     
@@ -157,26 +159,38 @@ def labelprefix(limit):
     return prefix
 
 #------------------------------------------------------------------------------
-def save_fig(plot, path, fn):
+def save_fig(plot, path, fn, fmt="png", profile="print", background=False):
     '''
-    Save figure as a .png file
+    Save figure as a .png, .svg or .pdf file
 
     Parameters
     ----------
     plot : figure
-        Name of plot
+        Name of plot, or axes returned by a plotting function
     path : str
         File directory path
     fn : str
         File name to save to
+    fmt : str, optional
+        File format, "png", "svg" or "pdf". Dense data layers are rasterized
+        in svg/pdf output. The default is "png".
+    profile : str or float, optional
+        "screen" (100 dpi), "preview" (300 dpi), "print" (1000 dpi) or a dpi
+        value. The default is "print".
+    background : bool, optional
+        Set to True to write the file in a background thread, use 
+        export.wait_saves() to wait for it. The default is False.
 
     Returns
     -------
-    None
+    bbox : Bbox or Future
+        Bounding box used, pass to export.save_figure to save other formats
+        of the same figure without another layout pass
 
     '''
-    save = path + fn + ".png"
-    plot.savefig(save, bbox_inches="tight", pad_inches=0.2, dpi=1000)
+    if background == True:
+        return export.save_async(plot, path, fn, fmt, profile)
+    return export.save_figure(plot, path, fn, fmt, profile)
 
 
 #------------------------------------------------------------------------------
@@ -184,12 +198,14 @@ def save_fig(plot, path, fn):
 ''' PDF PLOTTING 
 Functions in this section:
     - import_PDF
-    - plot_PDF '''
+    - import_PDF_sections
+    - plot_PDF
+    - plot_PDF_series '''
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 
 
-def import_PDF(path, fn, header_rows):
+def import_PDF(path, fn, header_rows=None, section=0):
     '''
     Imports PDF data file
 
@@ -199,8 +215,13 @@ def import_PDF(path, fn, header_rows):
         File directory path
     fn : str
         File name, including extension
-    header_rows : int
-        Number of rows of metadata at beginning of file
+    header_rows : int, optional
+        Number of rows of metadata at beginning of file. The default is None
+        (read the "#S" section given by section, see readers.read_section,
+        or detect the header of files without sections, see
+        readers.read_pattern).
+    section : int or str, optional
+        Section position or "#S" name of a PDFgui export. The default is 0.
 
     Returns
     -------
@@ -214,11 +235,79 @@ def import_PDF(path, fn, header_rows):
         G_calc(r) values
 
     '''
-    r, G, Gdiff, Gcalc = np.loadtxt(path+fn, unpack=True, dtype=float, skiprows=header_rows)
-    return r, G, Gdiff, Gcalc
+    if header_rows is not None:
+        r, G, Gdiff, Gcalc = cache.loadtxt(path+fn, skiprows=header_rows)
+        return r, G, Gdiff, Gcalc
+    
+    if len(readers.index_sections(path+fn)) == 0:
+        # plain r, G, Gdiff, Gcalc table, e.g. a .gr file
+        cols = list(readers.read_pattern(path+fn))
+        missing = np.full(len(cols[0]), np.nan)
+        r, G, Gdiff, Gcalc = (cols + [missing] * 2)[:4]
+        return r, G, Gdiff, Gcalc
+    
+    data = readers.read_section(path+fn, section)
+    return section_columns(data)
+
+#------------------------------------------------------------------------------
+def section_columns(data):
+    '''
+    Picks r, G, Gdiff and Gcalc from the named columns of a PDFgui section
+    '''
+    names = list(data)
+    G = "Gtrunc" if "Gtrunc" in data else ("Gobs" if "Gobs" in data else names[1])
+    missing = np.full(len(data[names[0]]), np.nan)
+    return data[names[0]], data[G], data.get("Gdiff", missing), data.get("Gcalc", missing)
+
+#------------------------------------------------------------------------------
+def import_PDF_sections(path, fn, sections=None):
+    '''
+    Imports several sections of a PDFgui export (e.g. a temperature series)
+
+    Only the requested sections are parsed, using a section index that is
+    built once per file and stored next to it.
+
+    Parameters
+    ----------
+    path : str
+        File directory path
+    fn : str
+        File name, including extension
+    sections : list (int or str), optional
+        Section positions or "#S" names. The default is None (all sections).
+
+    Returns
+    -------
+    names : list (str)
+        Section names
+    r_vals : RaggedArray
+        r (A) values, one row per section
+    G_vals : RaggedArray
+        G(r) values, one row per section
+    Gdiff_vals : RaggedArray
+        G_diff(r) values, one row per section
+    Gcalc_vals : RaggedArray
+        G_calc(r) values, one row per section
+
+    '''
+    index = readers.index_sections(path+fn)
+    if sections is None:
+        sections = range(len(index))
+    
+    names = []
+    columns = []
+    for s in sections:
+        data = readers.read_section(path+fn, s)
+        names.append(s if isinstance(s, str) else index[s]["name"])
+        columns.append(section_columns(data))
+    
+    r_vals = RaggedArray.from_list([c[0] for c in columns])
+    G_vals, Gdiff_vals, Gcalc_vals = (RaggedArray(np.concatenate([c[k] for c in columns] or [np.empty(0)]),
+                                                  r_vals.offsets) for k in (1, 2, 3))
+    return names, r_vals, G_vals, Gdiff_vals, Gcalc_vals
 
 
-def plot_PDF(r, G, Gcalc, Gdiff=False, fit_color=False, x_lim=False, y_lim=False):
+def plot_PDF(r, G, Gcalc, Gdiff=False, fit_color=False, x_lim=False, y_lim=False, ax=None):
     '''
     Generates plot with PDF data
 
@@ -238,34 +327,38 @@ def plot_PDF(r, G, Gcalc, Gdiff=False, fit_color=False, x_lim=False, y_lim=False
         Tuple with x-axis minimum and maximum. The default is False.
     y_lim : list (float), optional
         Tuple with x-axis minimum and maximum.. The default is False.
+    ax : axes, optional
+        Existing axes to draw on, a new figure is created if None. The default is None.
 
     Returns
     -------
-    None
+    ax : axes
+        Axes containing the plot
 
     '''
-    plt.figure(figsize=(7,7))
+    if ax is None:
+        fig, (ax) = plt.subplots(1, figsize=(7,7))
     
     if fit_color == False:
         fit_color = "#00C6BF"
     diff_pos = np.min(G) - 0.1
+    has_diff = Gdiff is not False and Gdiff is not None
     
     # plot observed G(r), calculated G(r), and difference curve
-    for i in range(len(r)):
-        plt.plot(r, G, color="black", label="_Observed", marker=".")
-        plt.plot(r, Gcalc, color=fit_color, label="_Calculated", linewidth="2")
-        if Gdiff != False:
-            plt.plot(r, Gdiff+diff_pos, color="#BEBEBE", label="_Difference")
+    ax.plot(r, G, color="black", label="_Observed", marker=".")
+    ax.plot(r, Gcalc, color=fit_color, label="_Calculated", linewidth="2")
+    if has_diff:
+        ax.plot(r, Gdiff+diff_pos, color="#BEBEBE", label="_Difference")
     
     # set axis limits
     if x_lim != False:
-        plt.xlim(x_lim)
+        ax.set_xlim(x_lim)
     if y_lim != False:
-        plt.ylim(y_lim)
+        ax.set_ylim(y_lim)
     
     # set axis labels
-    plt.xlabel("r / " r"$\AA$")
-    plt.ylabel("G(r) / " r"$\AA^{-2}$")
+    ax.set_xlabel("r / " r"$\AA$")
+    ax.set_ylabel("G(r) / " r"$\AA^{-2}$")
     
     # create legend
     G_handle = mlines.Line2D([], [], color="white", label="Observed", 
@@ -274,11 +367,243 @@ def plot_PDF(r, G, Gcalc, Gdiff=False, fit_color=False, x_lim=False, y_lim=False
                                  linewidth="2")
     Gdiff_handle = mlines.Line2D([], [], color="#BEBEBE", label="Difference",
                                  linewidth="2")
-    if Gdiff != False:
-        plt.legend(handles=[G_handle, Gcalc_handle, Gdiff_handle],
-                   handlelength=1, fontsize="14")
-    elif Gdiff == False:
-        plt.legend(handles=[G_handle, Gcalc_handle],
-                   handlelength=1, fontsize="14")
+    if has_diff:
+        ax.legend(handles=[G_handle, Gcalc_handle, Gdiff_handle],
+                  handlelength=1, fontsize="14")
+    else:
+        ax.legend(handles=[G_handle, Gcalc_handle],
+                  handlelength=1, fontsize="14")
+    
+    return(ax)
+
+#------------------------------------------------------------------------------
+def plot_PDF_series(num, r_vals, G_vals, Gcalc_vals, spacing, Gdiff_vals=None, 
+                    labels=None, label_offsets=None, start_hex=False, end_hex=False, 
+                    x_lim=False, y_lim=False, ax=None):
+    '''
+    Generates plot with multiple stacked PDF refinements (e.g. temperature series)
+
+    Each layer (observed, calculated, difference) is drawn as a single 
+    collection, so the number of artists does not grow with the number of
+    refinements.
+
+    Parameters
+    ----------
+    num : int
+        Total number of refinements
+    r_vals : list (float)
+        r (A) values for each refinement
+    G_vals : list (float)
+        G(r) values for each refinement
+    Gcalc_vals : list (float)
+        G_calc(r) values for each refinement
+    spacing : float
+        Vertical spacing between refinements on plot
+    Gdiff_vals : list (float), optional
+        G_diff(r) values for each refinement. The default is None.
+    labels : list (str), optional
+        Labels for each refinement. The default is None.
+    label_offsets : list (float), optional
+        Tuple with offsets from x-axis maximum and vertical spacing from data
+        for text labels. The default is None.
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+    x_lim : list (float), optional
+        Tuple with x-axis minimum and maximum. The default is False.
+    y_lim : list (float), optional
+        Tuple with y-axis minimum and maximum. The default is False.
+    ax : axes, optional
+        Existing axes to draw on, a new figure is created if None. The default is None.
+
+    Returns
+    -------
+    ax : axes
+        Axes containing the plot
+
+    '''
+    if ax is None:
+        fig, (ax) = plt.subplots(1, figsize=(7,7))
+    
+    # generate color gradient
+    if start_hex == False:
+        start_hex = "#00C6BF"
+    if end_hex == False:
+        end_hex = "#B430C2"
+    g = [c.hex for c in gradient_gen(start_hex, end_hex, num)]
     
-    return(plt)
\ No newline at end of file
+    # offset each refinement once while building the segment lists
+    obs_pts = []
+    calc_segs = []
+    diff_segs = []
+    for i in range(num):
+        r = np.asarray(r_vals[i], dtype=float)
+        offset = i * spacing
+        obs_pts.append(np.column_stack((r, np.asarray(G_vals[i]) + offset)))
+        calc_segs.append(np.column_stack((r, np.asarray(Gcalc_vals[i]) + offset)))
+        if Gdiff_vals is not None:
+            diff_pos = np.min(G_vals[i]) - 0.1 + offset
+            diff_segs.append(np.column_stack((r, np.asarray(Gdiff_vals[i]) + diff_pos)))
+    
+    # plot observed G(r), calculated G(r), and difference curves
+    obs_pts = np.concatenate(obs_pts)
+    ax.scatter(obs_pts[:,0], obs_pts[:,1], color="black", marker=".", s=8, zorder=1)
+    ax.add_collection(mcollections.LineCollection(calc_segs, colors=g, linewidths=2, zorder=2))
+    if Gdiff_vals is not None:
+        ax.add_collection(mcollections.LineCollection(diff_segs, colors="#BEBEBE", linewidths=1, zorder=0))
+    ax.autoscale_view()
+    
+    # set axis limits
+    if x_lim != False:
+        ax.set_xlim(x_lim)
+    if y_lim != False:
+        ax.set_ylim(y_lim)
+    
+    # set axis labels
+    ax.set_xlabel("r / " r"$\AA$")
+    ax.set_ylabel("G(r) / " r"$\AA^{-2}$")
+    
+    # add stack labels
+    if labels is not None:
+        x_max = ax.get_xlim()[1]
+        for i in range(num):
+            ax.text(x_max - label_offsets[0], label_offsets[1] + (i * spacing),
+                    labels[i], color=g[i], fontsize="16", ha="right", va="top")
+    
+    return(ax)
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' PDF TRANSFORM 
+Functions in this section:
+    - lorch_window
+    - sq_to_gr '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def lorch_window(Q, Qmax):
+    '''
+    Lorch modification function sin(pi Q / Qmax) / (pi Q / Qmax)
+
+    Parameters
+    ----------
+    Q : list (float)
+        Q values
+    Qmax : float
+        Maximum Q used in the transform
+
+    Returns
+    -------
+    M : list (float)
+        Window values, 0 beyond Qmax
+
+    '''
+    Q = np.asarray(Q, dtype=float)
+    return np.where(Q <= Qmax, np.sinc(Q / Qmax), 0.0)
+
+#------------------------------------------------------------------------------
+def _interp_rows(x, Y, x_new):
+    '''
+    Linear interpolation of every row of Y, x ascending, 0 outside x
+    '''
+    idx = np.clip(np.searchsorted(x, x_new) - 1, 0, len(x) - 2)
+    w = (x_new - x[idx]) / (x[idx+1] - x[idx])
+    out = Y[..., idx] * (1 - w) + Y[..., idx+1] * w
+    out[..., (x_new < x[0]) | (x_new > x[-1])] = 0
+    return out
+
+#------------------------------------------------------------------------------
+def sq_to_gr(Q, S, r, Qmin=None, Qmax=None, lorch=False, oversample=16):
+    '''
+    Fourier transforms S(Q) to G(r) for one pattern or a series
+
+    G(r) = 2/pi int Q [S(Q) - 1] M(Q) sin(Q r) dQ from Qmin to Qmax. S(Q)
+    is resampled onto a uniform Q grid starting at 0 and the sine sum is
+    evaluated with one zero-padded FFT per pattern (all patterns of a
+    series in one batched call) on a fine r grid, then interpolated onto
+    r with cubic Lagrange weights. G(r) is band limited by Qmax, so the
+    fine grid only needs to oversample the Qmax oscillation.
+
+    Parameters
+    ----------
+    Q : list (float)
+        Q values in 1/A (e.g. from XRD.tt_to_q), shared by all patterns,
+        or one row per pattern (e.g. a RaggedArray)
+    S : list (float)
+        Total scattering structure factor S(Q), one row per pattern
+    r : list (float)
+        r values in A to calculate G(r) at
+    Qmin : float, optional
+        Minimum Q used, raised to the smallest Q in data. The default is
+        None (smallest Q in data).
+    Qmax : float, optional
+        Maximum Q used, lowered to the largest Q in data. The default is
+        None (largest Q in data).
+    lorch : bool, optional
+        Set to True to apply the Lorch modification function, which reduces
+        termination ripples at the cost of resolution. The default is False.
+    oversample : int, optional
+        Fine r grid points per half period of the Qmax oscillation. The
+        default is 16.
+
+    Returns
+    -------
+    G : list (float)
+        G(r) in 1/A^2, one row per pattern (1D for a single pattern)
+
+    '''
+    r = np.asarray(r, dtype=float)
+    shared = np.ndim(Q[0]) == 0
+    single = shared and np.ndim(S[0]) == 0
+    if shared:
+        Q = np.asarray(Q, dtype=float)
+        S = np.atleast_2d(np.asarray(S, dtype=float))
+        Q_lo, Q_hi, steps = Q[0], Q[-1], np.diff(Q)
+    else:
+        Q = [np.asarray(q, dtype=float) for q in Q]
+        S = [np.asarray(s, dtype=float) for s in S]
+        Q_lo = max(q[0] for q in Q)
+        Q_hi = min(q[-1] for q in Q)
+        steps = np.concatenate([np.diff(q) for q in Q])
+    # S(Q) is not known outside the data, so the range is clipped to it
+    Qmin = max(Q_lo, 0.0) if Qmin is None else max(Qmin, Q_lo, 0.0)
+    Qmax = Q_hi if Qmax is None else min(Qmax, Q_hi)
+
+    # uniform Q grid from 0, fine enough for the largest r
+    dQ = min(np.median(steps[steps > 0]), np.pi / (2 * max(r.max(), 1e-12)))
+    Q_grid = np.arange(int(np.floor(Qmax / dQ)) + 1) * dQ
+    window = ((Q_grid >= Qmin) & (Q_grid <= Qmax)).astype(float)
+    if lorch:
+        window *= lorch_window(Q_grid, Qmax)
+
+    # fine r grid r_k = k pi / (N dQ), N zero-padded to a power of two
+    N = 1 << int(np.ceil(np.log2(max(oversample * len(Q_grid), len(Q_grid) + 1))))
+    dr = np.pi / (N * dQ)
+
+    # cubic Lagrange weights on the fine grid, G is odd in r
+    pos = r / dr
+    k = np.floor(pos).astype(np.int64)
+    t = pos - k
+    weights = np.stack((-t * (t - 1) * (t - 2) / 6, (t + 1) * (t - 1) * (t - 2) / 2,
+                        -(t + 1) * t * (t - 2) / 2, (t + 1) * t * (t - 1) / 6))
+    cols = k[None, :] + np.arange(-1, 3)[:, None]
+    sign = np.where(cols < 0, -1.0, 1.0)
+    cols = np.abs(cols)
+
+    # transform in blocks of patterns to bound memory
+    num = len(S)
+    G = np.empty((num, len(r)))
+    block = max(1, 2**23 // (2 * N))
+    for start in range(0, num, block):
+        stop = min(start + block, num)
+        if shared:
+            S_grid = _interp_rows(Q, S[start:stop], Q_grid)
+        else:
+            S_grid = np.array([_interp_rows(Q[i], S[i], Q_grid) for i in range(start, stop)])
+        F = Q_grid * (S_grid - 1) * window
+        Gk = -(2 / np.pi) * dQ * np.fft.rfft(F, n=2 * N, axis=-1).imag
+        G[start:stop] = (Gk[:, cols] * (sign * weights)).sum(axis=1)
+
+    return G[0] if single else G
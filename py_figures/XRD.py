@@ -3,15 +3,19 @@ Diffraction plotting functions
 """
 
 import numpy as np
-from colour import Color
-import glob, os
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
+from . import cache, export, readers
+from .ragged import RaggedArray
+from .decimate import output_dpi, axes_pixels, pixel_decimate, minmax_decimate
+from ._lazy import lazy_import
+import glob, os, re, warnings
+from concurrent.futures import ThreadPoolExecutor
+
+# plotting dependencies are imported on first use
+colour = lazy_import("colour")
+plt = lazy_import("matplotlib.pyplot")
+ticker = lazy_import("matplotlib.ticker")
+mcollections = lazy_import("matplotlib.collections")
 
-from matplotlib.pyplot import rc
-rc("text", usetex=True)
-rc("font", **{"family":"sans-serif","sans-serif":["Helvetica"]},size="14")
-rc("text.latex",preamble=r"\usepackage{sfmath}")
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -63,7 +67,7 @@ def q_to_tt(q, wavelength):
     return twotheta
 
 #------------------------------------------------------------------------------
-def import_file(path, fn, header_rows):
+def import_file(path, fn, header_rows=None):
     '''
     Imports a data file
 
@@ -73,8 +77,9 @@ def import_file(path, fn, header_rows):
         File directory path
     fn : str
         File name
-    header_rows : int
-        Number of rows of metadata at beginning of file
+    header_rows : int, optional
+        Number of rows of metadata at beginning of file. The default is None
+        (detected, see readers.read_pattern for supported formats).
 
     Returns
     -------
@@ -82,7 +87,9 @@ def import_file(path, fn, header_rows):
         Each column in file returned as a separate list
 
     '''
-    return np.loadtxt(path+fn, unpack=True, dtype=float, skiprows=header_rows)
+    if header_rows is None:
+        return readers.read_pattern(path+fn)
+    return cache.loadtxt(path+fn, skiprows=header_rows)
 
 #------------------------------------------------------------------------------
 def import_dir(path, filetype=None):
@@ -135,8 +142,8 @@ def gradient_gen(start_hex, end_hex, num):
         Hex codes, will need to use .hex() to retrieve as string
 
     '''
-    start_color = Color(start_hex)
-    end_color = Color(end_hex)
+    start_color = colour.Color(start_hex)
+    end_color = colour.Color(end_hex)
     
     colors_list = list(start_color.range_to(end_color, num))
     
@@ -168,10 +175,10 @@ def gradient_gen_2D(top_left, top_right, bottom_left, bottom_right, rows, cols):
         Hex codes in 2D array format, will need to use .hex() to retrieve as string
 
     '''
-    tl = Color(top_left)
-    tr = Color(top_right)
-    bl = Color(bottom_left)
-    br = Color(bottom_right)
+    tl = colour.Color(top_left)
+    tr = colour.Color(top_right)
+    bl = colour.Color(bottom_left)
+    br = colour.Color(bottom_right)
     
     start_col_colors = list(tl.range_to(bl, rows))
     end_col_colors = list(tr.range_to(br, rows))
@@ -242,32 +249,48 @@ def labelexp(limit):
     return exp
 
 #------------------------------------------------------------------------------
-def save_fig(plot, path, fn):
+def save_fig(plot, path, fn, fmt="png", profile="print", background=False):
     '''
-    Save figure as a .png file
+    Save figure as a .png, .svg or .pdf file
 
     Parameters
     ----------
     plot : figure
-        Name of plot
+        Name of plot, or axes returned by a plotting function
     path : str
         File directory path
     fn : str
         File name to save to
+    fmt : str, optional
+        File format, "png", "svg" or "pdf". Dense data layers are rasterized
+        in svg/pdf output. The default is "png".
+    profile : str or float, optional
+        "screen" (100 dpi), "preview" (300 dpi), "print" (1000 dpi) or a dpi
+        value. The default is "print".
+    background : bool, optional
+        Set to True to write the file in a background thread, use 
+        export.wait_saves() to wait for it. The default is False.
 
     Returns
     -------
-    None
+    bbox : Bbox or Future
+        Bounding box used, pass to export.save_figure to save other formats
+        of the same figure without another layout pass
 
     '''
-    save = path + fn + ".png"
-    plot.savefig(save, bbox_inches="tight", pad_inches=0.2, dpi=1000)
+    if background == True:
+        return export.save_async(plot, path, fn, fmt, profile)
+    return export.save_figure(plot, path, fn, fmt, profile)
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 ''' XRD DATA MANAGEMENT 
 Functions in this section:
     - var_dicts 
+    - natural_key
+    - load_patterns
+    - grid_keys
+    - match_grid
     - diff_curve
     - export_diff 
     - norm '''
@@ -277,7 +300,7 @@ Functions in this section:
 
 #------------------------------------------------------------------------------
 ''' create XRD variable dictionaries '''
-def var_dicts(current_dir, header_rows, x_vals, y_vals, isQ=True):
+def var_dicts(current_dir, header_rows=None, x_vals=None, y_vals=None, isQ=None):
     '''
     Create variable dictionaries for Q/2theta and intensity
 
@@ -285,14 +308,11 @@ def var_dicts(current_dir, header_rows, x_vals, y_vals, isQ=True):
     ----------
     current_dir : list (str)
         File names in working directory
-    header_rows : int
-        Number of rows of metadata at beginning of file
-    x_vals : list (float)
-        Q or 2theta values
-    y_vals : list (float)
-        Intensity values
-    isQ : bool, optional
-        Set to False if using units of 2theta. The default is True.
+    header_rows : int, optional
+        Number of rows of metadata at beginning of file. The default is None
+        (detected for each file, see readers.read_pattern).
+    x_vals, y_vals, isQ : optional
+        Deprecated and ignored, the values are read from the files.
 
     Returns
     -------
@@ -302,29 +322,159 @@ def var_dicts(current_dir, header_rows, x_vals, y_vals, isQ=True):
         Y-axis values sorted by corresponding file index
 
     '''
+    if x_vals is not None or y_vals is not None or isQ is not None:
+        warnings.warn("var_dicts ignores x_vals, y_vals and isQ, they will be removed",
+                      DeprecationWarning, stacklevel=2)
 
+    with ThreadPoolExecutor() as pool:
+        data = list(pool.map(lambda fp: readers.read_pattern(fp, usecols=(0, 1)) if header_rows is None
+                             else cache.loadtxt(fp, skiprows=header_rows, usecols=(0, 1)), current_dir))
+    
     x_dict = {}
     y_dict = {}
-    
-    # create keys for dictionaries with index number
-    for i in current_dir:
-        if isQ == True:
-            globals()[f"Q_{i}"] = f"Q_{i}"
-            x_dict[i] = "Q"+str(i)
-        elif isQ == False:
-            globals()[f"2theta_{i}"] = f"2theta_{i}"
-            x_dict[i] = "2theta"+str(i)
-        
-        globals()[f"ints_{i}"] = f"ints_{i}"
-        y_dict[i] = "ints"+str(i)
-            
-    for i in range(0, len(x_dict)):
-        x_dict[i], y_dict[i] = np.loadtxt(current_dir[i], unpack=True, dtype=float, skiprows=header_rows)
+    for i in range(len(data)):
+        x_dict[i], y_dict[i] = data[i]
                 
     return x_dict, y_dict
 
 #------------------------------------------------------------------------------
-def diff_curve(x1, x2, y1, y2):
+def natural_key(fn):
+    '''
+    Sort key that orders numbered file names numerically (scan_2 before scan_10)
+    '''
+    return [int(s) if s.isdigit() else s.lower() for s in re.split(r"(\d+)", fn)]
+
+#------------------------------------------------------------------------------
+def load_patterns(path, header_rows=None, filetype=None, x_col=0, y_col=1, workers=None):
+    '''
+    Loads every diffraction pattern in a directory
+
+    Only the x and y columns are parsed, files are parsed concurrently and
+    ordered by natural sort of their names (e.g. an in-situ heating series).
+
+    Parameters
+    ----------
+    path : str
+        File directory path
+    header_rows : int, optional
+        Number of rows of metadata at beginning of file. The default is None
+        (detected for each file, see readers.read_pattern).
+    filetype : str, optional
+        File name pattern, e.g. "*.xye". The default is None (all files).
+    x_col : int, optional
+        Column index of x-axis values (Q or 2theta). The default is 0.
+    y_col : int, optional
+        Column index of intensity values. The default is 1.
+    workers : int, optional
+        Number of parsing threads. The default is None (Python default).
+
+    Returns
+    -------
+    files : list (str)
+        File paths in load order
+    x_vals : list (float)
+        Shared x-axis values if all patterns use the same grid, otherwise a
+        RaggedArray with one row per pattern
+    y_vals : list (float)
+        2D array of intensities (patterns x points) if the grid is shared,
+        otherwise a RaggedArray with one row per pattern
+
+    '''
+    files = sorted(import_dir(path, filetype), key=natural_key)
+    
+    def parse(fp):
+        if header_rows is None:
+            return readers.read_pattern(fp, usecols=(x_col, y_col))
+        return cache.loadtxt(fp, skiprows=header_rows, usecols=(x_col, y_col))
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        data = list(pool.map(parse, files))
+    
+    x0 = data[0][0] if len(data) > 0 else np.empty(0)
+    shared = all(len(d[0]) == len(x0) and np.array_equal(d[0], x0) for d in data)
+    
+    if shared:
+        y_vals = np.empty((len(data), len(x0)))
+        for i in range(len(data)):
+            y_vals[i] = data[i][1]
+        return files, np.array(x0), y_vals
+    
+    x_vals = RaggedArray.from_list([d[0] for d in data])
+    y_vals = RaggedArray.from_list([d[1] for d in data])
+    return files, x_vals, y_vals
+
+#------------------------------------------------------------------------------
+def grid_keys(x, decimals=3):
+    '''
+    Quantizes x-axis values to integer keys
+
+    Parameters
+    ----------
+    x : list (float)
+        X-axis values
+    decimals : int, optional
+        Number of decimal places two values must agree to. The default is 3.
+
+    Returns
+    -------
+    keys : list (int)
+        Integer keys, equal keys correspond to matching x-axis values
+
+    '''
+    x = np.asarray(x, dtype=float)
+    scaled = x * 10**decimals
+    keys = np.rint(scaled).astype(np.int64)
+    
+    # values sitting on a rounding boundary are settled with exact decimal
+    # formatting so keys agree with '%.3f'-style rounding
+    tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in tie:
+        keys[i] = int(round(float('%.*f' % (decimals, x[i])) * 10**decimals))
+    
+    return keys
+
+#------------------------------------------------------------------------------
+def match_grid(x1, x2, decimals=3):
+    '''
+    Finds all pairs of matching points between two x-axis grids
+
+    Parameters
+    ----------
+    x1 : list (float)
+        x-axis values of dataset 1
+    x2 : list (float)
+        x-axis values of dataset 2
+    decimals : int, optional
+        Number of decimal places two values must agree to. The default is 3.
+
+    Returns
+    -------
+    idx1 : list (int)
+        Indices into dataset 1, in ascending order
+    idx2 : list (int)
+        Indices into dataset 2 matching each entry of idx1
+
+    '''
+    keys1 = grid_keys(x1, decimals)
+    keys2 = grid_keys(x2, decimals)
+    
+    # sort dataset 2 once, then look up every key of dataset 1 in O(log n)
+    order = np.argsort(keys2, kind="stable")
+    sorted_keys2 = keys2[order]
+    lo = np.searchsorted(sorted_keys2, keys1, side="left")
+    hi = np.searchsorted(sorted_keys2, keys1, side="right")
+    counts = hi - lo
+    
+    # expand each run of equal keys into individual index pairs
+    idx1 = np.repeat(np.arange(len(keys1)), counts)
+    run_starts = np.cumsum(counts) - counts
+    within_run = np.arange(len(idx1)) - np.repeat(run_starts, counts)
+    idx2 = order[np.repeat(lo, counts) + within_run]
+    
+    return idx1, idx2
+
+#------------------------------------------------------------------------------
+def diff_curve(x1, x2, y1, y2, decimals=3, interpolate=False):
     '''
     Calculates the difference between two datasets
 
@@ -335,29 +485,41 @@ def diff_curve(x1, x2, y1, y2):
     x2 : list (float)
         x-axis values of dataset 2
     y1 : list (float)
-        y-axis values of dataset 1
+        y-axis values of dataset 1, can be a 2D array with one row per
+        pattern to difference several patterns on the x1 grid at once
     y2 : list (float)
         y-axis values of dataset 2
+    decimals : int, optional
+        Number of decimal places x-axis values must agree to. The default is 3.
+    interpolate : bool, optional
+        Set to True if the two datasets do not share a grid, dataset 2 is then
+        interpolated onto the x1 values within its range. The default is False.
 
     Returns
     -------
     diff_x : list (float)
         x-axis values of difference curve
     diff_y : list (float)
-        y-axis values of difference curve
+        y-axis values of difference curve, one row per pattern if y1 is 2D
 
     '''
-    diff_x_list = []
-    diff_y_list = []
-    for i in range(len(x1)):
-        x1_val = float('%.3f'%(x1[i]))
-        for j in range(len(x2)):
-            x2_val = float('%.3f'%(x2[j]))
-            if x1_val == x2_val:
-                diff_x_list.append(x1_val)
-                diff_y_list.append(y1[i]-y2[j])
-    diff_x = np.array(diff_x_list)
-    diff_y = np.array(diff_y_list)
+    x1 = np.asarray(x1, dtype=float)
+    x2 = np.asarray(x2, dtype=float)
+    y1 = np.asarray(y1, dtype=float)
+    y2 = np.asarray(y2, dtype=float)
+    
+    if interpolate == True:
+        order = np.argsort(x2, kind="stable")
+        x2 = x2[order]
+        y2 = y2[order]
+        in_range = (x1 >= x2[0]) & (x1 <= x2[-1])
+        diff_x = x1[in_range]
+        diff_y = y1[..., in_range] - np.interp(diff_x, x2, y2)
+        return diff_x, diff_y
+    
+    idx1, idx2 = match_grid(x1, x2, decimals)
+    diff_x = grid_keys(x1[idx1], decimals) / 10**decimals
+    diff_y = y1[..., idx1] - y2[idx2]
     
     return diff_x, diff_y
 
@@ -414,14 +576,16 @@ Functions in this section:
     - single_fit
     - add_hkl
     - hkl_diff_subplots 
+    - offset_stack
     - stacked_single_plot
+    - append_stack
     - stacked_subplots '''
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
 def single_fit(x, obs, calc, diff, x_lim, y_lim, isQ=True, Q_wl=None, 
-               isNorm=False, fit_color=False):
+               isNorm=False, fit_color=False, decimate=False):
     '''
     Generates plot with a single diffraction refinement
 
@@ -447,6 +611,11 @@ def single_fit(x, obs, calc, diff, x_lim, y_lim, isQ=True, Q_wl=None,
         Set to True if intensity data is normalized. The default is False.
     fit_color : str, optional
         Hex code for calculated data color, format "#000000". The default is False.
+    decimate : bool, str or float, optional
+        Set to True to reduce plotted points to the pixel resolution of the 
+        default save_fig profile ("print", 1000 dpi), or give the export
+        profile name or dpi the figure will be saved at (e.g. "screen").
+        Only the visible x range is drawn. The default is False.
 
     Returns
     -------
@@ -460,24 +629,35 @@ def single_fit(x, obs, calc, diff, x_lim, y_lim, isQ=True, Q_wl=None,
     if fit_color == False:
         fit_color = "#00B8FF"
     
+    obs_x, obs_y = x, obs
+    calc_x, calc_y = x, calc
+    diff_x, diff_y = x, diff-np.max(diff)
+    
+    # reduce data to what is visible at the output resolution
+    if decimate is not False:
+        width, height = axes_pixels(ax, output_dpi(decimate))
+        obs_x, obs_y = pixel_decimate(obs_x, obs_y, x_lim, y_lim, width, height)
+        calc_x, calc_y = minmax_decimate(calc_x, calc_y, x_lim, width)
+        diff_x, diff_y = minmax_decimate(diff_x, diff_y, x_lim, width)
+    
     # plot XRD data
-    ax.scatter(x, obs, color="black", label="Observed", marker=".", s=8)
-    ax.plot(x, calc, color=fit_color, label="Calculated", linewidth=2)
-    ax.plot(x, diff-np.max(diff), color="#BEBEBE", label="Difference", linewidth=1)
+    ax.scatter(obs_x, obs_y, color="black", label="Observed", marker=".", s=8)
+    ax.plot(calc_x, calc_y, color=fit_color, label="Calculated", linewidth=2)
+    ax.plot(diff_x, diff_y, color="#BEBEBE", label="Difference", linewidth=1)
 
     # set axis limits
     ax.set_xlim(x_lim)
     ax.set_ylim(y_lim)
 
     # format axes
-    ax.yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
     ax.tick_params(axis="both", labelsize="14")
     
     # set axis labels
     if isQ == False:
-        x_label = r"2$\theta$ / $^{circ}$ (Cu K$\alpha$)"
+        x_label = r"2$\theta$ / $^{\circ}$ (Cu K$\alpha$)"
     elif isQ == True:
-        x_label = "Q (\AA" r"$^{-1}$, $\lambda=$" + str(Q_wl) + " \AA)"
+        x_label = "Q (" r"$\AA^{-1}$, $\lambda=$" + str(Q_wl) + r" $\AA$)"
     
     y_exp = labelexp(y_lim[1])
     if isNorm == False:
@@ -523,7 +703,8 @@ def add_hkl(plot, xvals, tick_height, tick_width, tick_pos, color):
 
 #------------------------------------------------------------------------------
 def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_lim, 
-                      isQ=True, Q_wl=None, isNorm=False, fit_color=False, hkl_color=False):
+                      isQ=True, Q_wl=None, isNorm=False, fit_color=False, hkl_color=False,
+                      decimate=False):
     '''
     Generates XRD plot with subplots for (hkl) ticks and difference curb
 
@@ -555,6 +736,11 @@ def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_li
         Hex code for calculated data color, format "#000000". The default is False.
     hkl_color : str, optional
         Hex code for (hkl) color, format "#000000". The default is False.
+    decimate : bool, str or float, optional
+        Set to True to reduce plotted points to the pixel resolution of the 
+        default save_fig profile ("print", 1000 dpi), or give the export
+        profile name or dpi the figure will be saved at (e.g. "screen").
+        Only the visible x range is drawn. The default is False.
 
     Returns
     -------
@@ -563,15 +749,30 @@ def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_li
     '''
     
     fig, (ax) = plt.subplots(3, 1, figsize=(9,6), gridspec_kw={'height_ratios': [4, 0.5, 1.25]})
+    # final layout before the axes are measured for decimation
+    plt.subplots_adjust(hspace=0.05)
     
     if fit_color == False:
         fit_color = "#00B8FF"
     if hkl_color == False:
         hkl_color = "#97DB4F"
     
+    obs_x, obs_y = x, obs
+    calc_x, calc_y = x, calc
+    diff_x, diff_y = x, diff
+    
+    # reduce data to what is visible at the output resolution
+    if decimate is not False:
+        dpi = output_dpi(decimate)
+        width, height = axes_pixels(ax[0], dpi)
+        obs_x, obs_y = pixel_decimate(obs_x, obs_y, x_lim, data_y_lim, width, height)
+        calc_x, calc_y = minmax_decimate(calc_x, calc_y, x_lim, width)
+        width, height = axes_pixels(ax[2], dpi)
+        diff_x, diff_y = minmax_decimate(diff_x, diff_y, x_lim, width)
+    
     # plot XRD data
-    obs = ax[0].scatter(x, obs, color="black", label="Observed", marker=".", s=8)
-    calc = ax[0].plot(x, calc, color=fit_color, label="Calculated", linewidth=2)
+    obs = ax[0].scatter(obs_x, obs_y, color="black", label="Observed", marker=".", s=8)
+    calc = ax[0].plot(calc_x, calc_y, color=fit_color, label="Calculated", linewidth=2)
     
     # plot hkl
     for i in range(len(hkl_vals)):
@@ -580,12 +781,12 @@ def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_li
         ax[1].plot(x_range, y_range, color=hkl_color)
     
     # plot difference
-    diff = ax[2].plot(x, diff, color="#BEBEBE", label="Difference", linewidth=1)
+    diff = ax[2].plot(diff_x, diff_y, color="#BEBEBE", label="Difference", linewidth=1)
 
     # set axis limits
     for i in range(3):
         ax[i].set_xlim(x_lim)
-        ax[i].yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+        ax[i].yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
         ax[i].tick_params(axis="both", labelsize="14")
         
     ax[0].set_ylim(data_y_lim)
@@ -598,9 +799,9 @@ def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_li
     
     # set axis labels
     if isQ == False:
-        x_label = r"2$\theta$ / $^{circ}$ (Cu K$\alpha$)"
+        x_label = r"2$\theta$ / $^{\circ}$ (Cu K$\alpha$)"
     elif isQ == True:
-        x_label = "Q (\AA" r"$^{-1}$, $\lambda=$" + str(Q_wl) + " \AA)"
+        x_label = "Q (" r"$\AA^{-1}$, $\lambda=$" + str(Q_wl) + r" $\AA$)"
     
     y_exp = labelexp(data_y_lim[1])
     if isNorm == False:
@@ -615,14 +816,50 @@ def hkl_diff_subplots(x, obs, calc, diff, hkl_vals, x_lim, data_y_lim, diff_y_li
     ax[0].legend(handlelength=1, fontsize="14")
     ax[2].legend(handlelength=1, fontsize="14")
     
-    plt.subplots_adjust(hspace=0.05)
-    
     return(ax)
 
+#------------------------------------------------------------------------------
+def offset_stack(num, x_vals, y_vals, spacing):
+    '''
+    Builds vertically offset (x, y) line segments for a stack of datasets
+
+    All segments are views into one preallocated array, so no per-dataset
+    offset copies are made.
+
+    Parameters
+    ----------
+    num : int
+        Total number of datasets
+    x_vals : list (float)
+        X-axis data for each dataset, or a single array shared by all datasets
+    y_vals : list (float)
+        Y-axis data for each dataset
+    spacing : float
+        Vertical spacing between datasets
+
+    Returns
+    -------
+    segments : list (float)
+        (N, 2) array of points for each dataset
+
+    '''
+    shared_x = np.ndim(x_vals[0]) == 0
+    lengths = np.array([len(y_vals[i]) for i in range(num)], dtype=np.int64)
+    offsets = np.zeros(num + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    
+    points = np.empty((offsets[-1], 2))
+    for i in range(num):
+        seg = points[offsets[i]:offsets[i+1]]
+        seg[:,0] = x_vals if shared_x else x_vals[i]
+        np.add(y_vals[i], i * spacing, out=seg[:,1])
+    
+    return [points[offsets[i]:offsets[i+1]] for i in range(num)]
+
 #------------------------------------------------------------------------------
 def stacked_single_plot(x_lim, y_lim, num, x_vals, y_vals, spacing, ycalc_vals=None, 
                         labels=None, label_offsets=None, start_hex=False, end_hex=False, 
-                        isQ=True, Q_wl=None, isNorm=False):
+                        isQ=True, Q_wl=None, isNorm=False, heatmap=False, cmap="viridis"):
     '''
     Generates plot with multiple XRD datasets on a single plot
 
@@ -635,7 +872,7 @@ def stacked_single_plot(x_lim, y_lim, num, x_vals, y_vals, spacing, ycalc_vals=N
     num : int
         Total number of datasets
     x_vals : list (float)
-        X-axis data (either Q or 2theta)
+        X-axis data (either Q or 2theta), or a single array shared by all datasets
     y_vals : list (float)
         Observed intensities
     spacing : float
@@ -657,6 +894,13 @@ def stacked_single_plot(x_lim, y_lim, num, x_vals, y_vals, spacing, ycalc_vals=N
         Set instrument wavelength. The default is None.
     isNorm : bool, optional
         Set to True if intensity data is normalized. The default is False.
+    heatmap : bool, optional
+        Set to True to draw datasets as rows of an intensity map instead of 
+        stacked lines, recommended for very large series. y_lim then sets the
+        intensity color range, spacing and ycalc_vals are not used. 
+        The default is False.
+    cmap : str, optional
+        Colormap used in heatmap mode. The default is "viridis".
 
     Returns
     -------
@@ -672,36 +916,75 @@ def stacked_single_plot(x_lim, y_lim, num, x_vals, y_vals, spacing, ycalc_vals=N
     if end_hex == False:
         end_hex = "#B430C2"
     g = gradient_gen(start_hex, end_hex, num)
+    colors = [c.hex for c in g]
     
-    # plot data
-    if ycalc_vals is None:
+    # set axis labels
+    if isQ == False:
+        x_label = r"2$\theta$ / $^{\circ}$ (Cu K$\alpha$)"
+    elif isQ == True:
+        x_label = "Q (" r"$\AA^{-1}$, $\lambda=$" + str(Q_wl) + r" $\AA$)"
+    
+    y_exp = labelexp(y_lim[1])
+    if isNorm == False:
+        y_label = "Intensity (counts " + y_exp + ")"
+    elif isNorm== True:
+        y_label = "Intensity (counts, normalized)"
+    
+    # plot data as an intensity map, one row per dataset
+    if heatmap == True:
+        shared_x = np.ndim(x_vals[0]) == 0
+        x_grid = np.asarray(x_vals if shared_x else x_vals[0], dtype=float)
+        image = np.empty((num, len(x_grid)))
         for i in range(num):
-            ax.plot(x_vals[i], y_vals[i] + (i * spacing), color=g[i].hex, linewidth="2")
+            if shared_x or np.array_equal(x_vals[i], x_grid):
+                image[i] = y_vals[i]
+            else:
+                image[i] = np.interp(x_grid, x_vals[i], y_vals[i])
+        
+        step = np.diff(x_grid)
+        if len(step) > 0 and np.allclose(step, step[0]):
+            mesh = ax.imshow(image, cmap=cmap, vmin=y_lim[0], vmax=y_lim[1], aspect="auto", 
+                             origin="lower",
+                             extent=(x_grid[0] - step[0]/2, x_grid[-1] + step[0]/2, -0.5, num - 0.5))
+        else:
+            mesh = ax.pcolormesh(x_grid, np.arange(num), image, cmap=cmap, vmin=y_lim[0], 
+                                 vmax=y_lim[1], shading="nearest", rasterized=True)
+        
+        cbar = fig.colorbar(mesh, ax=ax)
+        cbar.set_label(y_label, fontsize=16)
+        if y_exp != '':
+            cbar.ax.yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
+        
+        ax.set_xlim(x_lim)
+        ax.set_ylim(-0.5, num - 0.5)
+        ax.tick_params(axis="both", labelsize="14")
+        ax.set_xlabel(x_label, fontsize=16)
+        if labels is not None:
+            ax.set_yticks(np.arange(num))
+            ax.set_yticklabels(labels)
+        else:
+            ax.set_ylabel("Dataset", fontsize=16)
+        
+        return(ax)
+    
+    # plot data, one collection for all datasets
+    if ycalc_vals is None:
+        lines = offset_stack(num, x_vals, y_vals, spacing)
+        ax.add_collection(mcollections.LineCollection(lines, colors=colors, linewidths=2))
     elif ycalc_vals is not None:
-        for i in range(num):
-            ax.scatter(x_vals[i], y_vals[i] + (i * spacing), color="black", label="Observed", marker=".", s=8)
-            ax.plot(x_vals[i], ycalc_vals[i] + (i * spacing), color=g[i].hex, linewidth="2")
+        points = np.concatenate(offset_stack(num, x_vals, y_vals, spacing))
+        ax.scatter(points[:,0], points[:,1], color="black", label="Observed", marker=".", s=8)
+        lines = offset_stack(num, x_vals, ycalc_vals, spacing)
+        ax.add_collection(mcollections.LineCollection(lines, colors=colors, linewidths=2))
             
     # set axis limits
     ax.set_xlim(x_lim)
     ax.set_ylim(y_lim)
     
     # format axes
-    ax.yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
     ax.tick_params(axis="both", labelsize="14")
     
-    # set axis labels
-    if isQ == False:
-        x_label = r"2$\theta$ / $^{circ}$ (Cu K$\alpha$)"
-    elif isQ == True:
-        x_label = "Q (\AA" r"$^{-1}$, $\lambda=$" + str(Q_wl) + " \AA)"
-    
-    y_exp = labelexp(y_lim[1])
-    if isNorm == False:
-        y_label = "Intensity (counts " + y_exp + ")"
-    elif isNorm== True:
-        y_label = "Intensity (counts, normalized)"
-
     ax.set_xlabel(x_label, fontsize=16)
     ax.set_ylabel(y_label, fontsize=16)
     
@@ -709,10 +992,87 @@ def stacked_single_plot(x_lim, y_lim, num, x_vals, y_vals, spacing, ycalc_vals=N
     if labels is not None:
         for i in range(num):
             ax.text(x_lim[1] - label_offsets[0], label_offsets[1] + (i * spacing),
-                    labels[i], color=g[i].hex, fontsize="16", ha="right", va="top")
+                    labels[i], color=colors[i], fontsize="16", ha="right", va="top")
     
     return(ax) 
 
+#------------------------------------------------------------------------------
+def append_stack(ax, x_vals, y_vals, spacing, start_hex=False, end_hex=False):
+    '''
+    Adds new datasets to the top of a plot made by stacked_single_plot
+
+    Works for line stacks without calculated intensities and for heatmaps on
+    a uniform grid. The existing datasets are reused and only recolored or
+    shifted, nothing is re-offset. The upper y-axis limit grows if new
+    datasets do not fit.
+
+    Parameters
+    ----------
+    ax : axes
+        Axes returned by stacked_single_plot
+    x_vals : list (float)
+        X-axis data for each new dataset, or a single array shared by all
+    y_vals : list (float)
+        Observed intensities, one entry per new dataset
+    spacing : float
+        Vertical spacing between datasets, as used for the existing plot
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+
+    Returns
+    -------
+    ax : axes
+        Updated axes
+
+    '''
+    num_new = len(y_vals)
+    shared_x = np.ndim(x_vals[0]) == 0
+    
+    # heatmap mode, add rows to the image
+    if len(ax.images) > 0:
+        image = ax.images[0]
+        rows = np.asarray(image.get_array())
+        left, right, bottom, top = image.get_extent()
+        step = (right - left) / rows.shape[1]
+        x_grid = left + step * (np.arange(rows.shape[1]) + 0.5)
+        new_rows = np.empty((num_new, rows.shape[1]))
+        for i in range(num_new):
+            new_rows[i] = np.interp(x_grid, x_vals if shared_x else x_vals[i], y_vals[i])
+        num = rows.shape[0] + num_new
+        image.set_data(np.concatenate((rows, new_rows)))
+        image.set_extent((left, right, -0.5, num - 0.5))
+        ax.set_ylim(-0.5, num - 0.5)
+        return(ax)
+    
+    lines = [c for c in ax.collections if isinstance(c, mcollections.LineCollection)]
+    if len(lines) != 1 or len(ax.collections) != 1:
+        raise ValueError("append_stack needs a line stack without calculated intensities")
+    lines = lines[0]
+    
+    # offset the new datasets above the existing ones
+    segments = lines.get_segments()
+    num_old = len(segments)
+    new_segs = offset_stack(num_new, x_vals, y_vals, spacing)
+    for seg in new_segs:
+        seg[:,1] += num_old * spacing
+    segments = segments + new_segs
+    lines.set_segments(segments)
+    
+    # spread the gradient over all datasets
+    if start_hex == False:
+        start_hex = "#00C6BF"
+    if end_hex == False:
+        end_hex = "#B430C2"
+    lines.set_color([c.hex for c in gradient_gen(start_hex, end_hex, len(segments))])
+    
+    top = max(seg[:,1].max() for seg in new_segs if len(seg) > 0)
+    if top > ax.get_ylim()[1]:
+        ax.set_ylim(top=top + spacing)
+    
+    return(ax)
+
 #------------------------------------------------------------------------------
 def stacked_subplots(x_lim, y_lim, num, x_vals, y_vals, ycalc_vals=None, diff=None,
                         labels=None, label_offsets=None, start_hex=False, 
@@ -785,16 +1145,16 @@ def stacked_subplots(x_lim, y_lim, num, x_vals, y_vals, ycalc_vals=None, diff=No
     for i in range(num):
         ax[i].set_xlim(x_lim)
         ax[i].set_ylim(y_lim)
-        ax[i].yaxis.set_major_formatter(FuncFormatter(reformat_ticks))
+        ax[i].yaxis.set_major_formatter(ticker.FuncFormatter(reformat_ticks))
         ax[i].tick_params(axis="both", labelsize="14")
         if i < (num-1):
             ax[i].get_xaxis().set_visible(False)
 
     # set axis labels
     if isQ == False:
-        x_label = r"2$\theta$ / $^{circ}$ (Cu K$\alpha$)"
+        x_label = r"2$\theta$ / $^{\circ}$ (Cu K$\alpha$)"
     elif isQ == True:
-        x_label = "Q (\AA" r"$^{-1}$, $\lambda=$" + str(Q_wl) + " \AA)"
+        x_label = "Q (" r"$\AA^{-1}$, $\lambda=$" + str(Q_wl) + r" $\AA$)"
     
     y_exp = labelexp(y_lim[1])
     if isNorm == False:
@@ -0,0 +1,49 @@
+"""
+Deferred imports for optional and slow-to-import dependencies
+"""
+
+import importlib
+
+#------------------------------------------------------------------------------
+class LazyModule:
+    '''
+    Module placeholder that imports the real module on first attribute access
+
+    Parameters
+    ----------
+    name : str
+        Full module name, e.g. "matplotlib.pyplot"
+
+    '''
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<lazy module '{}' ({})>".format(self._name, state)
+
+#------------------------------------------------------------------------------
+def lazy_import(name):
+    '''
+    Returns a placeholder for a module that is imported on first use
+
+    Parameters
+    ----------
+    name : str
+        Full module name
+
+    Returns
+    -------
+    LazyModule
+        Placeholder module
+
+    '''
+    return LazyModule(name)
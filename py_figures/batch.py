@@ -0,0 +1,414 @@
+"""
+Headless batch figure rendering
+
+Figures are described in a JSON job file and rendered with the Agg backend
+in a process pool:
+
+    py_figures jobs.json
+
+Job file layout:
+
+    {
+      "output_dir": "figures/",
+      "defaults": {"fmt": "png", "profile": "print", "text": "mathtext"},
+      "jobs": [
+        {
+          "name": "EIS_multicycle",
+          "load": {"cycles": {"call": "EIS.import_cycles",
+                              "args": ["EIS_data/", "sample_PEIS_C01", 28]}},
+          "plot": "EIS.plot_multicycle",
+          "args": [28, "$cycles.0", "$cycles.1", "$cycles.2", "$cycles.3", [0, 12500]],
+          "kwargs": {"start_hex": "#7D83FF", "end_hex": "#FF7D83"}
+        }
+      ]
+    }
+
+Strings starting with "$" refer to loaded data, "$name.i" is item i of the
+result of load "name" and "$plot" is the value returned by the plot
+function (for "decorate" calls, e.g. EIS.plot_fit_params). Relative paths
+are relative to the job file. Jobs whose settings and input files are
+unchanged since the last run are skipped.
+"""
+
+import argparse, glob, hashlib, importlib, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# modules job files may call into
+job_modules = ("XRD", "EIS", "CP", "PDF", "style")
+
+# per-job settings with their defaults
+job_defaults = {"fmt": "png", "profile": "print", "text": "mathtext", "rc": None}
+
+state_file = ".py_figures_state.json"
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' JOB DEFINITION
+Functions in this section:
+    - read_jobs
+    - resolve_call
+    - resolve_refs
+    - job_inputs
+    - job_fingerprint '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_jobs(jobfile):
+    '''
+    Reads a job file and fills in default settings
+
+    Parameters
+    ----------
+    jobfile : str
+        Path to JSON job file
+
+    Returns
+    -------
+    jobs : list (dict)
+        Job definitions with all settings filled in
+    output_dir : str
+        Figure output directory, relative to the job file directory
+
+    '''
+    with open(jobfile) as f:
+        spec = json.load(f)
+
+    defaults = dict(job_defaults)
+    defaults.update(spec.get("defaults", {}))
+    output_dir = spec.get("output_dir", "")
+
+    jobs = []
+    names = set()
+    for i, job in enumerate(spec["jobs"]):
+        job = dict(defaults, **job)
+        job.setdefault("name", "job" + str(i))
+        if job["name"] in names:
+            raise ValueError("Duplicate job name: " + job["name"])
+        if "plot" not in job:
+            raise ValueError("Job " + job["name"] + " has no plot function")
+        if isinstance(job["fmt"], str):
+            job["fmt"] = [job["fmt"]]
+        names.add(job["name"])
+        jobs.append(job)
+
+    return jobs, output_dir
+
+#------------------------------------------------------------------------------
+def resolve_call(name):
+    '''
+    Finds a py_figures function from its "module.function" name
+
+    Parameters
+    ----------
+    name : str
+        Function name, e.g. "XRD.hkl_diff_subplots"
+
+    Returns
+    -------
+    func : function
+        Function to call
+
+    '''
+    module, _, func = name.partition(".")
+    if module not in job_modules or func == "" or func.startswith("_"):
+        raise ValueError("Not a py_figures function: " + name)
+    return getattr(importlib.import_module("py_figures." + module), func)
+
+#------------------------------------------------------------------------------
+def resolve_refs(value, data):
+    '''
+    Replaces "$name.i.j" references with loaded data
+
+    Parameters
+    ----------
+    value : str, list or dict
+        Argument value from job file
+    data : dict
+        Loaded data by load name
+
+    Returns
+    -------
+    value
+        Argument value with references replaced
+
+    '''
+    if isinstance(value, str) and value.startswith("$"):
+        parts = value[1:].split(".")
+        out = data[parts[0]]
+        for idx in parts[1:]:
+            out = out[int(idx)] if idx.lstrip("-").isdigit() else out[idx]
+        return out
+    if isinstance(value, list):
+        return [resolve_refs(v, data) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve_refs(v, data) for k, v in value.items()}
+    return value
+
+#------------------------------------------------------------------------------
+def job_inputs(job, base):
+    '''
+    Lists the input files of a job
+
+    Uses the "inputs" globs of the job if given, otherwise every file or
+    directory named in the load arguments.
+
+    Parameters
+    ----------
+    job : dict
+        Job definition
+    base : str
+        Job file directory
+
+    Returns
+    -------
+    files : list (str)
+        Sorted input file paths
+
+    '''
+    if "inputs" in job:
+        patterns = job["inputs"]
+    else:
+        patterns = []
+        for load in job.get("load", {}).values():
+            for arg in list(load.get("args", [])) + list(load.get("kwargs", {}).values()):
+                if isinstance(arg, str) and os.path.exists(os.path.join(base, arg)):
+                    patterns.append(arg)
+
+    files = set()
+    for pattern in patterns:
+        for match in glob.glob(os.path.join(base, pattern)):
+            if os.path.isdir(match):
+                files.update(e.path for e in os.scandir(match) if e.is_file())
+            else:
+                files.add(match)
+    return sorted(files)
+
+#------------------------------------------------------------------------------
+def job_fingerprint(job, base):
+    '''
+    Hashes the settings and input file states of a job
+
+    Parameters
+    ----------
+    job : dict
+        Job definition
+    base : str
+        Job file directory
+
+    Returns
+    -------
+    key : str
+        Hex digest, changes when a setting or an input file changes
+
+    '''
+    inputs = []
+    for fp in job_inputs(job, base):
+        stat = os.stat(fp)
+        inputs.append((os.path.abspath(fp), stat.st_mtime_ns, stat.st_size))
+    ident = {"job": job, "inputs": inputs}
+    return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' JOB EXECUTION
+Functions in this section:
+    - init_worker
+    - render_job
+    - run_jobs
+    - main '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def init_worker(base):
+    '''
+    Sets up a worker process for headless rendering
+
+    Parameters
+    ----------
+    base : str
+        Job file directory, relative paths in jobs start here
+
+    Returns
+    -------
+    None
+
+    '''
+    import matplotlib
+    matplotlib.use("Agg")
+    os.chdir(base)
+
+#------------------------------------------------------------------------------
+def render_job(job, output_dir):
+    '''
+    Loads data, plots and saves the figure of one job
+
+    Parameters
+    ----------
+    job : dict
+        Job definition
+    output_dir : str
+        Figure output directory
+
+    Returns
+    -------
+    timings : dict
+        Seconds spent loading, plotting and saving
+
+    '''
+    from . import export, style
+    import matplotlib.pyplot as plt
+
+    t0 = time.perf_counter()
+    data = {}
+    for name, load in job.get("load", {}).items():
+        data[name] = resolve_call(load["call"])(*resolve_refs(load.get("args", []), data),
+                                                **resolve_refs(load.get("kwargs", {}), data))
+    t1 = time.perf_counter()
+
+    with style.figure_style(job["rc"], job["text"]):
+        plot = resolve_call(job["plot"])(*resolve_refs(job.get("args", []), data),
+                                         **resolve_refs(job.get("kwargs", {}), data))
+        if plot is None:
+            plot = plt.gcf()
+        data["plot"] = plot
+        for call in job.get("decorate", []):
+            resolve_call(call["call"])(*resolve_refs(call.get("args", []), data),
+                                       **resolve_refs(call.get("kwargs", {}), data))
+        t2 = time.perf_counter()
+
+        fig = export.get_figure(plot)
+        out = os.path.join(output_dir, job.get("output", job["name"]))
+        path = os.path.join(os.path.dirname(out), "")
+        if path != "":
+            os.makedirs(path, exist_ok=True)
+        bbox = None
+        for fmt in job["fmt"]:
+            bbox = export.save_figure(fig, path, os.path.basename(out), fmt, job["profile"], bbox=bbox)
+    plt.close("all")
+    t3 = time.perf_counter()
+
+    return {"load": t1 - t0, "plot": t2 - t1, "save": t3 - t2}
+
+#------------------------------------------------------------------------------
+def run_jobs(jobfile, workers=None, force=False, select=None, stream=sys.stdout):
+    '''
+    Renders all jobs of a job file in a process pool
+
+    Parameters
+    ----------
+    jobfile : str
+        Path to JSON job file
+    workers : int, optional
+        Number of worker processes. The default is None (CPU count).
+    force : bool, optional
+        Set to True to render unchanged jobs too. The default is False.
+    select : list (str), optional
+        Names of jobs to run. The default is None (all).
+    stream : file, optional
+        Where to write the timing report. The default is sys.stdout.
+
+    Returns
+    -------
+    results : dict
+        Job name mapped to status ("done", "skipped" or error message) and
+        timings
+
+    '''
+    start = time.perf_counter()
+    base = os.path.dirname(os.path.abspath(jobfile))
+    jobs, output_dir = read_jobs(jobfile)
+    if select is not None:
+        jobs = [job for job in jobs if job["name"] in select]
+
+    state_path = os.path.join(base, output_dir, state_file)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    results = {}
+    pending = {}
+    for job in jobs:
+        key = job_fingerprint(job, base)
+        out = os.path.join(base, output_dir, job.get("output", job["name"]))
+        outputs_exist = all(os.path.exists(out + "." + fmt) for fmt in job["fmt"])
+        if not force and state.get(job["name"]) == key and outputs_exist:
+            results[job["name"]] = {"status": "skipped"}
+        else:
+            pending[job["name"]] = (job, key)
+
+    if workers is None:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers = max(min(workers, len(pending)), 1)
+
+    futures = {}
+    if len(pending) > 0:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(base,))
+        futures = {pool.submit(render_job, job, output_dir): name
+                   for name, (job, key) in pending.items()}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            results[name] = dict(future.result(), status="done")
+            state[name] = pending[name][1]
+        except Exception as e:
+            results[name] = {"status": type(e).__name__ + ": " + str(e)}
+            state.pop(name, None)
+    if len(pending) > 0:
+        pool.shutdown()
+
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+    width = max([len(job["name"]) for job in jobs] + [3])
+    stream.write("{0:<{w}}  {1:>7} {2:>7} {3:>7}  {4}\n".format("job", "load", "plot", "save", "status", w=width))
+    for job in jobs:
+        res = results[job["name"]]
+        if "load" in res:
+            stream.write("{0:<{w}}  {1:7.2f} {2:7.2f} {3:7.2f}  {4}\n".format(
+                job["name"], res["load"], res["plot"], res["save"], res["status"], w=width))
+        else:
+            stream.write("{0:<{w}}  {1:>7} {1:>7} {1:>7}  {2}\n".format(job["name"], "-", res["status"], w=width))
+
+    counts = [sum(res["status"] == s for res in results.values()) for s in ("done", "skipped")]
+    stream.write("{0} rendered, {1} skipped, {2} failed in {3:.2f} s with {4} workers\n".format(
+        counts[0], counts[1], len(results) - sum(counts), time.perf_counter() - start, workers))
+
+    return results
+
+#------------------------------------------------------------------------------
+def main(argv=None):
+    '''
+    Command line entry point of the py_figures command
+
+    Parameters
+    ----------
+    argv : list (str), optional
+        Command line arguments. The default is None (sys.argv).
+
+    Returns
+    -------
+    code : int
+        Exit code, 1 if any job failed
+
+    '''
+    parser = argparse.ArgumentParser(prog="py_figures",
+                                     description="Render figures from a JSON job file.")
+    parser.add_argument("jobfile", help="path to JSON job file")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="render jobs even if inputs and settings are unchanged")
+    parser.add_argument("-n", "--name", action="append", default=None,
+                        help="only run the named job, can be repeated")
+    args = parser.parse_args(argv)
+
+    results = run_jobs(args.jobfile, workers=args.jobs, force=args.force, select=args.name)
+    failed = [res for res in results.values() if res["status"] not in ("done", "skipped")]
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+On-disk cache for parsed data files
+"""
+
+import numpy as np
+import hashlib, json, os, tempfile, threading
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CACHE SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# cache location can be overridden with the PY_FIGURES_CACHE environment variable
+cache_dir = os.environ.get("PY_FIGURES_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "py_figures"))
+max_bytes = 1024**3
+enabled = True
+
+# eviction frees space down to this fraction of max_bytes, leaving room for
+# the next entries before the directory has to be scanned again
+evict_to = 0.9
+
+# running total of the cache size in bytes, None until the directory is
+# scanned. Refreshed by every eviction, so writes by other processes are
+# picked up then
+_total_bytes = None
+_total_lock = threading.Lock()
+
+#------------------------------------------------------------------------------
+def set_cache(path=None, size=None, enable=True):
+    '''
+    Configures the parsed data cache
+
+    Parameters
+    ----------
+    path : str, optional
+        Cache directory path. The default is None (keep current directory).
+    size : int, optional
+        Maximum total cache size in bytes. The default is None (keep current size).
+    enable : bool, optional
+        Set to False to always parse files directly. The default is True.
+
+    Returns
+    -------
+    None
+
+    '''
+    global cache_dir, max_bytes, enabled, _total_bytes
+    if path is not None:
+        cache_dir = path
+        _total_bytes = None
+    if size is not None:
+        max_bytes = size
+    enabled = enable
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CACHE MANAGEMENT
+Functions in this section:
+    - cache_key
+    - cached
+    - loadtxt
+    - evict
+    - clear '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def cache_key(filepath, **options):
+    '''
+    Generates cache key for a data file
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    **options
+        Parse options that affect the result (e.g. skiprows, delimiter)
+
+    Returns
+    -------
+    key : str
+        Hex digest of file path, modification time, size and parse options
+
+    '''
+    stat = os.stat(filepath)
+    ident = {"path": os.path.abspath(filepath), "mtime": stat.st_mtime_ns,
+             "size": stat.st_size, "options": options}
+    return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+#------------------------------------------------------------------------------
+def cached(filepath, parser, **options):
+    '''
+    Parses a data file, reusing a stored binary copy when the file is unchanged
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    parser : function
+        Called as parser(filepath, **options), must return an array or a dict
+        of arrays
+    **options
+        Parse options passed to parser, also part of the cache key
+
+    Returns
+    -------
+    array or dict
+        Parsed data, arrays are memory mapped from the cache on a hit
+
+    '''
+    if not enabled:
+        return parser(filepath, **options)
+
+    key = cache_key(filepath, parser=parser.__module__ + "." + parser.__name__, **options)
+    npy = os.path.join(cache_dir, key + ".npy")
+    npz = os.path.join(cache_dir, key + ".npz")
+
+    # cache hit, mark entry as recently used
+    for entry in (npy, npz):
+        if os.path.exists(entry):
+            try:
+                os.utime(entry)
+                if entry == npy:
+                    return np.asarray(np.load(entry, mmap_mode="c"))
+                with np.load(entry) as f:
+                    return {name: f[name] for name in f.files}
+            except (OSError, ValueError):
+                # entry removed or truncated by another process, parse again
+                break
+
+    data = parser(filepath, **options)
+    if not isinstance(data, dict):
+        data = np.ascontiguousarray(data)
+
+    # cache miss, write atomically so concurrent readers never see partial files
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(data, dict):
+                np.savez(f, **data)
+            else:
+                np.save(f, data)
+        os.replace(tmp, npz if isinstance(data, dict) else npy)
+        _added(os.path.getsize(npz if isinstance(data, dict) else npy))
+    except OSError:
+        pass
+
+    return data
+
+#------------------------------------------------------------------------------
+def _added(nbytes):
+    '''
+    Counts a new cache entry, evicting only once the running total is over
+    max_bytes, so a batch of misses does not rescan the directory each time
+    '''
+    global _total_bytes
+    with _total_lock:
+        if _total_bytes is not None:
+            _total_bytes += nbytes
+        over = _total_bytes is None or _total_bytes > max_bytes
+    if over:
+        evict(int(max_bytes * evict_to) if _total_bytes is not None else max_bytes)
+
+#------------------------------------------------------------------------------
+def _loadtxt(filepath, skiprows=0, delimiter=None, usecols=None):
+    return np.loadtxt(filepath, unpack=True, dtype=float, delimiter=delimiter, 
+                      skiprows=skiprows, usecols=usecols)
+
+#------------------------------------------------------------------------------
+def loadtxt(filepath, skiprows=0, delimiter=None, usecols=None):
+    '''
+    Cached equivalent of np.loadtxt(filepath, unpack=True, dtype=float)
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    skiprows : int, optional
+        Number of rows of metadata at beginning of file. The default is 0.
+    delimiter : str, optional
+        Column delimiter, whitespace if None. The default is None.
+    usecols : list (int), optional
+        Only parse these columns. The default is None (all columns).
+
+    Returns
+    -------
+    list
+        Each column in file returned as a separate list
+
+    '''
+    if usecols is not None:
+        usecols = tuple(usecols)
+    return cached(filepath, _loadtxt, skiprows=skiprows, delimiter=delimiter, usecols=usecols)
+
+#------------------------------------------------------------------------------
+def evict(size):
+    '''
+    Removes least recently used cache entries until the cache fits in size
+
+    Scans the whole cache directory and resets the running size total.
+
+    Parameters
+    ----------
+    size : int
+        Maximum total cache size in bytes
+
+    Returns
+    -------
+    None
+
+    '''
+    global _total_bytes
+    try:
+        entries = [e for e in os.scandir(cache_dir) if e.name.endswith((".npy", ".npz"))]
+    except OSError:
+        return
+
+    stats = []
+    for e in entries:
+        try:
+            stats.append((e.stat().st_mtime, e.stat().st_size, e.path))
+        except OSError:
+            pass
+    total = sum(s[1] for s in stats)
+
+    for mtime, nbytes, entry in sorted(stats):
+        if total <= size:
+            break
+        try:
+            os.remove(entry)
+            total -= nbytes
+        except OSError:
+            # entry still memory mapped (Windows) or already removed
+            pass
+    with _total_lock:
+        _total_bytes = total
+
+#------------------------------------------------------------------------------
+def clear():
+    '''
+    Removes all cache entries
+
+    Returns
+    -------
+    None
+
+    '''
+    evict(0)
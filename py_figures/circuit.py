@@ -0,0 +1,400 @@
+"""
+Equivalent-circuit fitting for EIS cycles
+
+Fits the R0-(R1||CPE1)-(R2||CPE2) circuit whose parameters are stored in
+the _params.txt files, with CPE impedance 1 / (Q (j w)^n). Parameter order
+matches the params files: R0, R1, n1, Q1, R2, n2, Q2 (followed by sigma
+and C in the full parameter rows).
+"""
+
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CIRCUIT SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+param_names = ["R0", "R1", "n1", "Q1", "R2", "n2", "Q2"]
+
+# parameters fitted on a log scale (positive, spanning many decades)
+log_params = np.array([True, True, False, True, True, False, True])
+
+# CPE exponent bounds
+n_bounds = (0.3, 1.0)
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CIRCUIT MODEL
+Functions in this section:
+    - circuit_impedance
+    - circuit_jacobian
+    - initial_guess '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def circuit_impedance(params, freq):
+    '''
+    Impedance of the R0-(R1||CPE1)-(R2||CPE2) circuit
+
+    Parameters
+    ----------
+    params : list (float)
+        R0, R1, n1, Q1, R2, n2, Q2, or one row per cycle
+    freq : list (float)
+        Frequencies in Hz
+
+    Returns
+    -------
+    Z : list (complex)
+        Impedance at each frequency, one row per parameter row
+
+    '''
+    p = np.asarray(params, dtype=float)[..., None]
+    jw = 2j * np.pi * np.asarray(freq, dtype=float)
+    R0, R1, n1, Q1, R2, n2, Q2 = [p[..., i, :] for i in range(7)]
+    return R0 + R1 / (1 + R1 * Q1 * jw**n1) + R2 / (1 + R2 * Q2 * jw**n2)
+
+#------------------------------------------------------------------------------
+def circuit_jacobian(params, freq):
+    '''
+    Analytic derivatives of the circuit impedance
+
+    For Z = R / (1 + R Q s^n) with s = j w:
+        dZ/dR = 1 / D^2,  dZ/dQ = -R^2 s^n / D^2,  dZ/dn = -R^2 Q s^n ln(s) / D^2
+
+    Parameters
+    ----------
+    params : list (float)
+        R0, R1, n1, Q1, R2, n2, Q2, or one row per cycle
+    freq : list (float)
+        Frequencies in Hz
+
+    Returns
+    -------
+    Z : list (complex)
+        Impedance at each frequency
+    J : list (complex)
+        dZ/dparam, shape (..., frequencies, 7)
+
+    '''
+    p = np.asarray(params, dtype=float)[..., None]
+    w = 2 * np.pi * np.asarray(freq, dtype=float)
+    log_s = np.log(w) + 0.5j * np.pi
+    J = np.empty(p.shape[:-2] + (len(w), 7), dtype=complex)
+
+    Z = p[..., 0, :] + np.zeros(len(w), dtype=complex)
+    J[..., 0] = 1
+    for R_i, n_i, Q_i in ((1, 2, 3), (4, 5, 6)):
+        R, n, Q = p[..., R_i, :], p[..., n_i, :], p[..., Q_i, :]
+        s_n = np.exp(n * log_s)
+        D = 1 + R * Q * s_n
+        inv_D2 = 1 / (D * D)
+        Z += R / D
+        J[..., R_i] = inv_D2
+        J[..., Q_i] = -R * R * s_n * inv_D2
+        J[..., n_i] = -R * R * Q * s_n * log_s * inv_D2
+
+    return Z, J
+
+#------------------------------------------------------------------------------
+def initial_guess(freq, Z):
+    '''
+    Estimates starting parameters from the shape of one spectrum
+
+    The high-frequency intercept gives R0, the low-frequency end the total
+    resistance, and the frequency of the largest -Z_imag the arc time
+    constants.
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz
+    Z : list (complex)
+        Measured impedance
+
+    Returns
+    -------
+    params : list (float)
+        R0, R1, n1, Q1, R2, n2, Q2
+
+    '''
+    freq = np.asarray(freq, dtype=float)
+    Z = np.asarray(Z)
+    order = np.argsort(freq)
+    w = 2 * np.pi * freq[order]
+    Z = Z[order]
+
+    R0 = max(Z.real[-1], 1e-3 * np.ptp(Z.real))
+    R_total = max(Z.real[0] - R0, 1e-6)
+    R1, R2 = 0.1 * R_total, 0.9 * R_total
+    n = 0.8
+
+    # main arc peaks near w = (R Q)^(-1/n), the second arc a few decades higher
+    w_peak = w[np.argmax(-Z.imag)]
+    Q2 = 1 / (R2 * w_peak**n)
+    Q1 = 1 / (R1 * (min(100 * w_peak, w[-1]))**n)
+
+    return np.array([R0, R1, n, Q1, R2, n, Q2])
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CIRCUIT FITTING
+Functions in this section:
+    - fit_circuit
+    - fit_cycles
+    - fit_curves
+    - full_params
+    - export_fit '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def _to_internal(params):
+    '''
+    Converts parameters to the fitted scale (log for R and Q)
+    '''
+    x = np.array(params, dtype=float)
+    x[..., log_params] = np.log(x[..., log_params])
+    return x
+
+#------------------------------------------------------------------------------
+def _to_params(x):
+    '''
+    Converts fitted-scale values back to circuit parameters
+    '''
+    p = np.array(x, dtype=float)
+    p[..., log_params] = np.exp(p[..., log_params])
+    return p
+
+#------------------------------------------------------------------------------
+def _residuals(x, freq, Z, weight):
+    '''
+    Weighted real/imaginary residuals and their Jacobian in fitted scale
+    '''
+    p = _to_params(x)
+    Zc, J = circuit_jacobian(p, freq)
+    J[..., log_params] *= p[..., None, log_params]
+    dZ = (Zc - Z) * weight
+    J *= weight[..., None]
+    r = np.concatenate((dZ.real, dZ.imag), axis=-1)
+    Jr = np.concatenate((J.real, J.imag), axis=-2)
+    return r, Jr
+
+#------------------------------------------------------------------------------
+def fit_circuit(freq, Z, p0, max_iter=200, tol=1e-8):
+    '''
+    Fits the circuit to one or more spectra with Levenberg-Marquardt
+
+    All spectra are iterated together: each step solves one small normal
+    equation system per spectrum with a batched solve, and spectra drop out
+    once converged. Residuals are weighted by 1/|Z| (modulus weighting).
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz, shared by all spectra
+    Z : list (complex)
+        Measured impedance, one row per spectrum
+    p0 : list (float)
+        Starting parameters, one row per spectrum
+    max_iter : int, optional
+        Maximum number of iterations. The default is 200.
+    tol : float, optional
+        Relative change of the residual sum of squares at which a fit has
+        converged. The default is 1e-8.
+
+    Returns
+    -------
+    params : list (float)
+        Fitted parameters, one row per spectrum
+    chi2 : list (float)
+        Weighted residual sum of squares of each fit
+
+    '''
+    Z = np.atleast_2d(np.asarray(Z, dtype=complex))
+    x = np.atleast_2d(_to_internal(p0)).repeat(len(Z), axis=0) if np.ndim(p0) == 1 \
+        else _to_internal(p0)
+    weight = 1 / np.abs(Z)
+    lam = np.full(len(Z), 1e-3)
+    n_cols = ~log_params & (np.arange(7) > 0)
+
+    r, J = _residuals(x, freq, Z, weight)
+    cost = np.einsum("bi,bi->b", r, r)
+    active = np.ones(len(Z), dtype=bool)
+
+    # trial steps that overflow give NaN costs and are rejected
+    with np.errstate(over="ignore", invalid="ignore"):
+        for it in range(max_iter):
+            idx = np.flatnonzero(active)
+            if len(idx) == 0:
+                break
+            Ja, ra = J[idx], r[idx]
+            JTJ = np.einsum("bij,bik->bjk", Ja, Ja)
+            g = np.einsum("bij,bi->bj", Ja, ra)
+            diag = np.einsum("bjj->bj", JTJ)
+            A = JTJ + (lam[idx, None] * np.maximum(diag, 1e-12))[..., None] * np.eye(7)
+            step = -np.linalg.solve(A, g[..., None])[..., 0]
+
+            x_new = x[idx] + step
+            x_new[:, n_cols] = np.clip(x_new[:, n_cols], *n_bounds)
+            r_new, J_new = _residuals(x_new, freq, Z[idx], weight[idx])
+            cost_new = np.einsum("bi,bi->b", r_new, r_new)
+
+            better = cost_new < cost[idx]
+            change = np.abs(cost[idx] - cost_new) <= tol * cost[idx]
+            acc = idx[better]
+            x[acc], r[acc], J[acc] = x_new[better], r_new[better], J_new[better]
+            lam[acc] /= 3
+            lam[idx[~better]] *= 4
+
+            active[idx[(better & change) | (lam[idx] > 1e10)]] = False
+            cost[acc] = cost_new[better]
+
+    return _to_params(x), cost
+
+#------------------------------------------------------------------------------
+def fit_cycles(freq, expt_re, expt_im, p0=None, warm_start=True, max_iter=200):
+    '''
+    Fits every EIS cycle of an experiment
+
+    With warm_start each cycle starts from the previous cycle's solution,
+    which is close because spectra change gradually, so most cycles
+    converge in a few iterations. Without it all cycles are fitted together
+    from p0 in one batch.
+
+    Parameters
+    ----------
+    freq : list (float)
+        Measurement frequencies in Hz, shared by all cycles (the exported
+        .txt files do not contain them)
+    expt_re : list (float)
+        Real values from observed dataset, one row per cycle
+    expt_im : list (float)
+        Imaginary values from observed dataset (-Z_imag), one row per cycle
+    p0 : list (float), optional
+        Starting parameters R0, R1, n1, Q1, R2, n2, Q2. The default is None
+        (estimated from the first cycle).
+    warm_start : bool, optional
+        Set to False to fit all cycles as one batch from p0. The default is
+        True.
+    max_iter : int, optional
+        Maximum number of iterations per fit. The default is 200.
+
+    Returns
+    -------
+    params : list (float)
+        Fitted R0, R1, n1, Q1, R2, n2, Q2, one row per cycle
+    chi2 : list (float)
+        Weighted residual sum of squares of each cycle
+
+    '''
+    freq = np.asarray(freq, dtype=float)
+    Z = np.array([np.asarray(expt_re[i]) - 1j * np.asarray(expt_im[i])
+                  for i in range(len(expt_re))])
+    if p0 is None:
+        p0 = initial_guess(freq, Z[0])
+
+    if warm_start == False:
+        return fit_circuit(freq, Z, p0, max_iter)
+
+    params = np.empty((len(Z), 7))
+    chi2 = np.empty(len(Z))
+    guess = np.asarray(p0, dtype=float)
+    for i in range(len(Z)):
+        p, c = fit_circuit(freq, Z[i], guess, max_iter)
+        params[i], chi2[i] = p[0], c[0]
+        guess = params[i]
+    return params, chi2
+
+#------------------------------------------------------------------------------
+def fit_curves(params, freq_min, freq_max, pts_per_decade=10):
+    '''
+    Evaluates fitted circuits on a log-spaced frequency grid
+
+    Parameters
+    ----------
+    params : list (float)
+        Fitted parameters, one row per cycle
+    freq_min : float
+        Lowest frequency in Hz
+    freq_max : float
+        Highest frequency in Hz
+    pts_per_decade : int, optional
+        Number of frequencies per decade. The default is 10.
+
+    Returns
+    -------
+    fit_re : list (float)
+        Real values from calculated dataset, one row per cycle
+    fit_im : list (float)
+        Imaginary values from calculated dataset (-Z_imag), one row per cycle
+
+    '''
+    decades = np.log10(freq_max) - np.log10(freq_min)
+    grid = np.logspace(np.log10(freq_max), np.log10(freq_min),
+                       int(np.ceil(decades * pts_per_decade)) + 1)
+    Z = circuit_impedance(np.atleast_2d(params), grid)
+    return Z.real, -Z.imag
+
+#------------------------------------------------------------------------------
+def full_params(params, cell_constant=None):
+    '''
+    Adds conductivity and capacitance to fitted parameters
+
+    Parameters
+    ----------
+    params : list (float)
+        Fitted R0, R1, n1, Q1, R2, n2, Q2, one row per cycle
+    cell_constant : float, optional
+        Thickness / area of the pellet in 1/cm. The default is None (sigma
+        is NaN).
+
+    Returns
+    -------
+    param_vals : list (float)
+        R0, R1, n1, Q1, R2, n2, Q2, sigma (S/cm), C (F), one row per cycle,
+        as read by EIS.import_param_vals
+
+    '''
+    params = np.atleast_2d(params)
+    R1, n1, Q1 = params[:, 1], params[:, 2], params[:, 3]
+    sigma = cell_constant / R1 if cell_constant is not None else np.full(len(params), np.nan)
+    C = (Q1 * R1**(1 - n1))**(1 / n1)
+    return np.column_stack((params, sigma, C))
+
+#------------------------------------------------------------------------------
+def export_fit(path, fn, cycles, fit_re, fit_im, param_vals):
+    '''
+    Writes _fit.txt and _params.txt files for each cycle
+
+    Parameters
+    ----------
+    path : str
+        File directory path
+    fn : str
+        File name, see readme for formatting information
+    cycles : list (int)
+        Cycle numbers
+    fit_re : list (float)
+        Real values from calculated dataset, one row per cycle
+    fit_im : list (float)
+        Imaginary values from calculated dataset, one row per cycle
+    param_vals : list (float)
+        Parameters from full_params, one row per cycle
+
+    Returns
+    -------
+    None
+
+    '''
+    for i, cycle in enumerate(cycles):
+        base = path + fn + "_cycle" + str(cycle)
+        with open(base + "_fit.txt", "w") as f:
+            f.write("Real Imaginary\n")
+            for (x, y) in zip(fit_re[i].tolist(), fit_im[i].tolist()):
+                f.write("{0} {1}\n".format(x, y))
+        with open(base + "_params.txt", "w") as f:
+            for val in param_vals[i].tolist():
+                f.write("{0}\n".format(val))
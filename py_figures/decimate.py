@@ -0,0 +1,231 @@
+"""
+Level-of-detail reduction for dense plot layers
+"""
+
+import numpy as np
+from .export import dpi_profiles
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' DECIMATION
+Functions in this section:
+    - output_dpi
+    - axes_pixels
+    - pixel_decimate
+    - minmax_decimate
+    - lttb_decimate '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def output_dpi(decimate):
+    '''
+    Output resolution of a plotting function's decimate option
+
+    Parameters
+    ----------
+    decimate : bool, str or float
+        True for the default save_fig profile ("print"), an export profile
+        name (see export.dpi_profiles) or a dpi value
+
+    Returns
+    -------
+    dpi : float
+        Resolution the figure will be saved at
+
+    '''
+    if decimate is True:
+        return dpi_profiles["print"]
+    if isinstance(decimate, str):
+        return dpi_profiles[decimate]
+    return decimate
+
+#------------------------------------------------------------------------------
+def axes_pixels(ax, dpi=None):
+    '''
+    Size of the plotting area of an axes in output pixels
+
+    Parameters
+    ----------
+    ax : axes
+        Axes to measure
+    dpi : float, optional
+        Output resolution, e.g. the dpi used when saving. The default is None
+        (figure dpi).
+
+    Returns
+    -------
+    width : int
+        Width in pixels
+    height : int
+        Height in pixels
+
+    '''
+    fig = ax.get_figure()
+    bbox = ax.get_position()
+    width_in, height_in = fig.get_size_inches()
+    if dpi is None:
+        dpi = fig.dpi
+    width = max(int(np.ceil(bbox.width * width_in * dpi)), 1)
+    height = max(int(np.ceil(bbox.height * height_in * dpi)), 1)
+    return width, height
+
+#------------------------------------------------------------------------------
+def pixel_decimate(x, y, x_lim, y_lim, width, height):
+    '''
+    Reduces scatter data to one point per occupied pixel
+
+    Points outside the axis limits are dropped and only the first point that
+    falls into each pixel is kept, so the rendered markers are unchanged
+    while the point count is bounded by width * height.
+
+    Parameters
+    ----------
+    x : list (float)
+        X-axis values
+    y : list (float)
+        Y-axis values
+    x_lim : list (float)
+        Tuple with x-axis minimum and maximum
+    y_lim : list (float)
+        Tuple with y-axis minimum and maximum
+    width : int
+        Axes width in pixels
+    height : int
+        Axes height in pixels
+
+    Returns
+    -------
+    x : list (float)
+        Kept x-axis values
+    y : list (float)
+        Kept y-axis values
+
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    visible = np.flatnonzero((x >= x_lim[0]) & (x <= x_lim[1]) &
+                             (y >= y_lim[0]) & (y <= y_lim[1]))
+    xv = x[visible]
+    yv = y[visible]
+
+    col = ((xv - x_lim[0]) * (width / (x_lim[1] - x_lim[0]))).astype(np.int64)
+    row = ((yv - y_lim[0]) * (height / (y_lim[1] - y_lim[0]))).astype(np.int64)
+    cell = col * (height + 1) + row
+
+    cells, first = np.unique(cell, return_index=True)
+    keep = visible[np.sort(first)]
+
+    return x[keep], y[keep]
+
+#------------------------------------------------------------------------------
+def minmax_decimate(x, y, x_lim, width):
+    '''
+    Reduces line data to the min/max envelope of each pixel column
+
+    The first, last, minimum and maximum point of every pixel column are
+    kept in their original order, so spikes are preserved and the drawn
+    line is unchanged. One point beyond each axis limit is kept so the line
+    still runs to the edge of the axes.
+
+    Parameters
+    ----------
+    x : list (float)
+        X-axis values, in ascending order
+    y : list (float)
+        Y-axis values
+    x_lim : list (float)
+        Tuple with x-axis minimum and maximum
+    width : int
+        Axes width in pixels
+
+    Returns
+    -------
+    x : list (float)
+        Kept x-axis values
+    y : list (float)
+        Kept y-axis values
+
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    lo = max(np.searchsorted(x, x_lim[0], side="left") - 1, 0)
+    hi = min(np.searchsorted(x, x_lim[1], side="right") + 1, len(x))
+    xv = x[lo:hi]
+    yv = y[lo:hi]
+    # at most 4 points are kept per pixel column the data spans
+    if len(xv) == 0 or len(xv) <= 4 * ((xv[-1] - xv[0]) * width / (x_lim[1] - x_lim[0]) + 2):
+        return xv, yv
+
+    col = np.clip(((xv - x_lim[0]) * (width / (x_lim[1] - x_lim[0]))).astype(np.int64), -1, width)
+
+    # x is sorted, so each pixel column is a contiguous run
+    starts = np.flatnonzero(np.diff(col)) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(col)])) - 1
+
+    # order points by (column, y), the first and last of each run are min and max
+    order = np.lexsort((yv, col))
+    mins = order[starts]
+    maxs = order[ends]
+
+    keep = np.unique(np.concatenate((starts, ends, mins, maxs)))
+
+    return xv[keep], yv[keep]
+
+#------------------------------------------------------------------------------
+def lttb_decimate(x, y, num_out):
+    '''
+    Reduces line data with the largest-triangle-three-buckets algorithm
+
+    The points are split into num_out - 2 buckets between the first and last
+    point. From each bucket the point forming the largest triangle with the
+    previously kept point and the mean of the next bucket is kept, which
+    follows the visual shape of the line (Steinarsson, 2013).
+
+    Parameters
+    ----------
+    x : list (float)
+        X-axis values, in ascending order
+    y : list (float)
+        Y-axis values
+    num_out : int
+        Number of points to keep
+
+    Returns
+    -------
+    x : list (float)
+        Kept x-axis values
+    y : list (float)
+        Kept y-axis values
+
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if num_out >= n or num_out < 3:
+        return x, y
+
+    # bucket edges for the points between the first and the last
+    edges = np.linspace(1, n - 1, num_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n-1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n-1], edges[:-1]) / counts
+    # the last bucket looks ahead to the last point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    keep = np.empty(num_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(num_out - 2):
+        lo, hi = edges[i], edges[i+1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + np.argmax(area)
+        keep[i+1] = a
+
+    return x[keep], y[keep]
@@ -0,0 +1,240 @@
+"""
+Figure export functions
+"""
+
+import numpy as np
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' EXPORT SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# output resolution for each export profile
+dpi_profiles = {"screen": 100, "preview": 300, "print": 1000}
+
+# layers with at least this many points are rasterized in vector output
+dense_points = 5000
+
+_pool = None
+_pending = []
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' FIGURE EXPORT
+Functions in this section:
+    - get_figure
+    - rasterize_dense
+    - tight_bbox
+    - save_figure
+    - render_figure
+    - save_async
+    - wait_saves '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def get_figure(plot):
+    '''
+    Finds the figure behind a plot
+
+    Parameters
+    ----------
+    plot : figure, axes or list (axes)
+        Figure, pyplot module, or axes returned by a plotting function
+
+    Returns
+    -------
+    fig : figure
+        Figure to save
+
+    '''
+    if hasattr(plot, "savefig") and hasattr(plot, "gcf"):
+        return plot.gcf()
+    if hasattr(plot, "savefig"):
+        return plot
+    if isinstance(plot, (list, tuple, np.ndarray)):
+        return np.ravel(plot)[0].get_figure()
+    return plot.get_figure()
+
+#------------------------------------------------------------------------------
+def rasterize_dense(fig, min_points=None):
+    '''
+    Rasterizes dense data layers so vector output stays small
+
+    Axes, ticks and text stay vector graphics.
+
+    Parameters
+    ----------
+    fig : figure
+        Figure to modify
+    min_points : int, optional
+        Layers with at least this many points are rasterized. The default is
+        None (use dense_points).
+
+    Returns
+    -------
+    None
+
+    '''
+    if min_points is None:
+        min_points = dense_points
+    for ax in fig.axes:
+        for artist in ax.lines:
+            if len(artist.get_xydata()) >= min_points:
+                artist.set_rasterized(True)
+        for artist in ax.collections:
+            if hasattr(artist, "get_offsets") and len(artist.get_offsets()) >= min_points:
+                artist.set_rasterized(True)
+            elif hasattr(artist, "get_segments"):
+                if sum(len(seg) for seg in artist.get_segments()) >= min_points:
+                    artist.set_rasterized(True)
+
+#------------------------------------------------------------------------------
+def tight_bbox(fig, pad_inches=0.2):
+    '''
+    Computes the tight bounding box of a figure once
+
+    Pass the result to save_figure to skip the extra layout pass that
+    bbox_inches="tight" runs on every save.
+
+    Parameters
+    ----------
+    fig : figure
+        Figure to measure
+    pad_inches : float, optional
+        Padding around the figure. The default is 0.2.
+
+    Returns
+    -------
+    bbox : Bbox
+        Bounding box in inches
+
+    '''
+    renderer = fig.canvas.get_renderer()
+    return fig.get_tightbbox(renderer).padded(pad_inches)
+
+#------------------------------------------------------------------------------
+def save_figure(plot, path, fn, fmt="png", profile="print", rasterize=True, bbox=None):
+    '''
+    Saves a figure in the requested format
+
+    Parameters
+    ----------
+    plot : figure, axes or list (axes)
+        Figure, pyplot module, or axes returned by a plotting function
+    path : str
+        File directory path
+    fn : str
+        File name to save to, without extension
+    fmt : str, optional
+        File format, "png", "svg" or "pdf". The default is "png".
+    profile : str or float, optional
+        "screen" (100 dpi), "preview" (300 dpi), "print" (1000 dpi) or a dpi
+        value. The default is "print".
+    rasterize : bool, optional
+        Set to False to keep dense data layers as vectors in svg/pdf output.
+        The default is True.
+    bbox : Bbox, optional
+        Precomputed bounding box from tight_bbox or a previous save. The
+        default is None (computed once here).
+
+    Returns
+    -------
+    bbox : Bbox
+        Bounding box used, can be reused for other formats of the same figure
+
+    '''
+    fig = get_figure(plot)
+    dpi = dpi_profiles[profile] if isinstance(profile, str) else profile
+
+    if fmt != "png" and rasterize == True:
+        rasterize_dense(fig)
+    if bbox is None:
+        bbox = tight_bbox(fig)
+
+    save = path + fn + "." + fmt
+    fig.savefig(save, format=fmt, bbox_inches=bbox, dpi=dpi)
+    return bbox
+
+#------------------------------------------------------------------------------
+def render_figure(plot, fmt="png", profile="print", rasterize=True, bbox=None):
+    '''
+    Renders a figure into memory in the requested format
+
+    Parameters
+    ----------
+    See save_figure.
+
+    Returns
+    -------
+    data : bytes
+        Contents of the image file
+    bbox : Bbox
+        Bounding box used
+
+    '''
+    fig = get_figure(plot)
+    dpi = dpi_profiles[profile] if isinstance(profile, str) else profile
+
+    if fmt != "png" and rasterize == True:
+        rasterize_dense(fig)
+    if bbox is None:
+        bbox = tight_bbox(fig)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, bbox_inches=bbox, dpi=dpi)
+    return buf.getvalue(), bbox
+
+#------------------------------------------------------------------------------
+def save_async(plot, path, fn, fmt="png", profile="print", rasterize=True, bbox=None):
+    '''
+    Saves a figure, writing the file in a background thread
+
+    Matplotlib is not thread-safe and reads rcParams (e.g. svg.fonttype or
+    path.simplify) while drawing, so the figure is rendered into memory on
+    the calling thread, inside the caller's style. Only writing the bytes
+    to disk overlaps with building the next figure.
+
+    Parameters
+    ----------
+    See save_figure.
+
+    Returns
+    -------
+    future : Future
+        Completes with the bounding box used once the file is written
+
+    '''
+    global _pool
+    data, bbox = render_figure(plot, fmt, profile, rasterize, bbox)
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=2)
+
+    future = _pool.submit(_write_file, path + fn + "." + fmt, data, bbox)
+    _pending.append(future)
+    return future
+
+#------------------------------------------------------------------------------
+def _write_file(filepath, data, bbox):
+    '''
+    Writes rendered figure bytes, returns the bounding box for save_async
+    '''
+    with open(filepath, "wb") as f:
+        f.write(data)
+    return bbox
+
+#------------------------------------------------------------------------------
+def wait_saves():
+    '''
+    Waits for all background saves to finish
+
+    Returns
+    -------
+    None
+
+    '''
+    while len(_pending) > 0:
+        _pending.pop(0).result()
@@ -0,0 +1,233 @@
+"""
+Kramers-Kronig validity test for EIS cycles
+
+Lin-KK test (Schonleber et al., Electrochim. Acta 131 (2014) 20): each
+spectrum is fitted with a series resistance and M RC elements with time
+constants spread over the measured frequency range. Such a circuit always
+satisfies the Kramers-Kronig relations, so large relative residuals mark
+cycles that are not linear, causal and stable. The fit is linear and
+weighted by 1/|Z|. The design matrix only depends on the frequency grid,
+so it is QR-factorized once per grid and the weights of each cycle are
+applied in a small reweighted system on the cached factors.
+"""
+
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' KK SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# over-fitting limit of the mu criterion for choosing the number of RC elements
+mu_limit = 0.85
+
+# largest number of RC elements tried, as a fraction of the number of
+# frequencies, so the fit never simply interpolates every point
+max_rc_ratio = 0.5
+
+# RC time constants extend this many decades beyond the measured range, so
+# arcs that are only partly measured are still described
+tau_extend = 1
+
+# factorized design matrices, by frequency grid and number of RC elements
+_factors = {}
+max_factors = 64
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' LIN-KK TEST
+Functions in this section:
+    - kk_design
+    - solve_upper
+    - kk_fit
+    - kk_test '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def kk_design(freq, num_rc):
+    '''
+    Builds and factorizes the Lin-KK design matrix of a frequency grid
+
+    Results are cached, so cycles measured on the same grid share one
+    factorization.
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz
+    num_rc : int
+        Number of RC elements
+
+    Returns
+    -------
+    A : list (float)
+        Design matrix, real parts stacked over imaginary parts, columns are
+        the series resistance and each RC element with unit resistance
+    Q : list (float)
+        Orthonormal factor of A
+    R : list (float)
+        Upper triangular factor of A
+
+    '''
+    freq = np.asarray(freq, dtype=float)
+    key = (freq.tobytes(), num_rc)
+    if key in _factors:
+        return _factors[key]
+
+    w = 2 * np.pi * freq
+    tau = np.logspace(np.log10(1 / w.max()) - tau_extend, np.log10(1 / w.min()) + tau_extend,
+                      num_rc)
+    wt = w[:, None] * tau[None, :]
+    A = np.zeros((2 * len(w), num_rc + 1))
+    A[:len(w), 0] = 1
+    A[:len(w), 1:] = 1 / (1 + wt**2)
+    A[len(w):, 1:] = -wt / (1 + wt**2)
+    Q, R = np.linalg.qr(A)
+
+    if len(_factors) >= max_factors:
+        _factors.pop(next(iter(_factors)))
+    _factors[key] = (A, Q, R)
+    return A, Q, R
+
+#------------------------------------------------------------------------------
+def solve_upper(R, y):
+    '''
+    Back substitution for a stack of upper triangular systems
+
+    Parameters
+    ----------
+    R : list (float)
+        Upper triangular matrices, shape (cycles, n, n), or one (n, n)
+        matrix shared by all cycles
+    y : list (float)
+        Right-hand sides, shape (cycles, n)
+
+    Returns
+    -------
+    x : list (float)
+        Solutions of R x = y, shape (cycles, n)
+
+    '''
+    n = R.shape[-1]
+    R = np.broadcast_to(R, (len(y), n, n))
+    x = np.zeros(y.shape)
+    for k in range(n - 1, -1, -1):
+        x[:, k] = (y[:, k] - np.einsum("ij,ij->i", R[:, k, k + 1:], x[:, k + 1:])) / R[:, k, k]
+    return x
+
+#------------------------------------------------------------------------------
+def kk_fit(freq, Z, num_rc):
+    '''
+    Fits the Lin-KK circuit to all cycles, weighted by 1/|Z|
+
+    With A = QR cached for the grid and W the weights of a cycle, the
+    weighted normal equations A^T W^2 A c = A^T W^2 b become
+    R^T (Q^T W^2 Q) R c = R^T Q^T W^2 b, i.e. the small system
+    (Q^T W^2 Q) y = Q^T W^2 b followed by the triangular solve R c = y.
+    Q has orthonormal columns, so the reweighted matrix is only as badly
+    conditioned as the squared range of the weights, not of A.
+
+    Parameters
+    ----------
+    freq : list (float)
+        Frequencies in Hz, shared by all cycles
+    Z : list (complex)
+        Measured impedance, one row per cycle
+    num_rc : int
+        Number of RC elements
+
+    Returns
+    -------
+    coefs : list (float)
+        Series resistance and RC resistances, one row per cycle
+    Z_fit : list (complex)
+        Fitted impedance, one row per cycle
+
+    '''
+    Z = np.atleast_2d(Z)
+    A, Q, R = kk_design(freq, num_rc)
+    wgt = np.tile(1 / np.abs(Z), 2)
+    b = np.concatenate((Z.real, Z.imag), axis=1) * wgt
+    Qw = Q[None] * wgt[:, :, None]
+    G = np.matmul(Qw.transpose(0, 2, 1), Qw)
+    y = np.linalg.solve(G, np.einsum("kij,ki->kj", Qw, b)[:, :, None])[:, :, 0]
+    coefs = solve_upper(R, y)
+    fit = coefs @ A.T
+    F = Z.shape[1]
+    return coefs, fit[:, :F] + 1j * fit[:, F:]
+
+#------------------------------------------------------------------------------
+def kk_test(freq, expt_re, expt_im, num_rc=None, threshold=0.01):
+    '''
+    Kramers-Kronig test of every cycle of an experiment
+
+    Parameters
+    ----------
+    freq : list (float)
+        Measurement frequencies in Hz, shared by all cycles (the exported
+        .txt files do not contain them)
+    expt_re : list (float)
+        Real values from observed dataset, one row per cycle
+    expt_im : list (float)
+        Imaginary values from observed dataset (-Z_imag), one row per cycle
+    num_rc : int, optional
+        Number of RC elements. The default is None (chosen per cycle with
+        the mu criterion: the smallest number with mu < mu_limit, at most
+        max_rc_ratio times the number of frequencies).
+    threshold : float, optional
+        Largest relative residual of a passing cycle. The default is 0.01.
+
+    Returns
+    -------
+    res_re : list (float)
+        Real residuals relative to |Z|, one row per cycle
+    res_im : list (float)
+        Imaginary residuals relative to |Z|, one row per cycle
+    passed : list (bool)
+        True for cycles with all residuals within threshold
+    num_rc : list (int)
+        Number of RC elements used for each cycle
+
+    '''
+    freq = np.asarray(freq, dtype=float)
+    Z = np.array([np.asarray(expt_re[i]) - 1j * np.asarray(expt_im[i])
+                  for i in range(len(expt_re))])
+    num = len(Z)
+
+    if num_rc is not None:
+        used = np.full(num, num_rc)
+        coefs, Z_fit = kk_fit(freq, Z, num_rc)
+    else:
+        # add RC elements until negative resistances signal over-fitting.
+        # Before the fit reaches the threshold, negative resistances come
+        # from the finite tau grid ringing around sharp arcs rather than
+        # from fitted noise, so mu only stops cycles whose fit is within
+        # threshold. Each cycle keeps its best fit up to that point.
+        max_rc = max(int(max_rc_ratio * len(freq)), 1)
+        used = np.zeros(num, dtype=int)
+        Z_fit = np.empty_like(Z)
+        best = np.full(num, np.inf)
+        done = np.zeros(num, dtype=bool)
+        for m in range(1, max_rc + 1):
+            todo = np.flatnonzero(~done)
+            if len(todo) == 0:
+                break
+            coefs, fit = kk_fit(freq, Z[todo], m)
+            err = np.abs((Z[todo] - fit) / np.abs(Z[todo])).max(axis=1)
+            R_k = coefs[:, 1:]
+            pos = np.maximum(R_k, 0).sum(axis=1)
+            neg = -np.minimum(R_k, 0).sum(axis=1)
+            mu = 1 - neg / np.maximum(pos, np.finfo(float).tiny)
+
+            better = err < best[todo]
+            best[todo[better]] = err[better]
+            used[todo[better]] = m
+            Z_fit[todo[better]] = fit[better]
+            done[todo] = (err <= threshold) & (mu < mu_limit)
+
+    res = (Z - Z_fit) / np.abs(Z)
+    res_re, res_im = res.real, -res.imag
+    passed = np.maximum(np.abs(res_re), np.abs(res_im)).max(axis=1) <= threshold
+    return res_re, res_im, passed, used
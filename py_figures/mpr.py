@@ -0,0 +1,390 @@
+"""
+Streaming reader for BioLogic .mpr files
+"""
+
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' MPR FILE LAYOUT '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+file_magic = b"BIO-LOGIC MODULAR FILE\x1a                         \x00\x00\x00\x00"
+module_magic = b"MODULE"
+
+# header following each MODULE keyword
+module_header = np.dtype([("short_name", "S10"), ("long_name", "S25"), ("length", "<u4"),
+                          ("version", "<u4"), ("date", "S8")])
+
+# data records start at a fixed offset within the data module, by module version
+data_start = {2: 0x0195, 3: 0x0196}
+
+# flag column IDs, all packed into a single byte per record
+flag_columns = {
+    0x0001: (0b00000011, "mode"),
+    0x0002: (0b00000100, "ox/red"),
+    0x0003: (0b00001000, "error"),
+    0x0015: (0b00010000, "control changes"),
+    0x001F: (0b00100000, "Ns changes"),
+    0x0041: (0b10000000, "counter inc."),
+}
+
+# data column IDs with dtype and name
+data_columns = {
+    0x0004: ("<f8", "time"),
+    0x0005: ("<f4", "control_V/I"),
+    0x0006: ("<f4", "Ewe"),
+    0x0007: ("<f8", "dq"),
+    0x0008: ("<f4", "I"),
+    0x0009: ("<f4", "Ece"),
+    0x000B: ("<f8", "<I>"),
+    0x000D: ("<f8", "(Q-Qo)"),
+    0x0010: ("<f4", "Analog IN 1"),
+    0x0011: ("<f4", "Analog IN 2"),
+    0x0013: ("<f4", "control_V"),
+    0x0014: ("<f4", "control_I"),
+    0x0017: ("<f8", "dQ"),
+    0x0018: ("<f8", "cycle number"),
+    0x0020: ("<f4", "freq"),
+    0x0021: ("<f4", "|Ewe|"),
+    0x0022: ("<f4", "|I|"),
+    0x0023: ("<f4", "Phase(Z)"),
+    0x0024: ("<f4", "|Z|"),
+    0x0025: ("<f4", "Re(Z)"),
+    0x0026: ("<f4", "-Im(Z)"),
+    0x0027: ("<u2", "I Range"),
+    0x0046: ("<f4", "P"),
+    0x004A: ("<f8", "Energy"),
+    0x004B: ("<f4", "Analog OUT"),
+    0x004C: ("<f4", "<I>"),
+    0x004D: ("<f4", "<Ewe>"),
+    0x004E: ("<f4", "Cs-2"),
+    0x0060: ("<f4", "|Ece|"),
+    0x0062: ("<f4", "Phase(Zce)"),
+    0x0063: ("<f4", "|Zce|"),
+    0x0064: ("<f4", "Re(Zce)"),
+    0x0065: ("<f4", "-Im(Zce)"),
+    0x007B: ("<f8", "Energy charge"),
+    0x007C: ("<f8", "Energy discharge"),
+    0x007D: ("<f8", "Capacitance charge"),
+    0x007E: ("<f8", "Capacitance discharge"),
+    0x0083: ("<u2", "Ns"),
+    0x00A3: ("<f4", "|Estack|"),
+    0x00A8: ("<f4", "Rcmp"),
+    0x00A9: ("<f4", "Cs"),
+    0x00AC: ("<f4", "Cp"),
+    0x00AD: ("<f4", "Cp-2"),
+    0x00AE: ("<f4", "<Ewe>"),
+    0x00F1: ("<f4", "|E1|"),
+    0x00F2: ("<f4", "|E2|"),
+    0x010F: ("<f4", "Phase(Z1)"),
+    0x0110: ("<f4", "Phase(Z2)"),
+    0x012D: ("<f4", "|Z1|"),
+    0x012E: ("<f4", "|Z2|"),
+    0x014B: ("<f4", "Re(Z1)"),
+    0x014C: ("<f4", "Re(Z2)"),
+    0x0169: ("<f4", "-Im(Z1)"),
+    0x016A: ("<f4", "-Im(Z2)"),
+    0x0187: ("<f4", "<E1>"),
+    0x0188: ("<f4", "<E2>"),
+    0x01A6: ("<f4", "Phase(Zstack)"),
+    0x01A7: ("<f4", "|Zstack|"),
+    0x01A8: ("<f4", "Re(Zstack)"),
+    0x01A9: ("<f4", "-Im(Zstack)"),
+    0x01AA: ("<f4", "<Estack>"),
+    0x01AE: ("<f4", "Phase(Zwe-ce)"),
+    0x01AF: ("<f4", "|Zwe-ce|"),
+    0x01B0: ("<f4", "Re(Zwe-ce)"),
+    0x01B1: ("<f4", "-Im(Zwe-ce)"),
+    0x01B2: ("<f4", "(Q-Qo)"),
+    0x01B3: ("<f4", "dQ"),
+    0x01B9: ("<f4", "<Ece>"),
+    0x01CE: ("<f4", "Temperature"),
+    0x01D3: ("<f8", "Q charge/discharge"),
+    0x01D4: ("<u4", "half cycle"),
+    0x01D5: ("<u4", "z cycle"),
+    0x01D7: ("<f4", "<Ece>"),
+    0x01D9: ("<f4", "THD Ewe"),
+    0x01DA: ("<f4", "THD I"),
+    0x01DC: ("<f4", "NSD Ewe"),
+    0x01DD: ("<f4", "NSD I"),
+    0x01DF: ("<f4", "NSR Ewe"),
+    0x01E0: ("<f4", "NSR I"),
+}
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' MPR DATA MANAGEMENT
+Functions in this section:
+    - read_modules
+    - data_layout
+    - mpr_columns
+    - load_mpr
+    - iter_mpr
+    - merge_mpr '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_modules(filepath):
+    '''
+    Reads the module headers of a .mpr file without loading module data
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to .mpr file
+
+    Returns
+    -------
+    modules : list (dict)
+        Name, version, date, data offset and data length of each module
+
+    '''
+    modules = []
+    with open(filepath, "rb") as f:
+        if f.read(len(file_magic)) != file_magic:
+            raise ValueError(filepath + " is not a BioLogic .mpr file")
+
+        while True:
+            magic = f.read(len(module_magic))
+            if len(magic) == 0:
+                break
+            if magic != module_magic:
+                raise ValueError("Unexpected module layout at byte " + str(f.tell() - len(magic)))
+
+            header = np.frombuffer(f.read(module_header.itemsize), dtype=module_header)[0]
+            offset = f.tell()
+            modules.append({"name": header["short_name"].decode("ascii").strip(),
+                            "version": int(header["version"]),
+                            "date": header["date"].decode("ascii"),
+                            "offset": offset,
+                            "length": int(header["length"])})
+            f.seek(offset + int(header["length"]))
+
+    return modules
+
+#------------------------------------------------------------------------------
+def data_layout(filepath):
+    '''
+    Reads the record layout of the data module of a .mpr file
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to .mpr file
+
+    Returns
+    -------
+    record : dtype
+        Structured dtype of one data record
+    num_points : int
+        Number of records
+    offset : int
+        Byte offset of first record in file
+    flags : dict
+        Bitmask of each flag column packed into the "flags" field
+
+    '''
+    data_module = [m for m in read_modules(filepath) if m["name"] == "VMP data"]
+    if len(data_module) == 0:
+        raise ValueError("No data module in " + filepath)
+    data_module = data_module[0]
+    if data_module["version"] not in data_start:
+        raise ValueError("Unknown data module version: " + str(data_module["version"]))
+
+    with open(filepath, "rb") as f:
+        f.seek(data_module["offset"])
+        head = f.read(5)
+        num_points = int(np.frombuffer(head, dtype="<u4", count=1)[0])
+        num_cols = head[4]
+        column_ids = np.frombuffer(f.read(2 * num_cols), dtype="<u2")
+
+    fields = []
+    flags = {}
+    for col in column_ids.tolist():
+        if col in flag_columns:
+            mask, name = flag_columns[col]
+            flags[name] = mask
+            if ("flags", "u1") not in fields:
+                fields.append(("flags", "u1"))
+        elif col in data_columns:
+            dtype, name = data_columns[col]
+            fields.append((name, dtype))
+        else:
+            raise ValueError("Unknown column ID: " + str(col))
+
+    offset = data_module["offset"] + data_start[data_module["version"]]
+    return np.dtype(fields), num_points, offset, flags
+
+#------------------------------------------------------------------------------
+def mpr_columns(filepath):
+    '''
+    Lists the columns available in a .mpr file
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to .mpr file
+
+    Returns
+    -------
+    names : list (str)
+        Column names
+
+    '''
+    record, num_points, offset, flags = data_layout(filepath)
+    return [n for n in record.names if n != "flags"] + list(flags)
+
+#------------------------------------------------------------------------------
+def _select(records, columns, flags):
+    '''
+    Returns requested columns of a block of records, data columns are views
+    '''
+    data = {}
+    for name in columns:
+        if name in flags:
+            mask = flags[name]
+            shift = (mask & -mask).bit_length() - 1
+            data[name] = (records["flags"] & mask) >> shift
+        else:
+            data[name] = records[name]
+    return data
+
+#------------------------------------------------------------------------------
+def _open_records(filepath, columns):
+    '''
+    Memory maps the data records of a .mpr file and checks requested columns
+    '''
+    record, num_points, offset, flags = data_layout(filepath)
+    if columns is None:
+        columns = [n for n in record.names if n != "flags"] + list(flags)
+
+    missing = [c for c in columns if c not in flags and c not in record.names]
+    if len(missing) > 0:
+        raise KeyError("Columns not in file: " + ", ".join(missing))
+
+    records = np.memmap(filepath, dtype=record, mode="r", offset=offset, shape=(num_points,))
+    return records, columns, flags
+
+#------------------------------------------------------------------------------
+def load_mpr(filepath, columns=None):
+    '''
+    Loads columns from a .mpr file as memory-mapped arrays
+
+    Data columns are zero-copy views into the file, pages are only read from
+    disk when values are accessed. Flag columns are unpacked on load.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to .mpr file
+    columns : list (str), optional
+        Column names to load, e.g. ["time", "<Ewe>"]. The default is None (all).
+
+    Returns
+    -------
+    data : dict
+        Column name mapped to array of values
+
+    '''
+    records, columns, flags = _open_records(filepath, columns)
+    return _select(records, columns, flags)
+
+#------------------------------------------------------------------------------
+def iter_mpr(filepath, columns=None, chunk_pts=1000000):
+    '''
+    Iterates over a .mpr file in blocks of records
+
+    Only one block is paged in at a time, so files larger than memory can be
+    processed.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to .mpr file
+    columns : list (str), optional
+        Column names to load. The default is None (all).
+    chunk_pts : int, optional
+        Number of records per block. The default is 1000000.
+
+    Yields
+    ------
+    data : dict
+        Column name mapped to array of values for one block
+
+    '''
+    records, columns, flags = _open_records(filepath, columns)
+    for start in range(0, len(records), chunk_pts):
+        yield _select(records[start:start+chunk_pts], columns, flags)
+
+#------------------------------------------------------------------------------
+def merge_mpr(filepaths, columns=None, by="time", chunk_pts=1000000):
+    '''
+    Merges several time-sorted .mpr files into one time-ordered stream
+
+    Files are read in blocks with iter_mpr. Each step emits every buffered
+    row up to the smallest last time among the buffers, so only about one
+    block per file is in memory at a time.
+
+    Parameters
+    ----------
+    filepaths : list (str)
+        Full paths to .mpr files, each sorted by the merge column
+    columns : list (str), optional
+        Column names to load, the merge column is always included. The
+        default is None (columns common to all files).
+    by : str, optional
+        Column to merge on. The default is "time".
+    chunk_pts : int, optional
+        Number of records per block read from each file. The default is
+        1000000.
+
+    Yields
+    ------
+    data : dict
+        Column name mapped to array of values for one block, blocks are in
+        order of the merge column and ties keep the order of filepaths
+
+    '''
+    if columns is None:
+        names = [set(mpr_columns(fp)) for fp in filepaths]
+        columns = [c for c in mpr_columns(filepaths[0]) if all(c in n for n in names)]
+    elif by not in columns:
+        columns = [by] + list(columns)
+
+    streams = [iter_mpr(fp, columns, chunk_pts) for fp in filepaths]
+    buffers = [None] * len(streams)
+
+    while True:
+        # refill empty buffers, dropping exhausted files
+        for i, stream in enumerate(streams):
+            while stream is not None and (buffers[i] is None or len(buffers[i][by]) == 0):
+                block = next(stream, None)
+                if block is None:
+                    streams[i] = stream = None
+                    buffers[i] = None
+                else:
+                    buffers[i] = {c: np.asarray(block[c]) for c in columns}
+        active = [i for i in range(len(buffers)) if buffers[i] is not None]
+        if len(active) == 0:
+            return
+
+        # rows up to the smallest buffered maximum cannot be preceded by
+        # rows not read yet. Rows equal to it are held back once an earlier
+        # file may still have unread rows equal to it, so ties stay in file
+        # order. The first file ending at the bound always empties its
+        # buffer, so every step makes progress.
+        bound = min(buffers[i][by][-1] for i in active)
+        parts = []
+        held = False
+        for i in active:
+            cut = np.searchsorted(buffers[i][by], bound, side="left" if held else "right")
+            held = held or buffers[i][by][-1] == bound
+            parts.append({c: buffers[i][c][:cut] for c in columns})
+            buffers[i] = {c: buffers[i][c][cut:] for c in columns}
+
+        merged = {c: np.concatenate([p[c] for p in parts]) for c in columns}
+        order = np.argsort(merged[by], kind="stable")
+        yield {c: merged[c][order] for c in columns}
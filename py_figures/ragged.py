@@ -0,0 +1,398 @@
+"""
+Contiguous containers for variable-length data series
+"""
+
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' RAGGED ARRAYS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class RaggedArray:
+    '''
+    Variable-length rows packed into one contiguous values array
+
+    Row i is values[offsets[i]:offsets[i+1]] and is returned as a view, so
+    indexing works like the lists of arrays returned by the import functions.
+
+    Parameters
+    ----------
+    values : list (float)
+        All rows concatenated
+    offsets : list (int)
+        Start index of each row followed by the total length (len(rows) + 1)
+
+    '''
+    __slots__ = ("values", "offsets")
+
+    def __init__(self, values, offsets):
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, rows, dtype=float):
+        '''
+        Packs a list of arrays into a RaggedArray
+
+        Parameters
+        ----------
+        rows : list (list)
+            Arrays to pack
+        dtype : type, optional
+            Data type of the packed values. The default is float.
+
+        Returns
+        -------
+        RaggedArray
+            Packed rows
+
+        '''
+        lengths = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.empty(offsets[-1], dtype=dtype)
+        for i, r in enumerate(rows):
+            values[offsets[i]:offsets[i+1]] = r
+        return cls(values, offsets)
+
+    @property
+    def lengths(self):
+        '''
+        Number of values in each row
+        '''
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return RaggedArray.from_list([self[j] for j in range(start, stop, step)],
+                                             dtype=self.values.dtype)
+            offsets = self.offsets[start:stop+1]
+            return RaggedArray(self.values[offsets[0]:offsets[-1]], offsets - offsets[0])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("row index out of range")
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def __repr__(self):
+        return "RaggedArray(rows={}, values={})".format(len(self), len(self.values))
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CYCLE TABLES '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class CycleTable:
+    '''
+    Cycle-indexed columns of an electrochemistry dataset
+
+    Every column is one contiguous array shared by all cycles, and cycle i
+    spans rows offsets[i]:offsets[i+1]. Indexing with a cycle number returns
+    a dict of zero-copy column views, so code written for the previous dict
+    of DataFrame slices (e.g. cycles[i]["time"]) keeps working. Indexing with
+    a column name returns that column as a RaggedArray, which can be passed
+    to the plotting functions in place of a list of arrays.
+
+    Parameters
+    ----------
+    columns : dict
+        Column name mapped to array of values, or a DataFrame
+    offsets : list (int)
+        Start row of each cycle followed by the end row of the last cycle
+
+    '''
+    __slots__ = ("columns", "offsets")
+
+    reductions = {"min": np.minimum, "max": np.maximum}
+
+    def __init__(self, columns, offsets):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        end = self.offsets[-1] if len(self.offsets) > 0 else 0
+        # rows after the last complete cycle are dropped, without copying
+        self.columns = {name: np.asarray(columns[name])[:end] for name in columns.keys()}
+
+    @classmethod
+    def from_columns(cls, columns, by=None, tol=0.0):
+        '''
+        Splits a dataset into cycles at detected boundaries, see cycle_offsets
+        '''
+        return cls(columns, cycle_offsets(columns, by, tol))
+
+    @classmethod
+    def from_cycle_pts(cls, columns, cycle_pts):
+        '''
+        Splits a dataset into cycles with a fixed number of points
+
+        Parameters
+        ----------
+        columns : dict
+            Column name mapped to array of values, or a DataFrame
+        cycle_pts : int
+            Number of data points per cycle
+
+        Returns
+        -------
+        CycleTable
+            Dataset split into complete cycles
+
+        '''
+        names = list(columns.keys())
+        num_rows = len(columns[names[0]]) if len(names) > 0 else 0
+        num_cycles = int(num_rows / cycle_pts)
+        return cls(columns, np.arange(num_cycles + 1, dtype=np.int64) * cycle_pts)
+
+    @property
+    def lengths(self):
+        '''
+        Number of rows in each cycle
+        '''
+        return np.diff(self.offsets)
+
+    def keys(self):
+        return self.columns.keys()
+
+    def column(self, name):
+        '''
+        One column as a RaggedArray with a row per cycle (zero-copy)
+        '''
+        return RaggedArray(self.columns[name], self.offsets)
+
+    def reduce(self, name, how="mean"):
+        '''
+        Per-cycle reduction of a column without a Python loop over cycles
+
+        Parameters
+        ----------
+        name : str
+            Column name
+        how : str, optional
+            "min", "max", "sum", "mean", "first" or "last". The default is
+            "mean".
+
+        Returns
+        -------
+        result : list (float)
+            One value per cycle, NaN for empty cycles
+
+        '''
+        values = self.columns[name]
+        starts, lengths = self.offsets[:-1], self.lengths
+        result = np.full(len(self), np.nan)
+        full = lengths > 0
+        if not full.any():
+            return result
+
+        if how == "first":
+            result[full] = values[starts[full]]
+        elif how == "last":
+            result[full] = values[starts[full] + lengths[full] - 1]
+        elif how == "mean":
+            result[full] = np.add.reduceat(values, starts[full], dtype=np.float64) / lengths[full]
+        elif how == "sum":
+            result[full] = np.add.reduceat(values, starts[full], dtype=np.float64)
+        elif how in self.reductions:
+            result[full] = self.reductions[how].reduceat(values, starts[full])
+        else:
+            raise ValueError("unknown reduction: " + str(how))
+        return result
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, str):
+            return self.column(i)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("cycle slices must be contiguous")
+            offsets = self.offsets[start:stop+1]
+            return CycleTable({name: col[offsets[0]:offsets[-1]] for name, col in self.columns.items()},
+                              offsets - offsets[0])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("cycle index out of range")
+        start, stop = self.offsets[i], self.offsets[i+1]
+        return {name: col[start:stop] for name, col in self.columns.items()}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "CycleTable(cycles={}, rows={}, columns={})".format(len(self), self.offsets[-1],
+                                                                   list(self.columns))
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' CYCLE DETECTION
+Functions in this section:
+    - cycle_offsets '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# counter columns, a new cycle starts wherever the value changes
+counter_columns = ("half cycle", "cycle number", "z cycle", "Ns")
+
+# current columns, a new cycle starts wherever the sign of the current flips
+current_columns = ("control_I", "I", "<I>")
+
+#------------------------------------------------------------------------------
+def cycle_offsets(columns, by=None, tol=0.0):
+    '''
+    Finds cycle boundaries of a dataset
+
+    Boundaries are found with vectorized comparisons of neighbouring rows,
+    so the cost is linear in the number of rows and no data is copied.
+    Cycles may have any length, including aborted last cycles.
+
+    Parameters
+    ----------
+    columns : dict
+        Column name mapped to array of values, or a DataFrame
+    by : str, optional
+        Column to split on. Counter columns ("half cycle", "cycle number",
+        "z cycle", "Ns") split where the value changes, "freq" splits where
+        a new frequency sweep starts (EIS) and current columns ("control_I",
+        "I", "<I>") split where the sign of the current flips. The default
+        is None (first available column in that order).
+    tol : float, optional
+        Currents with magnitude up to tol count as rest and stay with the
+        preceding cycle. The default is 0.0.
+
+    Returns
+    -------
+    offsets : list (int)
+        Start row of each cycle followed by the total number of rows, see
+        CycleTable
+
+    '''
+    names = list(columns.keys())
+    if by is None:
+        found = [c for c in counter_columns + ("freq",) + current_columns if c in names]
+        if len(found) == 0:
+            raise ValueError("no cycle number, frequency or current column to split on")
+        by = found[0]
+    values = np.asarray(columns[by])
+    num_rows = len(values)
+    if num_rows == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    if by == "freq":
+        # sweeps run from high to low frequency
+        starts = np.flatnonzero(values[1:] > values[:-1]) + 1
+    elif by in current_columns:
+        sign = np.sign(values) * (np.abs(values) > tol)
+        # rest points take the sign of the last non-rest point, leading rest
+        # points stay zero and belong to the first cycle
+        last = np.where(sign != 0, np.arange(num_rows), 0)
+        np.maximum.accumulate(last, out=last)
+        sign = sign[last]
+        starts = np.flatnonzero((sign[1:] != sign[:-1]) & (sign[:-1] != 0)) + 1
+    else:
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+
+    offsets = np.empty(len(starts) + 2, dtype=np.int64)
+    offsets[0] = 0
+    offsets[1:-1] = starts
+    offsets[-1] = num_rows
+    return offsets
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' ROW ORDERING
+Functions in this section:
+    - sort_order
+    - PermutedColumns '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def sort_order(values):
+    '''
+    Permutation that sorts values, or None if they are already sorted
+
+    Parameters
+    ----------
+    values : list (float)
+        Sort key, e.g. the time column
+
+    Returns
+    -------
+    order : list (int)
+        Stable argsort of values, None if values are non-decreasing (checked
+        in one linear pass)
+
+    '''
+    values = np.asarray(values)
+    if len(values) < 2 or not (values[1:] < values[:-1]).any():
+        return None
+    return np.argsort(values, kind="stable")
+
+#------------------------------------------------------------------------------
+class PermutedColumns:
+    '''
+    Columns of a dataset in a different row order
+
+    Rows are only reordered when a column is accessed, and each column is
+    reordered once, so projecting a few columns of a wide dataset does not
+    copy the rest.
+
+    Parameters
+    ----------
+    columns : dict
+        Column name mapped to array of values, or a DataFrame
+    order : list (int)
+        Row permutation, None for the original order
+    names : list (str), optional
+        Columns to keep. The default is None (all).
+
+    '''
+    __slots__ = ("source", "order", "names", "cache")
+
+    def __init__(self, columns, order, names=None):
+        self.source = columns
+        self.order = order
+        self.names = list(columns.keys()) if names is None else list(names)
+        self.cache = {}
+
+    def keys(self):
+        return list(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        if len(self.names) == 0:
+            return 0
+        return len(self.source[self.names[0]])
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        if name not in self.cache:
+            values = np.asarray(self.source[name])
+            self.cache[name] = values if self.order is None else values[self.order]
+        return self.cache[name]
+
+    def __repr__(self):
+        return "PermutedColumns(rows={}, columns={}, sorted={})".format(len(self), self.names,
+                                                                        self.order is None)
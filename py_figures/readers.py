@@ -0,0 +1,415 @@
+"""
+Fast text readers for numeric data files
+"""
+
+import numpy as np
+import json, mmap, os, re
+from . import cache
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' READER SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# line prefixes of comments in diffraction exports (Bruker .uxd uses ";" and
+# "_KEY=value" lines, .xye and GSAS-II use "#", TOPAS and 11-BM use "'")
+comment_prefixes = ("#", "'", ";", "!", "_")
+
+# whitespace bytes separating values
+_space = np.zeros(256, dtype=bool)
+_space[[9, 10, 13, 32]] = True
+
+# bytes read from the start of a file to detect its layout
+sniff_bytes = 65536
+
+# "#" lines of sectioned exports (PDFgui "#S name" and "#L columns")
+section_line = re.compile(rb"^#([^\r\n]*)", re.M)
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' TEXT READERS
+Functions in this section:
+    - check_rows
+    - read_columns
+    - sniff_header
+    - read_pattern '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def check_rows(raw, ncols, label):
+    '''
+    Checks that every non-blank line of a numeric block has ncols values
+
+    np.fromstring ignores line ends, so a short or long row would silently
+    shift every later value into the wrong column. Values are counted per
+    line on the raw bytes without splitting the block into strings.
+
+    Parameters
+    ----------
+    raw : bytes
+        Numeric block, whitespace separated
+    ncols : int
+        Expected number of values per row
+    label : str
+        File (and section) named in the error message
+
+    Returns
+    -------
+    nrows : int
+        Number of non-blank rows
+
+    Raises
+    ------
+    ValueError
+        If a row does not have ncols values
+
+    '''
+    b = np.frombuffer(raw, dtype=np.uint8)
+    if len(b) == 0:
+        return 0
+    space = _space[b]
+    # first character of each value, and the line it is on
+    starts = np.flatnonzero(~space[1:] & space[:-1]) + 1
+    if not space[0]:
+        starts = np.concatenate(([0], starts))
+    newlines = np.flatnonzero(b == 10)
+    counts = np.bincount(np.searchsorted(newlines, starts), minlength=len(newlines) + 1)
+
+    bad = np.flatnonzero((counts > 0) & (counts != ncols))
+    if len(bad) > 0:
+        row = np.count_nonzero(counts[:bad[0]]) + 1
+        text = raw.split(b"\n", bad[0] + 1)[bad[0]].strip().decode("latin-1")
+        raise ValueError("%s: row %d (%r) has %d values, expected %d"
+                         % (label, row, text, counts[bad[0]], ncols))
+    return np.count_nonzero(counts)
+
+#------------------------------------------------------------------------------
+def read_columns(filepath, skiprows=0, delimiter=None):
+    '''
+    Reads a plain numeric table, equivalent to np.loadtxt(..., unpack=True)
+
+    The whole file is read in one call and parsed in bulk, avoiding the
+    per-line overhead of np.loadtxt on the many small files of a cycle series.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    skiprows : int, optional
+        Number of rows of metadata at beginning of file. The default is 0.
+    delimiter : str, optional
+        Column delimiter, whitespace if None. The default is None.
+
+    Returns
+    -------
+    list
+        Each column in file returned as a separate list
+
+    Raises
+    ------
+    ValueError
+        If the rows do not all have the same number of values, or a value
+        cannot be parsed
+
+    '''
+    with open(filepath, "rb") as f:
+        raw = f.read()
+
+    if skiprows > 0:
+        lines = raw.split(b"\n", skiprows)
+        raw = lines[-1] if len(lines) > skiprows else b""
+    if delimiter is not None and delimiter.strip():
+        raw = raw.replace(delimiter.encode(), b" ")
+
+    text = raw.decode("latin-1")
+    first = text.lstrip().split("\n", 1)[0]
+    ncols = max(len(first.split()), 1)
+
+    nrows = check_rows(raw, ncols, filepath)
+    values = np.fromstring(text, dtype=float, sep=" ") if text.strip() else np.empty(0)
+    if values.size != nrows * ncols:
+        raise ValueError("%s: expected %d rows of %d values, found %d values"
+                         % (filepath, nrows, ncols, values.size))
+    if ncols == 1:
+        return values
+    return np.ascontiguousarray(values.reshape(-1, ncols).T)
+
+#------------------------------------------------------------------------------
+def _numeric(tokens):
+    '''
+    Checks if all tokens of a line are numbers
+    '''
+    try:
+        for t in tokens:
+            float(t)
+    except ValueError:
+        return False
+    return len(tokens) > 0
+
+#------------------------------------------------------------------------------
+def sniff_header(filepath):
+    '''
+    Detects the layout of a diffraction data file from its first kilobytes
+
+    Handles plain .xy/.xye files, GSAS-II FXYE and CSV exports and Bruker
+    and Panalytical text exports: leading metadata lines of any kind are
+    counted as header rows, comment lines (see comment_prefixes) are
+    skipped anywhere and commas are detected as delimiters.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+
+    Returns
+    -------
+    layout : dict
+        "header_rows" (int), "delimiter" ("," or None for whitespace),
+        "ncols" (int), "comments" (comment prefixes found after the header),
+        "names" (list of column names, None if the header does not name
+        every column) and "x_scale" (factor to convert the first column to
+        degrees, 0.01 for GSAS-II FXYE centidegrees)
+
+    '''
+    with open(filepath, "rb") as f:
+        head = f.read(sniff_bytes).decode("latin-1")
+    lines = head.split("\n")
+    if len(lines) > 1 and not head.endswith("\n"):
+        # last line may be cut off
+        lines = lines[:-1]
+
+    def split(line, delimiter):
+        if delimiter is None:
+            return line.split()
+        return [t.strip() for t in line.strip().rstrip(delimiter).split(delimiter)]
+
+    header_rows, delimiter, ncols = len(lines), None, 0
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if len(stripped) == 0 or stripped.startswith(comment_prefixes):
+            continue
+        delim = "," if "," in stripped else None
+        tokens = split(stripped, delim)
+        if not _numeric(tokens):
+            continue
+        # the next data line must have the same number of columns
+        following = [l.strip() for l in lines[i+1:] if l.strip() and not l.strip().startswith(comment_prefixes)]
+        if len(following) > 0:
+            nxt = split(following[0], delim)
+            if len(nxt) != len(tokens) or not _numeric(nxt):
+                continue
+        header_rows, delimiter, ncols = i, delim, len(tokens)
+        break
+
+    # comment lines within the data block
+    comments = sorted(set(l.strip()[0] for l in lines[header_rows:]
+                          if l.strip().startswith(comment_prefixes)))
+
+    # column names from the last header line naming every column, Bruker
+    # ";" and "_" lines only hold metadata
+    names = None
+    x_scale = 1.0
+    for line in lines[:header_rows]:
+        stripped = line.strip()
+        if stripped.upper().startswith("BANK") and "FXYE" in stripped.upper():
+            x_scale = 0.01
+        if stripped.startswith((";", "_", "!")):
+            continue
+        label = split(stripped.lstrip("#'").strip(), delimiter)
+        label = [t.strip("\"'") for t in label]
+        if len(label) == ncols and not _numeric(label):
+            names = label
+
+    return {"header_rows": header_rows, "delimiter": delimiter, "ncols": ncols,
+            "comments": comments, "names": names, "x_scale": x_scale}
+
+#------------------------------------------------------------------------------
+def _parse_pattern(filepath, usecols=None):
+    '''
+    Parses a diffraction data file with its detected layout
+    '''
+    layout = sniff_header(filepath)
+    options = dict(dtype=float, delimiter=layout["delimiter"], skiprows=layout["header_rows"],
+                   usecols=usecols, unpack=True, ndmin=2, encoding="latin-1")
+    # np.loadtxt only stays on its C path with at most one comment character
+    comments = layout["comments"]
+    try:
+        data = np.loadtxt(filepath, comments=comments[0] if len(comments) == 1 else
+                          (None if len(comments) == 0 else comments), **options)
+    except ValueError:
+        # comment lines beyond the sniffed part of the file
+        data = np.loadtxt(filepath, comments=list(comment_prefixes), **options)
+    if layout["x_scale"] != 1.0 and (usecols is None or usecols[0] == 0):
+        data[0] *= layout["x_scale"]
+    return data
+
+#------------------------------------------------------------------------------
+def read_pattern(filepath, usecols=None):
+    '''
+    Reads a diffraction data file without knowing its header layout
+
+    The layout is detected with sniff_header and the numeric block is
+    parsed by the C parser of np.loadtxt. Results are kept in the parsed
+    data cache, so files are only parsed once.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    usecols : list (int), optional
+        Only return these columns. The default is None (all columns).
+
+    Returns
+    -------
+    list
+        Each column in file returned as a separate list
+
+    '''
+    if usecols is not None:
+        usecols = tuple(usecols)
+    return cache.cached(filepath, _parse_pattern, usecols=usecols)
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' SECTIONED FILES
+Functions in this section:
+    - index_sections
+    - read_section '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def _index_path(filepath):
+    '''
+    Path of the section index stored next to a data file
+    '''
+    head, tail = os.path.split(os.path.abspath(filepath))
+    return os.path.join(head, "." + tail + ".sections.json")
+
+#------------------------------------------------------------------------------
+def index_sections(filepath):
+    '''
+    Finds the sections of a PDFgui/PDFfit export
+
+    Each "#S name" line starts a section, its "#L" line names the columns
+    and the data block runs to the next "#" line. The file is memory mapped
+    and only "#" lines are visited. The index is stored next to the file
+    (in the cache directory if that is not writable or the file has no
+    sections) and reused while the file is unchanged.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+
+    Returns
+    -------
+    sections : list (dict)
+        One entry per section with "name" (str), "columns" (list of str),
+        "start" and "end" (byte offsets of the data block)
+
+    '''
+    stat = os.stat(filepath)
+    ident = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+    stored = [_index_path(filepath),
+              os.path.join(cache.cache_dir, cache.cache_key(filepath, index="sections") + ".json")]
+    for fp in stored:
+        try:
+            with open(fp) as f:
+                index = json.load(f)
+            if index["file"] == ident:
+                return index["sections"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    sections = []
+    if stat.st_size > 0:
+        with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            current = None
+            for match in section_line.finditer(mm):
+                kind, text = match.group(1)[:1], match.group(1)[1:].strip().decode("latin-1")
+                if current is not None and current["end"] is None and current["start"] is not None:
+                    # any "#" line ends the data block
+                    current["end"] = match.start()
+                if kind == b"S":
+                    current = {"name": text, "columns": None, "start": None, "end": None}
+                    sections.append(current)
+                elif kind == b"L" and current is not None:
+                    current["columns"] = text.split()
+                    current["start"] = mm.find(b"\n", match.end()) + 1 or len(mm)
+                    current["end"] = None
+            if current is not None and current["start"] is not None and current["end"] is None:
+                current["end"] = len(mm)
+        sections = [s for s in sections if s["start"] is not None]
+
+    # files without sections are plain tables, keep their index out of the
+    # data directory
+    if len(sections) == 0:
+        stored = stored[1:]
+    for fp in stored:
+        try:
+            os.makedirs(os.path.dirname(fp), exist_ok=True)
+            with open(fp, "w") as f:
+                json.dump({"file": ident, "sections": sections}, f)
+            break
+        except OSError:
+            continue
+    return sections
+
+#------------------------------------------------------------------------------
+def read_section(filepath, section=0):
+    '''
+    Reads one section of a PDFgui/PDFfit export
+
+    Only the bytes of the requested section are parsed.
+
+    Parameters
+    ----------
+    filepath : str
+        Full path to data file
+    section : int or str, optional
+        Section position or "#S" name. The default is 0 (first section).
+
+    Returns
+    -------
+    data : dict
+        Column name from the "#L" line mapped to array of values
+
+    Raises
+    ------
+    ValueError
+        If the file has no "#S" sections
+    KeyError
+        If no section has the requested name
+    IndexError
+        If the section position is out of range
+
+    '''
+    sections = index_sections(filepath)
+    if len(sections) == 0:
+        raise ValueError(filepath + ': no "#S" sections with "#L" column names found')
+    if isinstance(section, str):
+        found = [s for s in sections if s["name"] == section]
+        if len(found) == 0:
+            raise KeyError("no section named " + section)
+        entry = found[0]
+    elif -len(sections) <= section < len(sections):
+        entry = sections[section]
+    else:
+        raise IndexError("section %d out of range, %s has %d sections"
+                         % (section, filepath, len(sections)))
+
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        raw = mm[entry["start"]:entry["end"]]
+    ncols = len(entry["columns"])
+    label = "%s, section %r" % (filepath, entry["name"])
+    nrows = check_rows(raw, ncols, label)
+    text = raw.decode("latin-1")
+    values = np.fromstring(text, dtype=float, sep=" ") if text.strip() else np.empty(0)
+    if values.size != nrows * ncols:
+        raise ValueError("%s: expected %d rows of %d values, found %d values"
+                         % (label, nrows, ncols, values.size))
+    values = values.reshape(-1, ncols)
+    return {name: np.ascontiguousarray(values[:, i]) for i, name in enumerate(entry["columns"])}
@@ -0,0 +1,212 @@
+"""
+Figure styling
+"""
+
+import os
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from . import cache
+from ._lazy import lazy_import
+
+mpl = lazy_import("matplotlib")
+texmanager = lazy_import("matplotlib.texmanager")
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' STYLE SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# sans-serif text used for all published figures
+rc_params = {
+    "font.family": "sans-serif",
+    "font.sans-serif": ["Helvetica", "Arial", "DejaVu Sans"],
+    "font.size": 14,
+}
+
+# text rendering backends, "mathtext" draws labels without a LaTeX install and
+# sets math in the text font like the sfmath package does for "latex"
+text_backends = {
+    "mathtext": {
+        "text.usetex": False,
+        "mathtext.fontset": "custom",
+        "mathtext.rm": "sans",
+        "mathtext.it": "sans:italic",
+        "mathtext.bf": "sans:bold",
+        "mathtext.sf": "sans",
+        "mathtext.cal": "sans",
+    },
+    "latex": {
+        "text.usetex": True,
+        "text.latex.preamble": r"\usepackage{sfmath}",
+    },
+}
+
+# rendered LaTeX labels are stored here, shared by all processes using py_figures.
+# None uses the "tex" folder of the parsed data cache (see cache.set_cache)
+tex_cache_dir = None
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' STYLE FUNCTIONS
+Functions in this section:
+    - style_params
+    - figure_style
+    - use_style
+    - set_tex_cache
+    - prerender_tex '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def style_params(text="mathtext", params=None):
+    '''
+    Collects the rcParams of the py_figures style
+
+    Parameters
+    ----------
+    text : str, optional
+        Text rendering backend, "mathtext" or "latex". The default is
+        "mathtext".
+    params : dict, optional
+        rcParams to change from the default style, e.g. {"font.size": 12}.
+        The default is None.
+
+    Returns
+    -------
+    style : dict
+        rcParams to apply
+
+    '''
+    if text not in text_backends:
+        raise ValueError("Unknown text backend: " + str(text))
+    if text == "latex":
+        set_tex_cache()
+
+    style = dict(rc_params)
+    style.update(text_backends[text])
+    if params is not None:
+        style.update(params)
+    return style
+
+#------------------------------------------------------------------------------
+@contextmanager
+def figure_style(params=None, text="mathtext"):
+    '''
+    Context manager applying the py_figures style
+
+    Text is rendered when a figure is drawn, so create and save figures
+    inside the same block:
+
+        with style.figure_style():
+            ax = XRD.single_fit(...)
+            XRD.save_fig(ax, path, fn)
+
+    Parameters
+    ----------
+    params : dict, optional
+        rcParams to change from the default style, e.g. {"font.size": 12}.
+        The default is None.
+    text : str, optional
+        Text rendering backend, "mathtext" or "latex". "latex" needs LaTeX
+        and dvipng installed and is much slower to draw. The default is
+        "mathtext".
+
+    Yields
+    ------
+    None
+
+    '''
+    with mpl.rc_context(style_params(text, params)):
+        yield
+
+#------------------------------------------------------------------------------
+def use_style(text="mathtext"):
+    '''
+    Applies the py_figures style globally, e.g. at the top of a notebook
+
+    Parameters
+    ----------
+    text : str, optional
+        Text rendering backend, "mathtext" or "latex". The default is
+        "mathtext".
+
+    Returns
+    -------
+    None
+
+    '''
+    mpl.rcParams.update(style_params(text))
+
+#------------------------------------------------------------------------------
+def set_tex_cache(path=None):
+    '''
+    Points matplotlib's LaTeX render cache at a py_figures directory
+
+    Rendered labels are stored by a hash of their LaTeX source, font size
+    and dpi and written atomically, so the directory can be shared by
+    parallel jobs and later sessions. Each label is then only run through
+    LaTeX and dvipng once.
+
+    Parameters
+    ----------
+    path : str, optional
+        Cache directory. The default is None (tex_cache_dir, or the "tex"
+        folder of the current cache.cache_dir if that is None).
+
+    Returns
+    -------
+    None
+
+    '''
+    global tex_cache_dir
+    if path is not None:
+        tex_cache_dir = path
+    path = tex_cache_dir if tex_cache_dir is not None else os.path.join(cache.cache_dir, "tex")
+    os.makedirs(path, exist_ok=True)
+
+    manager = texmanager.TexManager
+    if hasattr(manager, "_cache_dir"):
+        manager._cache_dir = Path(path)
+    else:
+        # matplotlib < 3.8
+        manager.texcache = path
+
+#------------------------------------------------------------------------------
+def prerender_tex(labels, fontsize=None, dpi=None, workers=None):
+    '''
+    Renders LaTeX labels into the render cache in parallel
+
+    Drawing a usetex figure runs LaTeX once per new label, one after the
+    other. Rendering the labels up front runs those processes side by side
+    so the draw only reads cached results. Call inside
+    figure_style(text="latex") so the preamble matches.
+
+    Parameters
+    ----------
+    labels : list (str)
+        Label strings, e.g. axis labels and tick labels
+    fontsize : float, optional
+        Font size in points. The default is None (font.size).
+    dpi : float, optional
+        Output resolution. The default is None (savefig.dpi).
+    workers : int, optional
+        Number of parallel LaTeX processes. The default is None (CPU count).
+
+    Returns
+    -------
+    None
+
+    '''
+    manager = texmanager.TexManager
+    if fontsize is None:
+        fontsize = mpl.rcParams["font.size"]
+    if dpi is None:
+        dpi = mpl.rcParams["savefig.dpi"]
+        if dpi == "figure":
+            dpi = mpl.rcParams["figure.dpi"]
+
+    manager()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda label: manager.make_png(label, fontsize, dpi), set(labels)))
@@ -0,0 +1,223 @@
+"""
+Streaming fit parameter series for long-term EIS tracking
+
+Parameter files are read once, as they appear, into a growable array with
+one row per cycle. Derived quantities are recalculated for all cycles at
+once, and plots are drawn from the array without re-reading earlier files.
+"""
+
+import numpy as np
+import os, re
+from . import EIS, readers
+from .circuit import param_names, full_params
+from .ragged import sort_order
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' TREND SETTINGS '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+# columns of a full parameter row, as written by circuit.export_fit
+column_names = param_names + ["sigma", "C"]
+
+# axis labels of each column
+column_labels = {"R0": "R$_0$ ($\\Omega$)", "R1": "R$_1$ ($\\Omega$)", "n1": "n$_1$",
+                 "Q1": "Q$_1$ (F s$^{n-1}$)", "R2": "R$_2$ ($\\Omega$)", "n2": "n$_2$",
+                 "Q2": "Q$_2$ (F s$^{n-1}$)", "sigma": "$\\sigma$ (S cm$^{-1}$)", "C": "C (F)"}
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' PARAMETER SERIES '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class ParamSeries:
+    '''
+    Fit parameters of one cell, updated as new _params.txt files appear
+
+    Parameters
+    ----------
+    path : str
+        File directory path
+    fn : str
+        File name, see readme for formatting information
+    cell_constant : float, optional
+        Thickness / area of the pellet in 1/cm, sigma is recalculated from
+        R1 when given. The default is None (sigma from the params files).
+    capacity : int, optional
+        Number of preallocated cycle rows, doubled when full. The default
+        is 64.
+
+    '''
+
+    def __init__(self, path, fn, cell_constant=None, capacity=64):
+        self.path = path
+        self.fn = fn
+        self.cell_constant = cell_constant
+        self.pattern = re.compile("^" + re.escape(fn) + r"_cycle(\d+)_params\.txt$")
+        self.num = 0
+        self.seen = set()
+        self._cycles = np.zeros(capacity, dtype=np.int64)
+        self._vals = np.full((capacity, len(column_names)), np.nan)
+
+    #--------------------------------------------------------------------------
+    def append(self, cycle, vals):
+        '''
+        Adds the parameters of one cycle
+
+        Parameters
+        ----------
+        cycle : int
+            Cycle number
+        vals : list (float)
+            Parameter values in params file order
+
+        Returns
+        -------
+        None
+
+        '''
+        vals = np.atleast_1d(np.asarray(vals, dtype=float))
+        if self.num == len(self._cycles):
+            grow = max(len(self._cycles), 1)
+            self._cycles = np.concatenate((self._cycles, np.zeros(grow, dtype=np.int64)))
+            self._vals = np.concatenate((self._vals, np.full((grow, self._vals.shape[1]), np.nan)))
+        if len(vals) > self._vals.shape[1]:
+            extra = np.full((len(self._vals), len(vals) - self._vals.shape[1]), np.nan)
+            self._vals = np.concatenate((self._vals, extra), axis=1)
+        self._cycles[self.num] = cycle
+        self._vals[self.num, :len(vals)] = vals
+        self.num += 1
+
+    #--------------------------------------------------------------------------
+    def update(self):
+        '''
+        Reads parameter files that appeared since the last update
+
+        A params file is only accepted once it ends with a line break and
+        holds at least one value per circuit parameter. Files still being
+        written parse cleanly into fewer values, so they are retried on the
+        next update.
+
+        Returns
+        -------
+        new : int
+            Number of cycles added
+
+        '''
+        found = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name in self.seen:
+                    continue
+                match = self.pattern.match(entry.name)
+                if match is not None:
+                    found.append((int(match.group(1)), entry.name, entry.path))
+
+        new = 0
+        for cycle, name, fp in sorted(found):
+            try:
+                vals = readers.read_columns(fp, skiprows=0, delimiter=" ")
+                with open(fp, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    complete = f.read(1) == b"\n"
+            except (OSError, ValueError):
+                continue
+            if not complete or np.size(vals) < len(param_names):
+                continue
+            self.append(cycle, vals)
+            self.seen.add(name)
+            new += 1
+        return new
+
+    #--------------------------------------------------------------------------
+    @property
+    def cycles(self):
+        '''
+        Cycle numbers, ascending
+        '''
+        cycles = self._cycles[:self.num]
+        order = sort_order(cycles)
+        return cycles if order is None else cycles[order]
+
+    #--------------------------------------------------------------------------
+    def values(self):
+        '''
+        Parameter rows ordered by cycle, with sigma and C recalculated
+
+        Returns
+        -------
+        param_vals : list (float)
+            R0, R1, n1, Q1, R2, n2, Q2, sigma, C, one row per cycle
+
+        '''
+        vals = self._vals[:self.num]
+        order = sort_order(self._cycles[:self.num])
+        if order is not None:
+            vals = vals[order]
+
+        derived = full_params(vals[:, :len(param_names)], self.cell_constant)
+        if self.cell_constant is None:
+            derived[:, len(param_names)] = vals[:, len(param_names)]
+        return derived
+
+    #--------------------------------------------------------------------------
+    def column(self, name):
+        '''
+        Values of one parameter ordered by cycle, see column_names
+        '''
+        return self.values()[:, column_names.index(name)]
+
+    #--------------------------------------------------------------------------
+    def plot_R(self, x_lim, y_lim, param="R1", color=False, marker=False):
+        '''
+        Plot a resistance vs cycle number with EIS.plot_R
+
+        Parameters
+        ----------
+        x_lim : list (float)
+            Tuple with x-axis minimum and maximum
+        y_lim : list (float)
+            Tuple with y-axis minimum and maximum
+        param : str, optional
+            Resistance to plot. The default is "R1".
+        color : str, optional
+            Hex code for data color, format "#000000". The default is False.
+        marker : str, optional
+            Plot marker shape. The default is False.
+
+        Returns
+        -------
+        ax : matplotlib axes
+            Plot of the resistance
+
+        '''
+        return EIS.plot_R(self.num, self.column(param), x_lim, y_lim, color, marker,
+                          cycles=self.cycles)
+
+    #--------------------------------------------------------------------------
+    def plot_trends(self, names=("R1", "R2", "n1", "sigma", "C"), color=False, marker=False):
+        '''
+        Plot several parameters vs cycle number with EIS.plot_param_trends
+
+        Parameters
+        ----------
+        names : list (str), optional
+            Parameters to plot, see column_names. The default is
+            ("R1", "R2", "n1", "sigma", "C").
+        color : str, optional
+            Hex code for data color, format "#000000". The default is False.
+        marker : str, optional
+            Plot marker shape. The default is False.
+
+        Returns
+        -------
+        ax : list (matplotlib axes)
+            One axes per parameter
+
+        '''
+        vals = self.values()[:, [column_names.index(n) for n in names]]
+        labels = [column_labels[n] for n in names]
+        return EIS.plot_param_trends(self.cycles, vals, labels, color, marker)
@@ -0,0 +1,354 @@
+"""
+Watch-folder mode for in-situ experiments
+
+New data files are picked up by polling a directory, only new or changed
+files are parsed and only figures depending on them are redrawn. Figures
+that only gained new datasets at the end are extended in place instead of
+being rebuilt.
+"""
+
+import numpy as np
+import os, re, time
+from . import export, readers
+from .XRD import import_dir, natural_key
+from ._lazy import lazy_import
+
+plt = lazy_import("matplotlib.pyplot")
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' FOLDER WATCHER '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class FolderWatcher:
+    '''
+    Polls a directory and keeps figures up to date with its files
+
+    Each figure depends on the files whose names match its pattern. Files
+    are grouped into items (e.g. one EIS cycle with its fit file) by the
+    first group of the pattern, and items are ordered by natural sort of
+    that group.
+
+    Parameters
+    ----------
+    path : str
+        Directory to watch
+    output_dir : str
+        Directory to write figures to
+    filetype : str, optional
+        File pattern passed to import_dir, e.g. "*.txt". The default is None.
+    interval : float, optional
+        Seconds between directory scans. The default is 1.0.
+    settle : float, optional
+        Files modified less than this many seconds ago are treated as still
+        being written and picked up by a later scan. The default is 0.5.
+    fmt : str, optional
+        Figure file format. The default is "png".
+    profile : str or float, optional
+        Export profile, see export.save_figure. The default is "screen".
+
+    '''
+
+    def __init__(self, path, output_dir, filetype=None, interval=1.0, settle=0.5,
+                 fmt="png", profile="screen"):
+        self.path = path
+        self.output_dir = output_dir
+        self.filetype = filetype
+        self.interval = interval
+        self.settle = settle
+        self.fmt = fmt
+        self.profile = profile
+        self.figures = {}
+        self.stats = {}
+        self.graph = {}
+
+    #--------------------------------------------------------------------------
+    def add_figure(self, name, pattern, parse, build, append=None):
+        '''
+        Registers a figure to keep up to date
+
+        Parameters
+        ----------
+        name : str
+            Figure name, also used as output file name
+        pattern : str
+            Regular expression matched against file names. The first group,
+            if any, is the item key, files with the same key form one item.
+        parse : function
+            Called with the sorted file paths of one item, returns its data
+        build : function
+            Called with the data of all items in order, returns the plot
+        append : function, optional
+            Called with the plot and the data of new items, returns the
+            updated plot. The default is None (always rebuild).
+
+        Returns
+        -------
+        None
+
+        '''
+        self.figures[name] = {"pattern": re.compile(pattern), "parse": parse,
+                              "build": build, "append": append, "files": {},
+                              "items": {}, "plot": None}
+        for fp in self.stats:
+            self._link(name, fp)
+
+    #--------------------------------------------------------------------------
+    def _link(self, name, fp):
+        '''
+        Adds a file to the dependency graph of a figure if its name matches
+        '''
+        match = self.figures[name]["pattern"].search(os.path.basename(fp))
+        if match is None:
+            return None
+        key = match.group(1) if match.re.groups > 0 else os.path.basename(fp)
+        self.graph.setdefault(fp, {})[name] = key
+        self.figures[name]["files"].setdefault(key, set()).add(fp)
+        return key
+
+    #--------------------------------------------------------------------------
+    def scan(self):
+        '''
+        Finds files that are new, changed or removed since the last scan
+
+        Returns
+        -------
+        changed : list (str)
+            New or modified file paths
+        removed : list (str)
+            Removed file paths
+
+        '''
+        now = time.time()
+        current = {}
+        for fp in import_dir(self.path, self.filetype):
+            try:
+                stat = os.stat(fp)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime < self.settle:
+                # still being written, keep the last state until it settles
+                if fp in self.stats:
+                    current[fp] = self.stats[fp]
+                continue
+            current[fp] = (stat.st_mtime_ns, stat.st_size)
+
+        changed = [fp for fp in current if self.stats.get(fp) != current[fp]]
+        removed = [fp for fp in self.stats if fp not in current]
+        for fp in removed:
+            del self.stats[fp]
+        for fp in changed:
+            if fp not in self.stats:
+                for name in self.figures:
+                    self._link(name, fp)
+            self.stats[fp] = current[fp]
+        return changed, removed
+
+    #--------------------------------------------------------------------------
+    def update(self):
+        '''
+        Scans the directory once and redraws the affected figures
+
+        Returns
+        -------
+        written : dict
+            Figure name mapped to (mode, latency): mode is "append" or
+            "rebuild", latency is the time in seconds from the newest changed
+            file modification to the figure being written
+
+        '''
+        changed, removed = self.scan()
+
+        # figure -> item keys touched by this scan
+        touched = {}
+        for fp in changed + removed:
+            for name, key in self.graph.get(fp, {}).items():
+                touched.setdefault(name, set()).add(key)
+        for fp in removed:
+            for name, key in self.graph.pop(fp, {}).items():
+                self.figures[name]["files"][key].discard(fp)
+        newest = max([self.stats[fp][0] for fp in changed] or [time.time_ns()]) / 1e9
+
+        written = {}
+        for name, keys in touched.items():
+            fig = self.figures[name]
+            items = fig["items"]
+            old_keys = sorted(items, key=natural_key)
+
+            # parse only the touched items
+            for key in keys:
+                files = sorted(fig["files"].get(key, ()))
+                if len(files) == 0:
+                    items.pop(key, None)
+                    fig["files"].pop(key, None)
+                else:
+                    items[key] = fig["parse"](files)
+            new_keys = sorted(items, key=natural_key)
+
+            is_tail = (len(old_keys) > 0 and new_keys[:len(old_keys)] == old_keys and
+                       keys.isdisjoint(old_keys))
+            if fig["plot"] is not None and fig["append"] is not None and is_tail:
+                try:
+                    fig["plot"] = fig["append"](fig["plot"], [items[k] for k in new_keys[len(old_keys):]])
+                    mode = "append"
+                except ValueError:
+                    mode = "rebuild"
+            else:
+                mode = "rebuild"
+
+            if mode == "rebuild":
+                if fig["plot"] is not None:
+                    plt.close(export.get_figure(fig["plot"]))
+                fig["plot"] = fig["build"]([items[k] for k in new_keys]) if len(new_keys) > 0 else None
+            if fig["plot"] is None:
+                continue
+
+            export.save_figure(fig["plot"], os.path.join(self.output_dir, ""), name,
+                               self.fmt, self.profile)
+            written[name] = (mode, time.time() - newest)
+
+        return written
+
+    #--------------------------------------------------------------------------
+    def run(self, duration=None, callback=None):
+        '''
+        Keeps figures up to date until interrupted
+
+        Parameters
+        ----------
+        duration : float, optional
+            Stop after this many seconds. The default is None (run until
+            KeyboardInterrupt).
+        callback : function, optional
+            Called with the result of each update that wrote figures. The
+            default is None.
+
+        Returns
+        -------
+        None
+
+        '''
+        start = time.perf_counter()
+        try:
+            while duration is None or time.perf_counter() - start < duration:
+                t0 = time.perf_counter()
+                written = self.update()
+                if callback is not None and len(written) > 0:
+                    callback(written)
+                time.sleep(max(self.interval - (time.perf_counter() - t0), 0))
+        except KeyboardInterrupt:
+            pass
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+''' FIGURE PRESETS
+Functions in this section:
+    - watch_multicycle
+    - watch_stack '''
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def watch_multicycle(watcher, name, fn, x_lim, start_hex=False, end_hex=False):
+    '''
+    Keeps an EIS.plot_multicycle figure up to date with new cycle files
+
+    Parameters
+    ----------
+    watcher : FolderWatcher
+        Watcher of the EIS data directory
+    name : str
+        Figure name
+    fn : str
+        File name, see readme for formatting information
+    x_lim : list (float)
+        Tuple with x-axis minimum and maximum
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+
+    Returns
+    -------
+    None
+
+    '''
+    from . import EIS
+
+    # each cycle is the data file and its fit file, either may arrive first
+    def parse(files):
+        data = {fp.endswith("_fit.txt"): readers.read_columns(fp, skiprows=1, delimiter=" ")
+                for fp in files}
+        expt = data.get(False, np.empty((2, 0)))
+        fit = data.get(True, np.empty((2, 0)))
+        return expt[0], expt[1], fit[0], fit[1]
+
+    def build(cycles):
+        cols = list(zip(*cycles))
+        return EIS.plot_multicycle(len(cycles), cols[0], cols[1], cols[2], cols[3], x_lim,
+                                   start_hex, end_hex)
+
+    def append(ax, cycles):
+        cols = list(zip(*cycles))
+        return EIS.append_cycles(ax, cols[0], cols[1], cols[2], cols[3], start_hex, end_hex)
+
+    pattern = "^" + re.escape(fn) + r"_cycle(\d+)(_fit)?\.txt$"
+    watcher.add_figure(name, pattern, parse, build, append)
+
+#------------------------------------------------------------------------------
+def watch_stack(watcher, name, pattern, x_lim, y_lim, spacing, header_rows=0,
+                start_hex=False, end_hex=False, isQ=True, Q_wl=None, heatmap=False):
+    '''
+    Keeps an XRD.stacked_single_plot figure up to date with new patterns
+
+    Parameters
+    ----------
+    watcher : FolderWatcher
+        Watcher of the pattern directory
+    name : str
+        Figure name
+    pattern : str
+        Regular expression matching pattern file names, e.g. r"scan_(\\d+)\\.xy"
+    x_lim : list (float)
+        Tuple with x-axis minimum and maximum
+    y_lim : list (float)
+        Tuple with y-axis minimum and maximum
+    spacing : float
+        Vertical spacing between datasets on plot
+    header_rows : int, optional
+        Number of rows of metadata at beginning of each file. The default is 0.
+    start_hex : str, optional
+        Hex code for initial gradient color, format "#000000". The default is False.
+    end_hex : str, optional
+        Hex code for final gradient color, format "#000000". The default is False.
+    isQ : bool, optional
+        Set to False if using units of 2theta. The default is True.
+    Q_wl : float, optional
+        Set instrument wavelength. The default is None.
+    heatmap : bool, optional
+        Set to True to draw an intensity map. The default is False.
+
+    Returns
+    -------
+    None
+
+    '''
+    from . import XRD
+
+    def parse(files):
+        data = readers.read_columns(files[0], skiprows=header_rows)
+        return data[0], data[1]
+
+    def build(patterns):
+        x_vals, y_vals = zip(*patterns)
+        return XRD.stacked_single_plot(x_lim, y_lim, len(patterns), x_vals, y_vals, spacing,
+                                       start_hex=start_hex, end_hex=end_hex, isQ=isQ, Q_wl=Q_wl,
+                                       heatmap=heatmap)
+
+    def append(ax, patterns):
+        x_vals, y_vals = zip(*patterns)
+        return XRD.append_stack(ax, x_vals, y_vals, spacing, start_hex, end_hex)
+
+    watcher.add_figure(name, pattern, parse, build, append)
@@ -7,5 +7,6 @@ setup(
    author='Sinclair R. Combs',
    author_email='sinclaircombs@mines.edu',
    packages=['py_figures'],
+   entry_points={'console_scripts': ['py_figures=py_figures.batch:main']},
    description='Python package for generate XRD, PDF, EIS, and CP plots'
 )
@@ -0,0 +1,22 @@
+"""
+Regression checks for the DRT solver
+"""
+
+import numpy as np
+from py_figures import DRT
+
+#------------------------------------------------------------------------------
+def test_nnls_gram_kkt():
+    rng = np.random.default_rng(0)
+    for i in range(100):
+        A = rng.standard_normal((40, 20))
+        # nearly collinear columns make new variables solve to s <= 0
+        A[:, 1] = A[:, 0] * (1 + 1e-9)
+        b = rng.standard_normal(40)
+        K, c = A.T @ A + 1e-8 * np.eye(20), A.T @ b
+        x = DRT.nnls_gram(K, c)
+        grad = K @ x - c
+        scale = np.abs(c).max()
+        assert np.isfinite(x).all() and (x >= 0).all()
+        assert (grad > -1e-8 * scale).all()
+        assert np.abs(grad[x > 0]).max(initial=0) < 1e-8 * scale
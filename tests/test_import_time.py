@@ -0,0 +1,64 @@
+"""
+Import time budget of the plotting modules
+
+Importing XRD, EIS, CP and PDF should take under 0.2 s, i.e. NumPy plus
+about 50 ms for py_figures itself, and must not import the plotting
+dependencies, which are loaded on first use (see _lazy.py).
+"""
+
+import subprocess, sys
+
+modules = ("py_figures.XRD", "py_figures.EIS", "py_figures.CP", "py_figures.PDF")
+
+# seconds, best of five runs
+total_budget = 0.2
+own_budget = 0.05
+
+# loaded on first use only
+lazy_modules = ("matplotlib", "pandas", "colour", "eclabfiles")
+
+#------------------------------------------------------------------------------
+def import_times():
+    '''
+    Imports the modules in a fresh interpreter with -X importtime
+
+    Returns
+    -------
+    total : float
+        Cumulative import time of the modules in s
+    numpy : float
+        Part of total spent importing NumPy in s
+    imported : list (str)
+        Names of all imported modules
+    '''
+    code = "import " + ", ".join(modules)
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                         capture_output=True, text=True, check=True).stderr
+    total = numpy = 0
+    imported = []
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = len(name) - len(name.lstrip()) - 1
+        name = name.strip()
+        imported.append(name)
+        if depth == 0 and name.startswith("py_figures"):
+            total += int(cumulative) / 1e6
+        if name == "numpy":
+            numpy = int(cumulative) / 1e6
+    return total, numpy, imported
+
+#------------------------------------------------------------------------------
+def test_import_time_budget():
+    runs = [import_times() for i in range(5)]
+    total = min(run[0] for run in runs)
+    own = min(run[0] - run[1] for run in runs)
+    imported = runs[0][2]
+    assert total < total_budget, "import took %.3f s" % total
+    assert own < own_budget, "py_figures import took %.3f s" % own
+
+    loaded = [m for m in imported if m.split(".")[0] in lazy_modules]
+    assert len(loaded) == 0, "imported at import time: " + ", ".join(loaded)
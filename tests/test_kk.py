@@ -0,0 +1,47 @@
+"""
+Regression checks for the Lin-KK test
+"""
+
+import numpy as np
+from py_figures import kk, circuit
+
+freq = np.logspace(6, -1, 60)
+
+# KK-valid by construction: ideal RC arcs, CPE arcs and a broad CPE arc
+# extending past the lowest frequency
+valid_params = [[5, 500, 1, 1e-8, 5000, 1, 4e-7],
+                [5, 500, 0.9, 1e-8, 5000, 0.85, 4e-7],
+                [10, 1000, 0.71, 1e-7, 2000, 0.75, 1e-5],
+                [1, 100, 0.6, 1e-6, 1e4, 0.65, 1e-4]]
+
+#------------------------------------------------------------------------------
+def test_valid_spectra_pass():
+    Z = circuit.circuit_impedance(valid_params, freq)
+    res_re, res_im, passed, num_rc = kk.kk_test(freq, Z.real, -Z.imag)
+    assert passed.all()
+    assert (num_rc <= kk.max_rc_ratio * len(freq)).all()
+
+#------------------------------------------------------------------------------
+def test_noisy_spectra_pass():
+    rng = np.random.default_rng(0)
+    Z = circuit.circuit_impedance(valid_params, freq)
+    Z = Z * (1 + 0.002 * rng.standard_normal(Z.shape))
+    passed = kk.kk_test(freq, Z.real, -Z.imag, threshold=0.02)[2]
+    assert passed.all()
+
+#------------------------------------------------------------------------------
+def test_distorted_spectrum_fails():
+    Z = circuit.circuit_impedance(valid_params[1], freq)
+    Z = Z.real + 1j * Z.imag * np.where(np.arange(len(freq)) >= 40, 0.5, 1)
+    res_re, res_im, passed, num_rc = kk.kk_test(freq, [Z.real], [-Z.imag])
+    assert not passed[0]
+    assert np.maximum(np.abs(res_re), np.abs(res_im)).max() > 0.02
+
+#------------------------------------------------------------------------------
+def test_fixed_num_rc_matches_lstsq():
+    Z = circuit.circuit_impedance(valid_params[1], freq)
+    coefs, Z_fit = kk.kk_fit(freq, Z, 12)
+    A = kk.kk_design(freq, 12)[0]
+    wgt = np.tile(1 / np.abs(Z), 2)
+    ref = np.linalg.lstsq(A * wgt[:, None], np.concatenate((Z.real, Z.imag)) * wgt, rcond=None)[0]
+    assert np.allclose(coefs[0], ref, rtol=1e-6, atol=1e-6 * np.abs(ref).max())